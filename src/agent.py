@@ -2,6 +2,7 @@ import os
 from os import linesep as newline
 import time
 import re
+import functools
 from enum import Enum
 
 import ptyprocess
@@ -33,7 +34,8 @@ from const import (local_command_timeout,
                    session_recover_retry,
                    session_prompt_retry,
                    session_prompt_retry_timeout,
-                   wait_passphrase_timeout)
+                   wait_passphrase_timeout,
+                   pattern_cache_size)
 
 # Default shell prompt for local host shell
 LOCAL_SHELL_PROMPT = '>>>'
@@ -75,6 +77,27 @@ intershell_info = {
                  'terminator': r"# {0,3}$"},
     }
 
+def output_matcher(expects=None, escapes=None):
+    """Get command output matcher for expects and escapes, with command error signatures."""
+    return _output_matcher(tuple(expects) if expects else (), tuple(escapes) if escapes else ())
+
+@functools.lru_cache(maxsize=pattern_cache_size)
+def _output_matcher(expects, escapes):
+    return utils.OutputMatcher(expects, escapes, command_errors)
+
+class CommandArgs(object):
+    """Command keyword arguments read as fields of a command record, fields
+    not given are None."""
+    def __init__(self, seqcmdargs):
+        self.__dict__.update(seqcmdargs)
+    
+    def __getattr__(self, name):
+        return None
+    
+    @property
+    def cmd_dict(self):
+        return self.__dict__
+
 class LoginCases(Enum):
     """Login cases enum for matching prompt cases while performing Pty connecting."""
     INPUT_WAIT_TIMEOUT = r".*timeout.*expired"                              # wait-input timeout, need to send a newline
@@ -87,13 +110,23 @@ class LoginCases(Enum):
 
 
 class UCSAgentWrapper(object):
-    """Basic UCS agent class."""
-    def __init__(self, command_timeout=local_command_timeout, local_prompt=local_shell_prompt, logfile=None):
+    """Basic UCS agent class. Methods doing pty I/O run agent steps, generators
+    in ``_*_steps`` methods yielding their I/O requests to _pump, this agent
+    does requests with blocking calls, AsyncUCSAgent awaits them."""
+    def __init__(self, command_timeout=local_command_timeout, local_prompt=local_shell_prompt, logfile=None,
+                 recorder=None, replay=None):
         global LOCAL_SHELL_PROMPT
         LOCAL_SHELL_PROMPT = local_prompt
         self.reset_agent()
         self.command_timeout = command_timeout
         self.logfile = logfile
+        # pty byte stream recorder and replay transport, see replay module
+        self.recorder = recorder
+        self.replay = replay
+        # timestamps and bytes read of last command, by run_cmd
+        self.cmd_stats = {}
+        # retries of commands failing with ErrorTryAgain, for the sequence of this agent
+        self.recover_retry = session_recover_retry
     
     def reset_agent(self):
         self.pty = None
@@ -109,6 +142,7 @@ class UCSAgentWrapper(object):
         self.command_timeout = local_command_timeout
         self.current_command = ''
         self.read_leftover = ''
+        self.read_stream = utils.StreamDecoder()
         self.session_info_chain = []
     
 #    def running_locally(self):
@@ -141,14 +175,53 @@ class UCSAgentWrapper(object):
     
     @property
     def running_locally(self):
+        return self._pump(self._running_locally_steps())
+    
+    def _running_locally_steps(self):
         if self.session_info_chain:
             if not self.pty or not self.pty.isalive() or self.pty.closed:
                 raise PtyProcessError('Pty Died Unexpectedly. Need Recovering.')
             return False
 
-        self.close_pty()
+        yield from self._close_pty_steps()
         return True
     
+    def _pump(self, steps):
+        """Run agent steps, a generator yielding I/O requests as (op, args...),
+        each request is done by _io and its result, or exception, is sent back
+        into steps. Value returned by steps is returned."""
+        result = error = None
+        while True:
+            try:
+                request = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                result = self._io(*request)
+            except BaseException as err:
+                error = err
+    
+    def _io(self, op, *args):
+        """Do I/O request of agent steps with blocking calls, requests are
+        ('wait', timeout): wait for pty readable, return True if it is,
+        ('read', delay): read all pty data available after delay,
+        ('sleep', seconds),
+        ('local', command, timeout): run local shell command, return (stdout, stderr),
+        ('close',): close pty process,
+        ('close_log',): flush and close log file."""
+        if op == 'wait': return self.pty.wait_readable(args[0])
+        if op == 'read': return self.pty.read_all_nonblocking(readafterdelay=args[0])
+        if op == 'sleep': return time.sleep(args[0])
+        if op == 'local': return local_run_cmd(args[0], timeout=args[1])
+        if op == 'close': return self.pty.close()
+        if op == 'close_log': return self._close_log()
+        raise ValueError('Unknown agent I/O request: %r' %(op))
+    
+    def _close_log(self):
+        self.logfile.flush()
+        self.logfile.close()
+    
     def _s_verify_termchar(self, s):
         return any(in_search(p, s[-prompt_offset_range:]) for p in PROMPT_WAIT_INPUT)
     
@@ -171,12 +244,14 @@ class UCSAgentWrapper(object):
                 wb = self.logfile.write(data)
                 byte_wrote += wb
                 data = data[wb:]
-            self.logfile.flush()
         return byte_wrote
     
     def set_pty_prompt(self, prompt=None, intershell=False):
+        return self._pump(self._set_pty_prompt_steps(prompt, intershell))
+    
+    def _set_pty_prompt_steps(self, prompt=None, intershell=False):
         if not prompt:
-            self.prompt = self.get_pty_prompt(intershell=intershell)
+            self.prompt = yield from self._get_pty_prompt_steps(intershell=intershell)
             if self.prompt == 'unknown_prompt':
                 raise ContextError('Entered unknown %s, check your command!' %('intershell' if intershell else 'shell'))
         else:
@@ -189,16 +264,14 @@ class UCSAgentWrapper(object):
 
         return self.prompt
     
-    def _connect(self, **seqcmdargs):
-        """Connect to new pty and update everything related with post validation."""
+    def _connect_target(self, seqcmdargs):
+        """Parse connect command, return (argv, command word, fixed command, target host,
+        session, serial port mode, remote connect, connect timeout)."""
         cmd = seqcmdargs['command']
         cmd_argv = utils.split_command_args(cmd)
         cmd_word = cmd_argv[0]
         fixed_cmd = ' '.join(cmd_argv)
         cmd_args = [x for x in cmd_argv[1:] if not (x.startswith('-') or '=' in x)]
-        login_user = seqcmdargs.get('user')
-        login_password = seqcmdargs.get('password')
-        do_boot_check = seqcmdargs.get('boot_expect') or seqcmdargs.get('boot_escape')
         # initialize host information
         target_host = self.host
         connect_session = cmd
@@ -219,18 +292,63 @@ class UCSAgentWrapper(object):
             telnet_port = int(cmd_args[1]) if 'telnet' in fixed_cmd and len(cmd_args) > 1 else -1
             connect_session = '%s %s' %(cmd_word, target_host) + (' %d' %(telnet_port) if telnet_port > 0 else '')
             if telnet_port >= base_serial_port: is_serial_port_mode = True
+        return (cmd_argv, cmd_word, fixed_cmd, target_host, connect_session,
+                is_serial_port_mode, do_remote_connect, connect_timeout)
+    
+    def _enter_session(self, target_host, session, user, password, prompt, serial_port_mode,
+                       cisco_sol_mode, command_timeout=None):
+        """Update agent for newly connected session and push it to session info chain."""
+        self.host = target_host
+        self.current_session = session
+        self.user = user
+        self.password = password
+        self.serial_port_mode = serial_port_mode
+        self.cisco_sol_mode = cisco_sol_mode
+        self.prompt = prompt
+        self.command_timeout = command_timeout if command_timeout else remote_command_timeout
+        session_info = {"target_host": self.host,
+                        "session": self.current_session,
+                        "user": self.user,
+                        "password": self.password,
+                        "prompt": self.prompt,
+                        "serial_port_mode": self.serial_port_mode,
+                        "cisco_sol_mode": self.cisco_sol_mode,
+                        "pty_linesep": self.pty_linesep,
+                        "command_timeout": self.command_timeout}
+        self.session_info_chain.append(session_info)
+    
+    def _restore_session(self):
+        """Revert agent to the last session of session info chain."""
+        self.prompt = self.session_info_chain[-1]['prompt']
+        self.user = self.session_info_chain[-1]['user']
+        self.password = self.session_info_chain[-1]['password']
+        self.host = self.session_info_chain[-1]['target_host']
+        self.current_session = self.session_info_chain[-1]['session']
+        self.serial_port_mode = self.session_info_chain[-1]['serial_port_mode']
+        self.cisco_sol_mode = self.session_info_chain[-1]['cisco_sol_mode']
+        self.pty_linesep = self.session_info_chain[-1]['pty_linesep']
+        self.command_timeout = self.session_info_chain[-1]['command_timeout']
+    
+    def _connect_steps(self, **seqcmdargs):
+        """Connect to new pty and update everything related with post validation."""
+        cmd = seqcmdargs['command']
+        (cmd_argv, cmd_word, fixed_cmd, target_host, connect_session,
+         is_serial_port_mode, do_remote_connect, connect_timeout) = self._connect_target(seqcmdargs)
+        login_user = seqcmdargs.get('user')
+        login_password = seqcmdargs.get('password')
+        do_boot_check = seqcmdargs.get('boot_expect') or seqcmdargs.get('boot_escape')
         # do session connecting with retry
         session_connected = False
         connect_retry = session_connect_retry
         while connect_retry > 0 and not session_connected:
-            if self.running_locally:
-                self.close_pty()
+            if (yield from self._running_locally_steps()):
+                yield from self._close_pty_steps()
                 self.log('%s %s' %(self.prompt, cmd) + newline)
-                self.pty = ptyprocess.PtyProcess.spawn(argv=cmd_argv)
+                self.pty = self.spawn_pty(cmd_argv)
             else:
-                if do_remote_connect and not self.pty_ping_host(target_host):
+                if do_remote_connect and not (yield from self._pty_ping_host_steps(target_host)):
                     raise ConnectionError('Host [%s] unaccessible from: %s' %(target_host, self.host))
-                self._ensure_send_line(fixed_cmd)
+                yield from self._ensure_send_line_steps(fixed_cmd)
             # handle login process
             # only remote connections will require login info
             if is_serial_port_mode or not do_remote_connect:
@@ -239,27 +357,27 @@ class UCSAgentWrapper(object):
             else:
                 nexts = PROMPT_WAIT_LOGIN
             while True:
-                out = self.read_until(nexts, connect_timeout, ignore_error=True)
+                out = yield from self._read_until_steps(nexts, connect_timeout, ignore_error=True)
                 # to avoid cases when remote system doesn't need password because of RSA key
                 #if 'ssh' in fixed_cmd and not login_password_sent:
                 #    append_out = self.read_until(PROMPT_WAIT_INPUT, 0.3, ignore_error=True)
                 #    if append_out.strip(): out = append_out
                 # match out read with cases
                 if in_search(LoginCases.INPUT_WAIT_TIMEOUT.value, out):
-                    self._ensure_send_line()
+                    yield from self._ensure_send_line_steps()
 
                 elif in_search(LoginCases.RSA_KEY_CORRUPTED.value, out.lower()):
-                    self.pty_rm_known_hosts()
+                    yield from self._pty_rm_known_hosts_steps()
                     break
 
                 elif in_search(LoginCases.INPUT_WAIT_YES_NO.value, out):
-                    self._ensure_send_line('yes')
+                    yield from self._ensure_send_line_steps('yes')
 
                 elif in_search(LoginCases.INPUT_WAIT_USERNAME.value, out):
                     if login_user:
-                        self._ensure_send_line(login_user)
+                        yield from self._ensure_send_line_steps(login_user)
                     elif login_password:
-                        self._ensure_send_line(login_password)
+                        yield from self._ensure_send_line_steps(login_password)
                         login_user, login_password = login_password, login_user
 
                     else: raise ConnectionError('Need login info to %s: %s' %(cmd_word, target_host))
@@ -267,9 +385,9 @@ class UCSAgentWrapper(object):
 
                 elif in_search(LoginCases.INPUT_WAIT_PASSWORD.value, out):
                     if login_password:
-                        self._ensure_send_line(login_password, text_visible=False)
+                        yield from self._ensure_send_line_steps(login_password, text_visible=False)
                     elif login_user:
-                        self._ensure_send_line(login_user, text_visible=False)
+                        yield from self._ensure_send_line_steps(login_user, text_visible=False)
                         login_user, login_password = login_password, login_user
 
                     else: raise ConnectionError('Need login info to %s: %s' %(cmd_word, target_host))
@@ -288,7 +406,7 @@ class UCSAgentWrapper(object):
                             t_end_watch = time.time() + bootup_watch_timeout
                             while time.time() <= t_end_watch:
                                 self._send_all('\r\n')
-                                boot_stream = self.read_until(PROMPT_WAIT_INPUT, bootup_watch_period, ignore_error=True)
+                                boot_stream = yield from self._read_until_steps(PROMPT_WAIT_INPUT, bootup_watch_period, ignore_error=True)
                                 if do_boot_check: out = out + boot_stream
                                 if boot_stream and boot_stream.count('\n') in (1, 2) and self._s_verify_termchar(boot_stream):
                                     session_connected = True
@@ -301,23 +419,20 @@ class UCSAgentWrapper(object):
             # Connected Successfully
             # Set pty linesep for new session
             if do_boot_check:
-                exp_raise = self._expect(out, seqcmdargs.get('boot_expect'))
-                esc_raise = self._escape(out, seqcmdargs.get('boot_escape'))
-                if exp_raise or esc_raise:
-                    raise ExpectError('Expect failure found while booting: %r' \
-                                      %(seqcmdargs.get('boot_expect') if exp_raise else seqcmdargs.get('boot_escape')))
+                matcher = output_matcher(seqcmdargs.get('boot_expect'), seqcmdargs.get('boot_escape'))
+                self._check_expects(out, matcher, 'Expect failure found while booting')
             prompt_read = prompt_read_prev = None
             retry = session_prompt_retry
             while retry > 0:
-                self.flush()
+                yield from self._flush_steps()
                 self._send_all('\r\n')
-                s = self.read_until(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
+                s = yield from self._read_until_steps(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
                 if s and s.count('\n') in (1,2) and self._s_verify_termchar(s):
                     if s.count('\n') == 2: self.pty_linesep = '\n'
                     else: self.pty_linesep = '\r\n'
-                    self.flush(delaybeforeflush=0.1)
-                    self._ensure_send_line()
-                    prompt_line = self.read_until(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
+                    yield from self._flush_steps(delaybeforeflush=0.1)
+                    yield from self._ensure_send_line_steps()
+                    prompt_line = yield from self._read_until_steps(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
                     if prompt_line and prompt_line.count('\n') == 1: # do postly verify
                         prompt_read_prev = utils.get_prompt_line(prompt_line)
                         if 'telnet' in fixed_cmd: prompt_read_prev = utils.prompt_strip_date(prompt_read_prev)
@@ -328,9 +443,9 @@ class UCSAgentWrapper(object):
             # Set pty prompt for new session
             retry = session_prompt_retry
             while retry > 0:
-                self.flush(delaybeforeflush=delay_before_prompt_flush)
-                self._ensure_send_line()
-                s = self.read_until(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
+                yield from self._flush_steps(delaybeforeflush=delay_before_prompt_flush)
+                yield from self._ensure_send_line_steps()
+                s = yield from self._read_until_steps(PROMPT_WAIT_INPUT, session_prompt_retry_timeout, ignore_error=True)
                 prompt_info = utils.get_prompt_line(s)
                 # Strip dynamic datetime part of prompt for telnet session
                 if 'telnet' in fixed_cmd: prompt_info = utils.prompt_strip_date(prompt_info)
@@ -348,29 +463,20 @@ class UCSAgentWrapper(object):
             if retry == 0: raise ConnectionError('Pty set prompt failed in new session: %s, [%s, %s]'
                                                  %(connect_session, s, prompt_read))
             # Update agent
-            self.host = target_host
-            self.current_session = connect_session
-            self.user = login_user
-            self.password = login_password
-            self.serial_port_mode = is_serial_port_mode
-            self.cisco_sol_mode = is_cisco_sol_mode
-            self.prompt = prompt_read
-            self.command_timeout = seqcmdargs['command_timeout'] if seqcmdargs.get('command_timeout') else remote_command_timeout
-            session_info = {"target_host": self.host,
-                            "session": self.current_session,
-                            "user": self.user,
-                            "password": self.password,
-                            "prompt": self.prompt,
-                            "serial_port_mode": self.serial_port_mode,
-                            "cisco_sol_mode": self.cisco_sol_mode,
-                            "pty_linesep": self.pty_linesep,
-                            "command_timeout": self.command_timeout}
-            self.session_info_chain.append(session_info)
-
+            self._enter_session(target_host, connect_session, login_user, login_password, prompt_read,
+                                is_serial_port_mode, is_cisco_sol_mode, seqcmdargs.get('command_timeout'))
             return True
         # Connect Failed
         raise ConnectionError('%s to %s failed with 3 retry' %(cmd_word, target_host))
     
+    def spawn_pty(self, argv):
+        """Spawn pty process for local connect command, with replay transport,
+        recorded session is replayed instead."""
+        if self.replay: argv = self.replay.argv(argv)
+        pty = ptyprocess.PtyProcess.spawn(argv=argv)
+        if self.recorder: self.recorder.attach(pty, argv)
+        return pty
+    
     def _trigger_intershell(self, cmd):
         was_intershell = self.intershell
         if self.session_info_chain:
@@ -437,26 +543,30 @@ class UCSAgentWrapper(object):
 #        line = line + self.pty_linesep
 #        return self._send_all(line)
     
-    def _ensure_send_line(self, text='', text_visible=True):
+    def _ensure_send_line_steps(self, text='', text_visible=True):
         "Send text with linesep fixed as well as readback check to pty process."
         text = text.rstrip()
-        self.flush()
+        yield from self._flush_steps()
         sent = self._send_all(text)
         if text and text_visible:
             try:
-                self.read_until(text, self.command_timeout//4, match_method=utils.ucs_output_search_command)
+                yield from self._read_until_steps(text, self.command_timeout//4, match_method=utils.ucs_output_search_command)
+                self.cmd_stats['echo'] = time.time()
             except TimeoutError as senderr:
                 # In some very occasional cases, command was not completely sent, while script
                 # doesn't know that, then this output will be a substring of the sending command,
                 # like, command: run UPI DISPLAY-CONFIGURATION, output: run UPI DIS
                 # A TimeoutError will be raised here, but the process is good to continue
                 comp = utils.ucs_fuzzy_complement(senderr.output, text)
-                if comp: return self._ensure_send_line(text=comp, text_visible=text_visible)
+                if comp: return (yield from self._ensure_send_line_steps(text=comp, text_visible=text_visible))
 
         self._send_all(self.pty_linesep)
         return True if sent == len(text) else False
     
     def send_control(self, char):
+        return self._pump(self._send_control_steps(char))
+    
+    def _send_control_steps(self, char):
         out = None
         if len(char) > 1:
             out = self.pty.sendcontrol(char[0])
@@ -465,138 +575,201 @@ class UCSAgentWrapper(object):
             out = self.pty.sendcontrol(char)
             if char.lower() == 'c':
                 #self._send_line()
-                self.read_until(self.prompt, send_intr_timeout, ignore_error=True)
+                yield from self._read_until_steps(self.prompt, send_intr_timeout, ignore_error=True)
         return out
     
+    def _read_pty(self, count=False):
+        """Drain pty into its receive buffer, decode and strip all buffered bytes
+        through read stream, then release them. With count, bytes are counted
+        as command output, command echo is read without."""
+        self.pty.fill_available()
+        with self.pty.recv_buffer.peek() as view:
+            chunk = self.read_stream.feed(view)
+            if count: self._count_output(len(view))
+        self.pty.recv_buffer.consume()
+        return chunk
+    
+    def _count_output(self, size):
+        """Count command output bytes, time of first output byte after echo is kept."""
+        if not size: return
+        self.cmd_stats.setdefault('first_byte', time.time())
+        self.cmd_stats['bytes'] = self.cmd_stats.get('bytes', 0) + size
+    
     def flush(self, delaybeforeflush=0.0, close_handler=False):
+        return self._pump(self._flush_steps(delaybeforeflush, close_handler))
+    
+    def _flush_steps(self, delaybeforeflush=0.0, close_handler=False):
         if self.pty:
-            out = self.read_leftover + self._str(self.pty.read_all_nonblocking(readafterdelay=delaybeforeflush))
+            out = self.read_leftover + self.read_stream.feed((yield ('read', delaybeforeflush)))
             self.read_leftover = ''
-            if out: out = utils.strip_ansi_escape(out)
             self.log(out)
 
         if close_handler:
             if self.logfile and not self.logfile.closed:
-                self.logfile.flush()
-                self.logfile.close()
+                yield ('close_log',)
     
-    def _expect(self, out, expect):
-        """Expect each item in expect list, return False only if all items are found."""
-        if not expect or not out: return False
-
-        expects = expect if isinstance(expect, type([])) else [expect,]
-        do_raise = False
-
-        for exp in expects:
-            pos = in_search(exp, out, do_find=True)
-            if pos < 0:
-                do_raise = True
-                break
-            out = out[pos+len(exp):]
-
-        return do_raise
+    def _match_target(self, out, matcher):
+        """Get buffer, matcher and bounded excerpt for matching output, spilled
+        output capture is matched over its mmap with binary matcher."""
+        if isinstance(out, utils.OutputCapture):
+            if out.spilled: return out.buffer(), matcher.binary(), out.excerpt()
+            out = out.buffer()
+        return out, matcher, utils.output_excerpt(out)
     
-    def _escape(self, out, escape):
-        """Escape each item in escape list, return False if any of items is found."""
-        if not escape or not out: return False
-
-        escapes = escape if isinstance(escape, type([])) else [escape,]
-        do_raise = False
-
-        for esc in escapes:
-            if in_search(esc, out):
-                do_raise = True
-                break
-
-        return do_raise
+    def _check_expects(self, out, matcher, emsg='Expect failure found inside expects'):
+        """Raise ExpectError if any expect is missing or any escape is found in output,
+        error message points at the output line where the failure is found."""
+        if not len(out): return
+        buf, matcher, excerpt = self._match_target(out, matcher)
+        missing = matcher.find_missing_expect(buf)
+        if missing is not None:
+            emsg = '%s: %r, %r not found after output line %d' \
+                %(emsg, matcher.expects, missing.pattern, utils.line_number(buf, missing.start))
+        else:
+            escaped = matcher.find_escape(buf)
+            if escaped is None: return
+            emsg = '%s: %r, %r found at output line %d' \
+                %(emsg, matcher.escapes, escaped.pattern, utils.line_number(buf, escaped.start))
+        raise ExpectError(emsg, prompt=self.prompt, output=excerpt)
     
-    def atomic_read(self, timeout=None, do_expect=True):
+    def atomic_read(self, timeout=None, do_expect=True, fail_fast_matcher=None):
         """Atomically read command output without waiting for certain timeout,
-        this method will return instantly when commands execution complete."""
-        data_rd = ''
+        this method will return instantly when commands execution complete.
+        Output is returned in an OutputCapture, which spills to disk for large
+        outputs, caller should close it after use.
+        With fail_fast_matcher, escapes are checked while output streams in,
+        command is interrupted and ExpectError is raised once an escape is found."""
+        return self._pump(self._atomic_read_steps(timeout, do_expect, fail_fast_matcher))
+    
+    def _atomic_read_steps(self, timeout=None, do_expect=True, fail_fast_matcher=None):
+        capture = utils.OutputCapture()
         read_completed = True
-        time_interval = 0.03
-        size_interval = 1024
         if timeout is None: timeout = self.command_timeout
 
         if timeout > 0:
-            data_rd = self.read_leftover
+            # output read with command echo already
+            self._count_output(len(self.read_leftover))
+            capture.write(self.read_leftover)
             self.read_leftover = ''
             t_end_read = time.time() + timeout
+            t_complement = t_end_read - timeout*0.6
             read_completed = False
             linesep_complemented = False
-            while time.time() <= t_end_read:
-                chunk = self._str(self.pty.read_nonblocking(size_interval))
-                data_rd = data_rd + chunk
-                if do_expect and not chunk and data_rd:
-                    # strip all ANSI escape characters first
-                    data_rd = utils.strip_ansi_escape(data_rd)
+            tail_size = len(self.prompt) + prompt_offset_range
+            epos = 0
+            watcher = utils.EscapeWatcher(fail_fast_matcher) if fail_fast_matcher else None
+            escaped = None
+            while True:
+                t_now = time.time()
+                if t_now > t_end_read: break
+                # block on pty readiness, wake up earlier for linesep complement if nothing read yet
+                t_wait = t_end_read - t_now
+                if not linesep_complemented and not capture and t_now <= t_complement:
+                    t_wait = t_complement - t_now
+                if (yield ('wait', t_wait)):
+                    chunk = self._read_pty(count=True)
+                    if chunk: capture.write(chunk)
+                    elif self.pty.eof(): break
+                    if chunk and watcher:
+                        escaped = watcher.feed(chunk)
+                        if escaped: break
+                if do_expect and capture and not (yield ('wait', 0)):
                     # match shell prompt to check if command execution ends
-                    s = data_rd[-(len(self.prompt)+prompt_offset_range):]
+                    s = capture.tail[-tail_size:]
                     spos = in_search(self.prompt, s, do_find=True)
                     if spos >= 0:
                         epos = utils.reversed_find_term(spos, self.prompt, s)
-                        if epos < 0:
-                            self.read_leftover = data_rd[epos:]
-                            data_rd = data_rd[:epos]
                         read_completed = True
+                        self.cmd_stats['prompt'] = time.time()
                         break
-                elif not linesep_complemented and not data_rd and time.time() > (t_end_read-timeout*0.6):
+                elif not linesep_complemented and not capture and time.time() > t_complement:
                     # only two exceptional cases will make process reach here as below,
                     # 1. invisible text isn't correctly sent, eg, passphrases
                     # 2. the final linesep of command text isn't successfully sent
                     self._send_all(self.pty_linesep)
                     linesep_complemented = True
-                time.sleep(time_interval)
 
-            self.log(data_rd)
+            self.read_leftover = capture.truncate(-epos)
+            for text in capture.iter_text(): self.log(text)
+            if escaped:
+                # fail fast, interrupt running command and drop its left output
+                yield from self._send_control_steps('c')
+                yield from self._flush_steps()
+                excerpt = capture.excerpt()
+                capture.close()
+                raise ExpectError('Expect failure found while command running: %r, %r found at output line %d'
+                                  %(fail_fast_matcher.escapes, escaped[0].pattern, escaped[1]),
+                                  prompt=self.prompt,
+                                  output=excerpt)
             # in very occasional cases, the Pty connection dies unnaturally when performing reading,
             # in this case, nothing will be returned and also shell prompt won't be reached.
-            if do_expect and not read_completed and not self.running_locally:
+            if do_expect and not read_completed and not (yield from self._running_locally_steps()):
+                excerpt = capture.excerpt()
+                capture.close()
                 raise TimeoutError('Command exceeded time limit: %r sec' %(timeout),
                                    prompt=self.prompt,
-                                   output=data_rd)
-        return data_rd
+                                   output=excerpt)
+        return capture
     
-    def check_cmd_output(self, out):
+    def check_cmd_output(self, out, matcher=None):
         """Check command output, check if command was successfully sent before and if command is valid."""
         cmd_word = utils.get_command_word(self.current_command)
-        if cmd_word not in error_bypass_commands and any(e in out.lower() for e in command_errors):
-            raise ErrorTryAgain('Invalid command in host: %s' %(self.host), output=out)
+        if cmd_word in error_bypass_commands: return
+        buf, matcher, excerpt = self._match_target(out, matcher or output_matcher())
+        error = matcher.find_error(buf)
+        if error is not None:
+            raise ErrorTryAgain('Invalid command in host: %s, %r found at output line %d'
+                                %(self.host, error.pattern, utils.line_number(buf, error.start)), output=excerpt)
     
     def read_until(self, until, timeout, ignore_error=False, match_method=in_search):
         """Read certain bytes within certain time interval once a time from 
         current pty process, until the 'until' string is found, timeout is
-        limited in case of infinite loop."""
-        data_rd = ''
+        limited in case of infinite loop. Output is kept in an OutputCapture,
+        each chunk is matched on a window from the last incomplete line, so the
+        whole output is not rematched as it grows."""
+        return self._pump(self._read_until_steps(until, timeout, ignore_error, match_method))
+    
+    def _read_until_steps(self, until, timeout, ignore_error=False, match_method=in_search):
+        capture = utils.OutputCapture()
         expected = True
-        t_interval = 0.03
-        s_interval = 1024
         if timeout > 0 and until:
             untils = until if isinstance(until, type([])) else (until,)
-            data_rd = self.read_leftover
+            # only output later chunks can still match is rematched, from the
+            # last incomplete line and as many lines before as patterns span
+            lines = max(ut.count('\n') + ut.count('\\n') for ut in untils)
+            window = self.read_leftover
+            capture.write(self.read_leftover)
             self.read_leftover = ''
             t_end_rd = time.time() + timeout
             expected = False
-            while time.time() <= t_end_rd:
-                chunk = self._str(self.pty.read_nonblocking(s_interval))
+            while True:
+                t_wait = t_end_rd - time.time()
+                if t_wait < 0 or not (yield ('wait', t_wait)): break
+                chunk = self._read_pty()
+                if not chunk and self.pty.eof(): break
                 if chunk:
-                    data_rd = utils.strip_ansi_escape(data_rd + chunk)
+                    capture.write(chunk)
+                    window = window + chunk
                     for ut in untils:
-                        if match_method(ut, data_rd):
+                        if match_method(ut, window):
                             expected = True
                             break
+                    window = utils.search_window(window, lines)
                 if expected: break
-                time.sleep(t_interval)
 
-            self.log(data_rd)
+            for text in capture.iter_text(): self.log(text)
             # in very occasional cases, the Pty connection dies unnaturally when performing reading,
             # in this case, nothing will be returned and also shell prompt won't be reached.
-            if not ignore_error and not expected and not self.running_locally:
+            if not ignore_error and not expected and not (yield from self._running_locally_steps()):
+                excerpt = capture.excerpt()
+                capture.close()
                 raise TimeoutError('No %r found within timeout: %r' %(untils, timeout),
                                    prompt=self.prompt,
-                                   output=data_rd)
-        return data_rd
+                                   output=excerpt)
+        try:
+            return capture.value()
+        finally:
+            capture.close()
     
     def read_expect(self, timeout=None, **kwargs):
         """Read with expect strings within certain time amount[timeout], this method is 
@@ -604,79 +777,82 @@ class UCSAgentWrapper(object):
         wait for each test item to complete within given time amount, and meanwhile,
         expect a list which contains specific patterns that you want to check if the test item's 
         output involve these patterns or doesn't involve[called escape here] sequentially."""
+        return self._pump(self._read_expect_steps(timeout, **kwargs))
+    
+    def _read_expect_steps(self, timeout=None, **kwargs):
         if not timeout: timeout = self.command_timeout
 
-        expects = kwargs.get('expect')
-        escapes = kwargs.get('escape')
+        matcher = kwargs.get('matcher') or output_matcher(kwargs.get('expect'), kwargs.get('escape'))
         # read stream without wait
-        out = self.atomic_read(timeout=timeout)
-        # check command output
-        self.check_cmd_output(out)
-
-        exp_raise = self._expect(out, expects)
-        esc_raise = self._escape(out, escapes)
-        if exp_raise or esc_raise:
-            raise ExpectError('Expect failure found inside expects: %r' %(expects if exp_raise else escapes),
-                              prompt=self.prompt,
-                              output=out)
-        return out
+        capture = yield from self._atomic_read_steps(timeout=timeout, fail_fast_matcher=matcher if kwargs.get('fail_fast') else None)
+        try:
+            # check command output
+            self.check_cmd_output(capture, matcher)
+            self._check_expects(capture, matcher)
+            return capture.value()
+        finally:
+            capture.close()
     
     def run_cmd(self, **seqcmdargs):
+        """Run command given as keyword arguments, see run_command."""
+        return self._pump(self._run_command_steps(CommandArgs(seqcmdargs)))
+    
+    def run_command(self, command):
         """Run commands sequentially and update Pty connection status as well as Pty shell status,
-        eg, connecting to new pty and update shell information."""
+        eg, connecting to new pty and update shell information. Command is a command record of
+        builtin module, its fields are read as attributes."""
+        return self._pump(self._run_command_steps(command))
+    
+    def _run_command_steps(self, command):
+        self.cmd_stats = {'start': time.time()}
         # Do connecting first
-        if seqcmdargs.get('action') == 'CONNECT': return self._connect(**seqcmdargs)
+        if command.action == 'CONNECT': return (yield from self._connect_steps(**command.cmd_dict))
         # Handle other commands
-        cmd = seqcmdargs['command']
-        timeout = seqcmdargs.get('timeout')
-        expects = seqcmdargs.get('expect')
-        escapes = seqcmdargs.get('escape')
+        cmd = command.command
+        timeout = command.timeout
+        expects = command.expect
+        matcher = command.matcher or output_matcher(expects, command.escape)
         out = ''
         # Process Local Commands
-        if self.running_locally:
+        if (yield from self._running_locally_steps()):
             self.log('%s %s' %(self.prompt, cmd) + newline)
-            out, err = local_run_cmd(cmd, timeout=timeout)
+            out, err = yield ('local', cmd, timeout)
             self.log('%s %s' %(self.prompt, out) + newline)
             self.log('%s %s' %(self.prompt, err) + newline)
+            self.cmd_stats['bytes'] = len(out) + len(err)
 
-            exp_raise = self._expect(out, expects)
-            esc_raise = self._escape(out, escapes)
-            if exp_raise or esc_raise:
-                raise ExpectError('Expect failure found inside expects: %r' %(expects if exp_raise else escapes),
-                                  prompt=self.prompt,
-                                  output=out)
+            self._check_expects(out, matcher)
         # Process Remote Commands
         else:
             # send command text with ensure read check
-            self._ensure_send_line(cmd, text_visible=(not seqcmdargs.get('text_invisible')))
+            yield from self._ensure_send_line_steps(cmd, text_visible=(not command.text_invisible))
             # Handling commands which reset pty shell prompt
             prompt_set_filter = [utils.get_command_word(cmd) == 'cd',
                                  self._trigger_intershell(cmd),
-                                 seqcmdargs.get('action') == 'FIND',]
+                                 command.action == 'FIND',]
             if any(prompt_set_filter):
-                return self.set_pty_prompt(intershell=prompt_set_filter[1])
+                return (yield from self._set_pty_prompt_steps(intershell=prompt_set_filter[1]))
             # Handling case of running background commands
-            if seqcmdargs.get('bg_run') is True:
-                time.sleep(timeout if timeout and timeout > 0 else 0)
+            if command.bg_run is True:
+                yield ('sleep', timeout if timeout and timeout > 0 else 0)
                 timeout = 0  # reset timeout since we have done wait here
-                self._ensure_send_line()
+                yield from self._ensure_send_line_steps()
             # Capturing and checking command output
             self.current_command = cmd
-            if seqcmdargs.get('command_wait_passphrase'):
+            if command.command_wait_passphrase:
                 try:
-                    out = self.read_until(expects, wait_passphrase_timeout)
+                    out = yield from self._read_until_steps(expects, wait_passphrase_timeout)
                 except TimeoutError as err:
                     raise InvalidCommand("Passphrase input doesn't reach: %r" %(expects), output=err.output)
             else:
                 try:
-                    out = self.read_expect(timeout=timeout, expect=expects, escape=escapes)
+                    out = yield from self._read_expect_steps(timeout=timeout, matcher=matcher, fail_fast=command.fail_fast)
                 except ErrorTryAgain as err:
-                    global session_recover_retry
-                    if seqcmdargs.get('text_invisible') or session_recover_retry == 0:
+                    if command.text_invisible or self.recover_retry == 0:
                         raise InvalidCommand('Invalid command in host: %s' %(self.host), output=err.output)
                     else:
-                        session_recover_retry -= 1
-                        return self.run_cmd(**seqcmdargs)
+                        self.recover_retry -= 1
+                        return (yield from self._run_command_steps(command))
                 except:
                     raise
 
@@ -720,13 +896,16 @@ class UCSAgentWrapper(object):
     
     def get_pty_current_host(self):
         """Get current host IP information using Linux command, only works in Linux pty."""
-        if self.running_locally: return 'localhost'
+        return self._pump(self._get_pty_current_host_steps())
+    
+    def _get_pty_current_host_steps(self):
+        if (yield from self._running_locally_steps()): return 'localhost'
         out = 'unknown_host'
         try:
-            self.flush()
+            yield from self._flush_steps()
             host_check_cmd = "ifconfig | awk '/inet addr/{print substr($2,6)}'"
-            out = self.run_cmd(command=host_check_cmd)
-        except:
+            out = yield from self._run_command_steps(CommandArgs({'command': host_check_cmd}))
+        except Exception:
             pass
         return out
     
@@ -734,19 +913,23 @@ class UCSAgentWrapper(object):
         """Get current pty shell prompt string with post validation, this method is usually used in setting
         new pty prompt string after some prompt-impacted command is issued, like cd/FS0[in Uefi shell]/images
         to start a internal interactive shell[intershell], like tftp, etc."""
-        if self.running_locally: return LOCAL_SHELL_PROMPT
+        return self._pump(self._get_pty_prompt_steps(intershell))
+    
+    def _get_pty_prompt_steps(self, intershell=False):
+        if (yield from self._running_locally_steps()): return LOCAL_SHELL_PROMPT
 
         if intershell:
             wait = intershell_info[self.current_session]['init_wait']
-            time.sleep(wait if wait > 0 else 0)
+            yield ('sleep', wait if wait > 0 else 0)
 
         prompt1 = prompt2 = None
         nexts = [intershell_info[self.current_session]['terminator'],] if intershell else PROMPT_WAIT_INPUT
         retry = session_prompt_retry
+        self.cmd_stats.setdefault('prompt_retries', 0)
         while retry > 0:
-            self.flush(delaybeforeflush=delay_before_prompt_flush)
-            self._ensure_send_line()
-            s = self.read_until(nexts, session_prompt_retry_timeout, ignore_error=True)
+            yield from self._flush_steps(delaybeforeflush=delay_before_prompt_flush)
+            yield from self._ensure_send_line_steps()
+            s = yield from self._read_until_steps(nexts, session_prompt_retry_timeout, ignore_error=True)
             prompt_info = utils.get_prompt_line(s)
             # This is to skip time print, [Mon Apr 13 17:34:58 root@UCSC-C240-M6SX-WZP23350BLA:/]$
             if 'telnet' in self.current_session: prompt_info = utils.prompt_strip_date(prompt_info)
@@ -763,124 +946,136 @@ class UCSAgentWrapper(object):
                     prompt1 = prompt2
                     prompt2 = None
             retry -= 1
+            self.cmd_stats['prompt_retries'] += 1
 
         return 'unknown_prompt'
     
     def pty_ping_host(self, host):
         """Ping target host from current host, and check if network is accessible. This method is usually used
         before connecting to target machine."""
-        self.flush()
+        return self._pump(self._pty_ping_host_steps(host))
+    
+    def _pty_ping_host_steps(self, host):
+        yield from self._flush_steps()
         ping_cmd = 'ping -c 2 ' + host
         out = ''
         try:
-            out = self.run_cmd(command=ping_cmd, timeout=host_ping_timeout)
+            out = yield from self._run_command_steps(CommandArgs({'command': ping_cmd, 'timeout': host_ping_timeout}))
         except TimeoutError:
-            self.send_control('c')
+            yield from self._send_control_steps('c')
 
         return True if ('seq' in out and 'ttl' in out and 'time' in out) or 'alive' in out else False
     
     def pty_rm_known_hosts(self):
         """Remove corrupt ssh host file while corrput ssh connection warning is detected."""
+        return self._pump(self._pty_rm_known_hosts_steps())
+    
+    def _pty_rm_known_hosts_steps(self):
         rm_known_hosts_cmd = 'rm -f ~/.ssh/known_hosts'
         try:
-            self.flush()
-            self.run_cmd(command=rm_known_hosts_cmd)
-        except:
+            yield from self._flush_steps()
+            yield from self._run_command_steps(CommandArgs({'command': rm_known_hosts_cmd}))
+        except Exception:
             pass
     
     def pty_pulse_session(self):
         """Emit a infinite pulse loop command to pty connection, in case that connection gets automatically 
         dropped by remote host because of no action within certain timeout."""
-        if not self.running_locally:
+        return self._pump(self._pty_pulse_session_steps())
+    
+    def _pty_pulse_session_steps(self):
+        if not (yield from self._running_locally_steps()):
             pulse_cmd = "while :; do echo 'Hit CTRL+C'; sleep 240; done"
-            self.run_cmd(command=pulse_cmd, timeout=-1)
+            yield from self._run_command_steps(CommandArgs({'command': pulse_cmd, 'timeout': -1}))
     
     def quit(self):
         """Quit current Pty connection, and revert back to previous connection status using session info chain."""
-        if self.running_locally:
+        return self._pump(self._quit_steps())
+    
+    def _quit_steps(self):
+        if (yield from self._running_locally_steps()):
             session_index = self.find_session_by_host(self.host)
             if session_index >= 0: del self.session_info_chain[session_index:]
-            self.close_pty()
+            yield from self._close_pty_steps()
 
         elif self.intershell:
             exit_cmd = intershell_info[self.current_session]['exit_cmd']
             if 'ctrl' in exit_cmd.lower():
                 ctrlchars = ''.join([c for c in exit_cmd.lower().lstrip('ctrl ') if c.isalpha()])
-                self.send_control(ctrlchars)
+                yield from self._send_control_steps(ctrlchars)
             else:
-                self._ensure_send_line(exit_cmd)
+                yield from self._ensure_send_line_steps(exit_cmd)
             self.current_session = self.session_info_chain[-1]['session']
             self.prompt = self.session_info_chain[-1]['prompt']
             self.command_timeout = self.session_info_chain[-1]['command_timeout']
             self.intershell = False
             del self.executable
-            time.sleep(delay_after_quit)
-            self.flush()
+            yield ('sleep', delay_after_quit)
+            yield from self._flush_steps()
 
         else:
             if self.serial_port_mode:
-                self.send_control('c')
-                self.send_control(']')
+                yield from self._send_control_steps('c')
+                yield from self._send_control_steps(']')
                 try:
-                    out = self.read_until('telnet>', telnet_timeout)
+                    out = yield from self._read_until_steps('telnet>', telnet_timeout)
                 except TimeoutError:
                     raise ContextError("Current session should be telnet to serial port: %s"
                                        %(self.current_session))
-                self._ensure_send_line('q')
+                yield from self._ensure_send_line_steps('q')
                 first_telnet_index = self.find_first_telnet_session()
                 if first_telnet_index >= 0: del self.session_info_chain[first_telnet_index:]
 
             elif self.cisco_sol_mode:
-                self.send_control('x')
+                yield from self._send_control_steps('x')
                 first_sol_index = self.find_first_sol_session()
                 if first_sol_index >= 0: del self.session_info_chain[first_sol_index:]
 
             else:
-                self.send_control('c')
-                self._ensure_send_line('exit')
+                yield from self._send_control_steps('c')
+                yield from self._ensure_send_line_steps('exit')
                 session_index = self.find_session_by_host(self.host)
                 if session_index >= 0: del self.session_info_chain[session_index:]
 
-            time.sleep(delay_after_quit)
+            yield ('sleep', delay_after_quit)
             if self.session_info_chain:
-                self.prompt = self.session_info_chain[-1]['prompt']
-                self.user = self.session_info_chain[-1]['user']
-                self.password = self.session_info_chain[-1]['password']
-                self.host = self.session_info_chain[-1]['target_host']
-                self.current_session = self.session_info_chain[-1]['session']
-                self.serial_port_mode = self.session_info_chain[-1]['serial_port_mode']
-                self.cisco_sol_mode = self.session_info_chain[-1]['cisco_sol_mode']
-                self.pty_linesep = self.session_info_chain[-1]['pty_linesep']
-                self.command_timeout = self.session_info_chain[-1]['command_timeout']
+                self._restore_session()
                 # ???????!!!!!!!!
-                host_info = self.get_pty_current_host()
-                prompt_info = self.get_pty_prompt()
+                host_info = yield from self._get_pty_current_host_steps()
+                prompt_info = yield from self._get_pty_prompt_steps()
                 if self.host not in host_info and self.prompt != prompt_info:
                     emsg = 'Enter unknown shell, host should be: %s, but read:' %(self.host) + newline + \
                         host_info + newline + 'prompt should be: %s, but read: ' %(self.prompt) + prompt_info
                     raise ContextError(emsg)
             else:
-                self.close_pty()
+                yield from self._close_pty_steps()
     
     def close_pty(self):
         """Safely close currenty Pty connection."""
+        return self._pump(self._close_pty_steps())
+    
+    def _close_pty_steps(self):
         if self.pty and not self.pty.closed:
-            self.flush()
+            yield from self._flush_steps()
             msg = 'Close Pty...'
             self.log(newline + newline + msg + newline + newline)
             while not self.pty.closed:
                 try:
-                    self.pty.close()
-                except:
-                    time.sleep(0.005)
+                    yield ('close',)
+                except Exception:
+                    yield ('sleep', 0.005)
 
         self.reset_agent()
     
     def close_on_exception(self):
         """Safely close everything when an uncorrectable exception occurs, and also close logging handler."""
+        return self._pump(self._close_on_exception_steps())
+    
+    def _close_on_exception_steps(self):
         self.log(newline + newline + repr(self) + newline)
-        self.close_pty()
-        self.flush(close_handler=True)
+        yield from self._close_pty_steps()
+        yield from self._flush_steps(close_handler=True)
+        if self.recorder: self.recorder.close()
     
     def __repr__(self):
         rpr = 'PTY INFO DUMP:' + newline
@@ -0,0 +1,127 @@
+"""Asyncio variant of UCS agent, many agents share one event loop, each pty
+is watched with loop readers and every deadline is a loop timer, so a
+session waiting on its console costs no thread and no process.
+
+Agent logic is shared with UCSAgentWrapper, its agent steps are pumped here
+by awaiting their I/O requests, only the I/O primitives are async."""
+import asyncio
+
+import ptyprocess
+import utils
+from utils import (PtyProcessError,
+                   TimeoutError)
+from agent import UCSAgentWrapper
+
+
+class AsyncPtyProcess(object):
+    """Pty process driven by asyncio event loop, waits for readiness with a
+    loop reader instead of blocking select. Writes stay blocking, commands
+    written are far smaller than pty buffer."""
+    def __init__(self, pty, loop=None):
+        self.pty = pty
+        self.loop = loop or asyncio.get_running_loop()
+    
+    @classmethod
+    def spawn(cls, argv, loop=None, **kwargs):
+        return cls(ptyprocess.PtyProcess.spawn(argv=argv, **kwargs), loop=loop)
+    
+    def __getattr__(self, name):
+        return getattr(self.pty, name)
+    
+    def readable(self):
+        """Nonblocking check if pty has data to read."""
+        return self.pty.wait_readable(0)
+    
+    async def wait_readable(self, timeout=None):
+        """Wait until pty has data to read or ``timeout`` seconds elapse,
+        return True if child's fd is ready, see PtyProcess.wait_readable."""
+        if self.readable(): return True
+        if timeout is not None and timeout <= 0: return False
+        ready = self.loop.create_future()
+        self.loop.add_reader(self.pty.fd, lambda: ready.done() or ready.set_result(True))
+        try:
+            return await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.loop.remove_reader(self.pty.fd)
+    
+    async def read_all_nonblocking(self, readafterdelay=0, settle=0.02):
+        """Read all available data, data arriving within ``settle`` seconds
+        is also read, see PtyProcess.read_all_nonblocking."""
+        if readafterdelay and readafterdelay > 0:
+            await asyncio.sleep(readafterdelay)
+
+        limit = self.pty.recv_buffer.limit
+        drained = self.pty.fill_available(limit=limit)
+        while drained < limit and await self.wait_readable(settle):
+            n = self.pty.fill_available(limit=limit-drained)
+            if n == 0: break    # EOF or receive buffer reaches memory ceiling
+            drained += n
+        return self.pty.recv_buffer.take()
+    
+    async def close(self):
+        # close waits for child to exit, keep it off event loop
+        await self.loop.run_in_executor(None, self.pty.close)
+    
+    def __repr__(self):
+        return 'Async%r' %(self.pty)
+
+
+class AsyncUCSAgent(UCSAgentWrapper):
+    """UCS agent running commands as coroutines on asyncio event loop, its
+    methods doing pty I/O return coroutines to await."""
+    @property
+    def running_locally(self):
+        # closing pty left without session needs I/O, agent steps do it,
+        # see UCSAgentWrapper._running_locally_steps
+        if self.session_info_chain:
+            if not self.pty or not self.pty.isalive() or self.pty.closed:
+                raise PtyProcessError('Pty Died Unexpectedly. Need Recovering.')
+            return False
+        return True
+    
+    def spawn_pty(self, argv):
+        return AsyncPtyProcess(super(AsyncUCSAgent, self).spawn_pty(argv))
+    
+    async def _pump(self, steps):
+        """Run agent steps, I/O requests are awaited, see UCSAgentWrapper._pump."""
+        result = error = None
+        while True:
+            try:
+                request = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                result = await self._io(*request)
+            except BaseException as err:
+                error = err
+    
+    async def _io(self, op, *args):
+        """Await I/O request of agent steps, see UCSAgentWrapper._io, closing
+        log file waits for disk, it's done in executor."""
+        if op == 'wait': return await self.pty.wait_readable(args[0])
+        if op == 'read': return await self.pty.read_all_nonblocking(readafterdelay=args[0])
+        if op == 'sleep': return await asyncio.sleep(args[0])
+        if op == 'local': return await self.local_run_cmd(args[0], timeout=args[1])
+        if op == 'close': return await self.pty.close()
+        if op == 'close_log': return await asyncio.get_running_loop().run_in_executor(None, self._close_log)
+        raise ValueError('Unknown agent I/O request: %r' %(op))
+    
+    async def local_run_cmd(self, cmd, timeout=None):
+        """Run local shell command in a subprocess watched by event loop,
+        return (stdout, stderr)."""
+        process = await asyncio.create_subprocess_shell(cmd.strip(), stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+        timeout = timeout if timeout and timeout > 0 else None
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TimeoutError('Command exceeded time limit: %rsec' %(timeout))
+        except BaseException:
+            if process.returncode is None: process.kill()
+            raise
+        return utils._str(stdout), utils._str(stderr)
@@ -0,0 +1,568 @@
+"""Benchmarks for UCS AutoRobot agent internals, run inside src folder:
+
+    python benchmark.py [benchmark ...]
+
+All benchmarks run against local pty shells or simulator, no UCS server is required."""
+import os
+import time
+import re
+import argparse
+import tempfile
+import shutil
+import asyncio
+import tracemalloc
+
+import ptyprocess
+import utils
+import simulator
+import sequence
+import worker
+from metrics import MetricSet
+from replay import (PtyRecorder,
+                    PtyReplay)
+from builtin import (COMMAND_ACTION_MAPPING,
+                     match_builtin_command,
+                     command_record)
+from asyncagent import AsyncUCSAgent
+from agent import (UCSAgentWrapper,
+                   output_matcher,
+                   LoginCases,
+                   PROMPT_WAIT_INPUT,
+                   PROMPT_WAIT_LOGIN,
+                   command_errors)
+
+
+BENCH_PROMPT = 'bench$ '
+BENCH_SHELL = ['bash', '--norc', '--noprofile'] if ptyprocess.which('bash') else ['sh']
+
+
+def spawn_shell():
+    env = dict(os.environ, PS1=BENCH_PROMPT)
+    pty = ptyprocess.PtyProcess.spawn(argv=BENCH_SHELL, env=env)
+    pty.write(b'stty -echo\n')
+    poll_read_until(pty, BENCH_PROMPT.encode(), 10.0)
+    return pty
+
+
+def connect_agent(logfile=None):
+    os.environ['PS1'] = BENCH_PROMPT
+    agent = UCSAgentWrapper(logfile=logfile)
+    agent.run_cmd(action='CONNECT', command=' '.join(BENCH_SHELL))
+    return agent
+
+
+def poll_read_until(pty, until, timeout, interval=0.03, size=1024):
+    """Legacy read loop, sleep polling pty with zero-timeout select."""
+    data = b''
+    t_end = time.time() + timeout
+    while time.time() <= t_end:
+        data = data + pty.read_nonblocking(size)
+        if data.rstrip().endswith(until.rstrip()): break
+        time.sleep(interval)
+    return data
+
+
+def wait_read_until(pty, until, timeout, size=1024):
+    """Event driven read loop, block on pty readiness with remaining deadline,
+    read at most ``size`` bytes per wakeup, or drain all buffered data if None."""
+    chunks = []
+    tail = b''
+    t_end = time.time() + timeout
+    while True:
+        t_wait = t_end - time.time()
+        if t_wait < 0 or not pty.wait_readable(t_wait): break
+        chunk = pty.read_nonblocking(size) if size else pty.read_available()
+        chunks.append(chunk)
+        tail = (tail + chunk)[-len(until)-16:]
+        if tail.rstrip().endswith(until.rstrip()): break
+    return b''.join(chunks)
+
+
+def report(name, rows):
+    lines = ['', '[%s]' %(name)] + ['    %-36s %s' %(k, v) for k, v in rows]
+    print(os.linesep.join(lines))
+
+
+def bench_read_latency(args):
+    """Prompt-to-return latency and idle CPU cost, polling versus event driven reads."""
+    until = BENCH_PROMPT.encode()
+    rows = []
+    for name, reader in (('polling', poll_read_until), ('event', wait_read_until)):
+        pty = spawn_shell()
+        latencies = []
+        for i in range(args.count):
+            # command prints prompt after a random short delay, measure time from prompt to return
+            pty.write(b'sleep 0.0%d; echo ok\n' %(i % 10))
+            t_start = time.time()
+            reader(pty, until, 5.0)
+            latencies.append(time.time() - t_start - (i % 10)/100.0)
+        latencies.sort()
+        # idle worker, wait on a silent pty
+        cpu_start = time.process_time()
+        reader(pty, until, args.idle)
+        cpu_idle = time.process_time() - cpu_start
+        pty.close()
+        rows.append(('%s latency p50/max (ms)' %(name),
+                     '%.2f / %.2f' %(latencies[len(latencies)//2]*1000, latencies[-1]*1000)))
+        rows.append(('%s idle cpu (%% of core)' %(name), '%.3f' %(cpu_idle/args.idle*100)))
+
+    agent = connect_agent()
+    t_start = time.time()
+    for i in range(args.count):
+        agent.run_cmd(action='SEND', command='echo ok')
+    rows.append(('agent run_cmd echo (cmds/sec)', '%.1f' %(args.count/(time.time()-t_start))))
+    agent.close_pty()
+    report('read-latency', rows)
+
+
+def bench_read_throughput(args):
+    """Ingest rate of multi-megabyte command outputs, fixed size reads versus bulk drain."""
+    until = BENCH_PROMPT.encode()
+    nbytes = args.megabytes*1024*1024
+    command = 'head -c %d /dev/zero | tr "\\0" "x" | fold -w 120; echo' %(nbytes)
+    rows = [('legacy 1024B per 30ms cap (KB/s)', '%.1f' %(1024/0.03/1024))]
+    for name, size in (('fixed 1024B', 1024), ('bulk drain', None)):
+        pty = spawn_shell()
+        pty.write(command.encode() + b'\n')
+        t_start = time.time()
+        out = wait_read_until(pty, until, 300.0, size=size)
+        elapsed = time.time() - t_start
+        pty.close()
+        rows.append(('%s (MB/s)' %(name), '%.2f, %d bytes' %(len(out)/elapsed/1024/1024, len(out))))
+
+    # flush already buffered output, legacy flush slept 20 ms per 4 KB chunk
+    pty = spawn_shell()
+    pty.write(b'head -c 65536 /dev/zero | tr "\\0" "x"\n')
+    time.sleep(1.0)
+    t_start = time.time()
+    out = pty.read_all_nonblocking()
+    elapsed = time.time() - t_start
+    pty.close()
+    rows.append(('flush 64KB buffered (ms)', '%.2f, legacy ~%d' %(elapsed*1000, len(out)//4096*20)))
+
+    agent = connect_agent()
+    t_start = time.time()
+    out = agent.run_cmd(action='SEND', command=command, timeout=300)
+    elapsed = time.time() - t_start
+    rows.append(('agent run_cmd (MB/s)', '%.2f, %d chars' %(len(out)/elapsed/1024/1024, len(out))))
+    agent.close_pty()
+    report('read-throughput', rows)
+
+
+def legacy_in_search(p, s, do_find=False):
+    """Legacy matcher, uncompiled regex with bare except on every call."""
+    if not p: return -1 if do_find else False
+    if do_find:
+        pos = s.find(p)
+        if pos < 0:
+            try:
+                pos = re.search(p, s, re.M).start()
+            except:
+                pass
+        return pos
+    if p in s: return True
+    try:
+        return (re.search(p, s, re.M | re.I) is not None)
+    except:
+        return False
+
+
+# Realistic UCS outputs seen by the matcher, shell prompts, login banners and diag output
+UCS_OUTPUTS = [
+    '[Mon Apr 13 17:34:58 root@UCSC-C240-M6SX-WZP23350BLA:/]$ ',
+    'login: ',
+    'admin@10.124.1.20\'s password: ',
+    'Are you sure you want to continue connecting (yes/no)? ',
+    'CISCO Serial Over LAN:\r\nPress Ctrl+x to Exit the session\r\n',
+    'udibmc_m6.stripped % ',
+    'Shell> ',
+    'FS0:\\EFI\\> ',
+    'bash: diagtool: command not found\r\n[root@localhost ~]# ',
+    '\r\n'.join('Test %03d  memory pattern walk ....... %s' %(i, 'FAIL' if i == 97 else 'PASS')
+                 for i in range(120)) + '\r\nResult: 119 passed, 1 failed\r\n[root@localhost ~]# ',
+    ]
+
+UCS_PATTERNS = PROMPT_WAIT_INPUT + PROMPT_WAIT_LOGIN + [x.value for x in LoginCases] + command_errors + \
+    ['[root@localhost ~]#', 'FAIL', 'PASS', r"Result: \d+ passed, 0 failed", 'telnet>', r"% {0,3}$"]
+
+
+def bench_in_search(args):
+    """in_search hit rate and latency over realistic UCS outputs, legacy versus compiled cache."""
+    calls = [(p, s, f) for s in UCS_OUTPUTS for p in UCS_PATTERNS for f in (False, True)]
+    literals = sum(1 for p in UCS_PATTERNS if utils.compile_pattern(p).literal)
+    hits = sum(1 for p, s, f in calls if (utils.in_search(p, s, f) >= 0 if f else utils.in_search(p, s)))
+    rows = [('patterns literal/total', '%d / %d' %(literals, len(UCS_PATTERNS))),
+            ('hit rate', '%.1f%% of %d calls' %(hits*100.0/len(calls), len(calls)))]
+    rounds = max(args.count, 1)
+    for name, matcher in (('legacy', legacy_in_search), ('compiled', utils.in_search)):
+        t_start = time.perf_counter()
+        for i in range(rounds):
+            for p, s, f in calls:
+                matcher(p, s, f)
+        elapsed = time.perf_counter() - t_start
+        rows.append(('%s latency (us/call)' %(name), '%.3f' %(elapsed/rounds/len(calls)*1e6)))
+    rows.append(('pattern cache', repr(utils.compile_pattern.cache_info())))
+    report('in-search', rows)
+
+
+# Session types on simulator, connect steps from local shell, last step is timed as connect
+SIM_SESSIONS = [
+    ('ssh', [{'command': 'ssh admin@10.0.0.2', 'user': 'admin', 'password': 'password'}]),
+    ('telnet', [{'command': 'telnet 10.0.0.3', 'user': 'root', 'password': 'password'}]),
+    ('telnet serial', [{'command': 'telnet 10.0.0.4 2005'}]),
+    ('sol', [{'command': 'connect host'}]),
+    ('ssh > sol', [{'command': 'ssh admin@10.0.0.2', 'user': 'admin', 'password': 'password'},
+                   {'command': 'connect host'}]),
+    ('ssh > bmc_diag', [{'command': 'ssh admin@10.0.0.2', 'user': 'admin', 'password': 'password'},
+                        {'command': './udibmc_m6.stripped', 'action': 'SEND'}]),
+    ('telnet > i2c_uart', [{'command': 'telnet 10.0.0.3', 'user': 'root', 'password': 'password'},
+                           {'command': './i2c_uart', 'action': 'SEND'}]),
+]
+
+
+def bench_simulator(args):
+    """Connect time, commands/sec and output throughput per session type on UCS target simulator."""
+    options = ['--yes-no', '--latency', str(args.sim_latency), '--baud', str(args.sim_baud)]
+    os.environ['PATH'] = simulator.install_shims(tempfile.mkdtemp(prefix='ucs_sim_'), options) + \
+        os.pathsep + os.environ['PATH']
+    nbytes = args.megabytes*1024*1024//8
+    rows = []
+    for name, steps in SIM_SESSIONS:
+        agent = UCSAgentWrapper()
+        for step in steps:
+            t_start = time.time()
+            agent.run_cmd(**dict({'action': 'CONNECT'}, **step))
+        t_connect = time.time() - t_start
+        t_start = time.time()
+        for i in range(args.count):
+            agent.run_cmd(action='SEND', command='echo ok')
+        t_cmds = time.time() - t_start
+        t_start = time.time()
+        out = agent.run_cmd(action='SEND', command='dump %d' %(nbytes), timeout=300)
+        t_dump = time.time() - t_start
+        agent.close_pty()
+        rows.append(('%s connect (sec)' %(name), '%.3f' %(t_connect)))
+        rows.append(('%s echo (cmds/sec)' %(name), '%.1f' %(args.count/t_cmds)))
+        rows.append(('%s dump (MB/s)' %(name), '%.2f, %d chars' %(len(out)/t_dump/1024/1024, len(out))))
+    report('simulator', rows)
+
+
+def bench_replay(args):
+    """Replay time of a recorded simulator session, as fast as possible and realtime."""
+    options = ['--yes-no', '--latency', str(args.sim_latency or 0.05)]
+    tmpdir = tempfile.mkdtemp(prefix='ucs_replay_')
+    os.environ['PATH'] = simulator.install_shims(tmpdir, options) + os.pathsep + os.environ['PATH']
+    record_path = os.path.join(tmpdir, 'session.rec')
+    steps = SIM_SESSIONS[0][1]
+
+    def run(recorder=None, replay=None):
+        agent = UCSAgentWrapper(recorder=recorder, replay=replay)
+        t_start = time.time()
+        outputs = [agent.run_cmd(**dict({'action': 'CONNECT'}, **step)) for step in steps]
+        outputs += [agent.run_cmd(action='SEND', command='echo %d' %(i)) for i in range(args.count)]
+        agent.close_on_exception()
+        return time.time() - t_start, outputs
+
+    t_record, recorded = run(recorder=PtyRecorder(record_path))
+    t_fast, fast = run(replay=PtyReplay(record_path))
+    t_realtime, realtime = run(replay=PtyReplay(record_path, realtime=True))
+    rows = [('record (sec)', '%.3f, %d bytes' %(t_record, os.path.getsize(record_path))),
+            ('replay fast (sec)', '%.3f, %s' %(t_fast, 'same output' if fast == recorded else 'OUTPUT DIFFERS')),
+            ('replay realtime (sec)', '%.3f, %s' %(t_realtime, 'same output' if realtime == recorded else 'OUTPUT DIFFERS'))]
+    report('replay', rows)
+
+
+def bench_hub(args):
+    """Sessions connected and driven concurrently on one event loop, against blocking agents one by one."""
+    options = ['--yes-no', '--latency', str(args.sim_latency or 0.05)]
+    os.environ['PATH'] = simulator.install_shims(tempfile.mkdtemp(prefix='ucs_hub_'), options) + \
+        os.pathsep + os.environ['PATH']
+    step = dict({'action': 'CONNECT'}, **SIM_SESSIONS[0][1][0])
+
+    def run_blocking():
+        agent = UCSAgentWrapper()
+        agent.run_cmd(**step)
+        out = agent.run_cmd(action='SEND', command='echo ok')
+        agent.close_pty()
+        return out
+
+    async def run_async():
+        agent = AsyncUCSAgent()
+        await agent.run_cmd(**step)
+        out = await agent.run_cmd(action='SEND', command='echo ok')
+        await agent.close_pty()
+        return out
+
+    async def run_hub():
+        return await asyncio.gather(*[run_async() for i in range(args.count)])
+
+    rows = []
+    t_start, cpu_start = time.time(), time.process_time()
+    outputs = [run_blocking() for i in range(args.count)]
+    rows.append(('blocking %d sessions (sec)' %(args.count), '%.3f, cpu %.3f' %(time.time()-t_start, time.process_time()-cpu_start)))
+    t_start, cpu_start = time.time(), time.process_time()
+    hub_outputs = asyncio.run(run_hub())
+    rows.append(('hub %d sessions (sec)' %(args.count), '%.3f, cpu %.3f, %s' %(time.time()-t_start, time.process_time()-cpu_start,
+                                                                          'same output' if hub_outputs == outputs else 'OUTPUT DIFFERS')))
+    report('hub', rows)
+
+
+def bench_sequence_cache(args):
+    """Sequence file parse time against compiled sequence cache load, for a generated sequence."""
+    tmpdir = tempfile.mkdtemp(prefix='ucs_seq_')
+    path = os.path.join(tmpdir, 'generated.seq')
+    lines = args.count*400
+    with open(path, mode='w') as fp:
+        for i in range(lines//4):
+            fp.write('echo step %d;step %d,PROMPT;FAIL,FAILFAST;30\n' %(i, i))
+            fp.write('ssh admin@10.0.0.%d;password\n' %(i % 250))
+            fp.write('WAIT 1\n')
+            fp.write('QUIT\n')
+    t_start = time.time()
+    parsed = sequence.sequence_compile(path)[0]
+    t_parse = time.time() - t_start
+    sequence.sequence_reader(path)      # store cache
+    t_start = time.time()
+    cached = sequence.sequence_read(path, os.stat(path))[0]
+    t_load = time.time() - t_start
+    same = [c.cmd_dict for c in cached] == [c.cmd_dict for c in parsed]
+    rows = [('parse %d lines (sec)' %(lines), '%.4f' %(t_parse)),
+            ('cache load (sec)', '%.4f, %s' %(t_load, 'same commands' if same else 'COMMANDS DIFFER')),
+            ('cache size (bytes)', '%d' %(os.path.getsize(sequence.sequence_cache_path(path))))]
+    report('sequence-cache', rows)
+
+
+def bench_executor(args):
+    """Sequence executor cost per command, straight-line sequence against the same commands in LOOP body."""
+    class DryWorker(worker.SequenceWorker):
+        # commands pass without agent, only executor runs
+        def __init__(self, sequence_file):
+            self.sequence_file = sequence_file
+            self.program = sequence.sequence_program(sequence_file)
+            self.test_sequence = self.program.commands
+            self.test_loops = 1
+            self.complt_loops = 0
+            self.logfile = None
+            self.status = None
+            self.own_slots = []
+            self.loop_slots = {}
+            self.metrics = MetricSet()
+            self.t_metrics = time.time()
+
+        def send_ipc_msg(self, message):
+            pass
+
+        def _run_sequence_command_steps(self, command):
+            yield from ()
+            return worker.Messages.ITEM_RESULT_PASS, None, ''
+
+    tmpdir = tempfile.mkdtemp(prefix='ucs_exec_')
+    commands = args.count*2000
+    straight = os.path.join(tmpdir, 'straight.seq')
+    with open(straight, mode='w') as fp:
+        for i in range(commands): fp.write('echo step\n')
+    looped = os.path.join(tmpdir, 'looped.seq')
+    with open(looped, mode='w') as fp:
+        fp.write('SUBSEQUENCE body\n' + 'echo step\n'*10 + 'END-SUBSEQUENCE body\nLOOP body %d\n' %(commands//10))
+    rows = []
+    for name, path in (('straight-line', straight), ('LOOP body', looped)):
+        job = DryWorker(path)
+        t_start = time.time()
+        job.run_all()
+        t_total = time.time() - t_start
+        rows.append(('%s %d commands (usec/command)' %(name, commands), '%.3f' %(t_total*1e6/commands)))
+    report('executor', rows)
+
+
+class LegacyCommand(object):
+    """Legacy sequence command, fields in instance dict, missing fields read as None."""
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return None
+
+    @property
+    def cmd_dict(self):
+        return self.__dict__
+
+
+def legacy_command_fields(**seqcmdargs):
+    """Fields legacy run_cmd reads from keyword arguments of a command."""
+    return (seqcmdargs['command'], seqcmdargs.get('timeout'), seqcmdargs.get('expect'),
+            seqcmdargs.get('matcher') or output_matcher(seqcmdargs.get('expect'), seqcmdargs.get('escape')),
+            seqcmdargs.get('text_invisible'), seqcmdargs.get('action') == 'FIND', seqcmdargs.get('bg_run'),
+            seqcmdargs.get('command_wait_passphrase'), seqcmdargs.get('fail_fast'))
+
+
+def record_command_fields(command):
+    """Fields run_command reads from a command record."""
+    return (command.command, command.timeout, command.expect,
+            command.matcher or output_matcher(command.expect, command.escape),
+            command.text_invisible, command.action == 'FIND', command.bg_run,
+            command.command_wait_passphrase, command.fail_fast)
+
+
+def bench_command_record(args):
+    """Command fields read per command and memory of parsed commands, legacy dynamic objects against slots records."""
+    tmpdir = tempfile.mkdtemp(prefix='ucs_cmd_')
+    path = os.path.join(tmpdir, 'generated.seq')
+    with open(path, mode='w') as fp:
+        for i in range(args.count*200):
+            fp.write('echo step %d;step %d,PROMPT;FAIL,FAILFAST;30\n' %(i, i))
+    records = sequence.sequence_compile(path)[0]
+    # legacy parser compiled matchers into commands, records compile them on first use
+    fields = [dict(command.cmd_dict, matcher=command.matcher) for command in records]
+    rows = []
+    built = {}
+    for name, build in (('legacy', lambda d: LegacyCommand(**d)), ('record', command_record)):
+        tracemalloc.start()
+        built[name] = [build(d) for d in fields]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rows.append(('%s memory %d commands (bytes/command)' %(name, len(fields)), '%.1f' %(size/len(fields))))
+    t_start = time.perf_counter()
+    legacy = [legacy_command_fields(**command.cmd_dict) for command in built['legacy']]
+    rows.append(('legacy run_cmd(**cmd_dict) fields (us/command)', '%.3f' %((time.perf_counter()-t_start)*1e6/len(fields))))
+    t_start = time.perf_counter()
+    record = [record_command_fields(command) for command in built['record']]
+    rows.append(('record run_command fields (us/command)', '%.3f, %s' %((time.perf_counter()-t_start)*1e6/len(fields),
+                                                                     'same fields' if record == legacy else 'FIELDS DIFFER')))
+    report('command-record', rows)
+
+
+def legacy_item_split(line, delimiter=';'):
+    """Legacy sequence item split, escapes joined by list surgery."""
+    line = utils._str(line).strip(delimiter)
+    items = [item for item in line.split(delimiter) if item]
+    cur = len(items) - 1
+    while cur >= 0:
+        cur = cur - 1
+        if ord(items[cur][-1]) == 92:
+            items[cur] = items[cur][0:-1] + delimiter + items[cur+1]
+            del items[cur+1]
+    return items
+
+
+def legacy_match_builtin(word):
+    """Legacy keyword match, every action pattern searched."""
+    found = None
+    for command, action in COMMAND_ACTION_MAPPING.items():
+        if re.search(command, word):
+            found = action
+    return found
+
+
+def generate_burn_in(path, lines):
+    """Write generated burn-in sequence, mixed commands, builtins, subsequences and comments."""
+    with open(path, mode='w') as fp:
+        fp.write('# generated burn-in sequence\n')
+        for i in range(lines//10):
+            fp.write('ssh admin@10.0.%d.%d;password;;30\n' %(i//250 % 250, i % 250))
+            fp.write('SUBSEQUENCE stress%d\n' %(i))
+            fp.write('memtester 64M 1 | tail -1;ok;FAIL,FAILFAST;600\n')
+            fp.write('echo step\\;%d done;step;;5  # step marker\n' %(i))
+            fp.write('END-SUBSEQUENCE stress%d\n' %(i))
+            fp.write('LOOP stress%d 2\n' %(i))
+            fp.write('dmesg | grep -i error \\\n')
+            fp.write('  | wc -l;0\n')
+            fp.write('WAIT 1\n')
+            fp.write('exit\n')
+
+
+def bench_sequence_parse(args):
+    """Parse throughput of generated burn-in sequence, with tokenizer and keyword match against legacy ones,
+    keyword match is timed uncached, and with its cache apart."""
+    tmpdir = tempfile.mkdtemp(prefix='ucs_parse_')
+    path = os.path.join(tmpdir, 'burn_in.seq')
+    lines = args.count*2000
+    generate_burn_in(path, lines)
+    t_start = time.perf_counter()
+    test_seq, marks = sequence.sequence_compile(path)
+    t_parse = time.perf_counter() - t_start
+    rows = [('parse %d lines (sec)' %(lines), '%.3f, %d commands, %d marks' %(t_parse, len(test_seq), len(marks))),
+            ('parse throughput', '%.0f lines/sec, %.2f MB/sec' %(lines/t_parse, os.path.getsize(path)/t_parse/1e6))]
+    with open(path) as fp:
+        statements = [line for lineno, line in sequence.sequence_statements(fp)]
+    keywords = [utils.sequence_item_split(line.split(';')[0], ' ')[0] for line in statements]
+    # tokenizer keyword is matched by the combined alternation, uncached here,
+    # burn-in sequence repeats few keywords, cached matches are mostly hits
+    for name, split, match in (('legacy', legacy_item_split, legacy_match_builtin),
+                               ('tokenizer', utils.sequence_item_split, match_builtin_command.__wrapped__)):
+        t_start = time.perf_counter()
+        items = [split(line) for line in statements]
+        t_split = time.perf_counter() - t_start
+        t_start = time.perf_counter()
+        actions = [match(word) for word in keywords]
+        t_match = time.perf_counter() - t_start
+        rows.append(('%s split / keyword (us/line)' %(name), '%.3f / %.3f' %(t_split*1e6/len(statements), t_match*1e6/len(statements))))
+    match_builtin_command.cache_clear()
+    t_start = time.perf_counter()
+    actions = [match_builtin_command(word) for word in keywords]
+    t_match = time.perf_counter() - t_start
+    cache = match_builtin_command.cache_info()
+    rows.append(('tokenizer keyword cached (us/line)', '%.3f, %d hits / %d misses' %(t_match*1e6/len(statements),
+                                                                                   cache.hits, cache.misses)))
+    report('sequence-parse', rows)
+
+
+def bench_preflight(args):
+    """Sequence tree resolve time, loaded in this process against loaded by
+    parallel processes, which only write sequence cache for workers."""
+    tmpdir = tempfile.mkdtemp(prefix='ucs_tree_')
+    cache_dir = os.path.join(tmpdir, '__seqcache__')
+    children = args.count
+    entry = os.path.join(tmpdir, 'entry.seq')
+    with open(entry, mode='w') as fp:
+        for i in range(children):
+            path = os.path.join(tmpdir, 'child%d.seq' %(i))
+            generate_burn_in(path, 4000)
+            fp.write('RUN-SEQUENCE %s 1\n' %(path))
+    cache_enabled = sequence.seq_cache_enabled
+    rows = []
+    for name, enabled, parallel_files in (('serial, no cache', False, 0),
+                                          ('serial, cold cache', True, children+1),
+                                          ('parallel, cold cache', True, 0)):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        sequence.seq_cache_enabled = enabled
+        sequence.PROGRAMS.clear()
+        t_start = time.perf_counter()
+        tree = sequence.sequence_preflight(entry, workers=os.cpu_count(), parallel_files=parallel_files)
+        rows.append(('%s %d files (sec)' %(name, len(tree)), '%.3f, %d programs kept, %d cpus'
+                     %(time.perf_counter() - t_start, len(sequence.PROGRAMS), os.cpu_count())))
+    sequence.seq_cache_enabled = cache_enabled
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    report('preflight', rows)
+
+
+BENCHMARKS = {
+    'read-latency': bench_read_latency,
+    'read-throughput': bench_read_throughput,
+    'in-search': bench_in_search,
+    'simulator': bench_simulator,
+    'replay': bench_replay,
+    'hub': bench_hub,
+    'sequence-cache': bench_sequence_cache,
+    'executor': bench_executor,
+    'command-record': bench_command_record,
+    'sequence-parse': bench_sequence_parse,
+    'preflight': bench_preflight,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UCS AutoRobot agent benchmarks.')
+    parser.add_argument('names', nargs='*', default=list(BENCHMARKS.keys()),
+                        help='benchmarks to run: %s' %(', '.join(BENCHMARKS.keys())))
+    parser.add_argument('-n', dest='count', type=int, default=50, help='iterations per benchmark.')
+    parser.add_argument('-i', dest='idle', type=float, default=3.0, help='idle seconds to measure cpu.')
+    parser.add_argument('-m', dest='megabytes', type=int, default=8, help='megabytes of output for throughput.')
+    parser.add_argument('--sim-latency', type=float, default=0.0, help='simulator seconds before command output.')
+    parser.add_argument('--sim-baud', type=int, default=0, help='simulator console line speed in baud, 0 for unlimited.')
+    args = parser.parse_args()
+    for name in args.names:
+        BENCHMARKS[name](args)
@@ -1,8 +1,12 @@
 import os
 from os import linesep as newline
 import re
+import functools
 
-from agent import quit_command_patterns
+from agent import (quit_command_patterns,
+                   waitpassphrase_command_pattern,
+                   output_matcher)
+from const import pattern_cache_size
 
 COMMAND_ACTION_MAPPING = {
     r"DEFAULT1": 'SEND',
@@ -23,59 +27,135 @@ COMMAND_ACTION_MAPPING = {
 }
 
 
-class BuiltinCommand(object):
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            setattr(self, k, v)
-    
-    def __getitem__(self, key):
-        try:
-            return getattr(self, key)
-        except AttributeError:
-            return None
-        except:
-            raise
+def keyword_pattern(mapping):
+    """Combine keyword patterns of mapping into one alternation matched at word
+    start, return (pattern, group name to action). Each alternative may match
+    anywhere in word and they are in reverse order, so when keyword patterns
+    overlap, the last one found in word wins, like searching them one by one."""
+    groups = list(enumerate(mapping.items()))[::-1]
+    pattern = re.compile('|'.join('(?P<k%d>(?s:.*?)(?:%s))' %(i, p) for i, (p, a) in groups))
+    return pattern, dict(('k%d' %(i), a) for i, (p, a) in groups)
+
+
+# keyword patterns in one alternation, matched group name gives action
+BUILTIN_KEYWORD_PATTERN, BUILTIN_KEYWORD_ACTIONS = keyword_pattern(COMMAND_ACTION_MAPPING)
+
+
+class Command(object):
+    """Sequence command record, fields of its action kind are slots, fields
+    not given are None, flags are False. Records are built by command_record
+    from parsed or cached fields."""
+    __slots__ = ('command', 'argv', 'builtin', 'action', 'text_invisible')
+    DEFAULTS = dict(command=None, argv=None, builtin=False, action=None, text_invisible=False)
     
-    def __setitem__(self, key, value):
-        setattr(self, key, value)
+    def __init__(self, fields):
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, fields.get(name, default))
     
     @property
     def cmd_dict(self):
-        return self.__dict__
+        return dict((name, getattr(self, name)) for name in self.DEFAULTS)
     
     def __repr__(self):
-        clsname = type(self).__name__
         rpr = self.command
         if self.builtin:
             rpr = 'BUILTIN COMMAND: ' + rpr
-        elif self.action == 'CONNECT':
-            append = 'login info: ('
-            login_info = None
-            if hasattr(self, 'user') and self.user:
-                login_info = '%r, ' %(self.user)
-            if hasattr(self, 'password') and self.password:
-                login_info = login_info + '%r' %(self.password)
-            append = append + (login_info if login_info else 'None') + ')'
-            if hasattr(self, 'boot_expect') and self.boot_expect:
-                append = append + ', boot expect: %s' %(self.boot_expect)
-            if hasattr(self, 'boot_escape') and self.boot_escape:
-                append = append + ', boot escape: %s' %(self.boot_escape)
-            rpr = '%s, %s' %(rpr, append)
-            timeout = ', timeout: %r' %(self.timeout) if hasattr(self, 'timeout') and self.timeout else ''
-            rpr = rpr + timeout
-        elif self.action == 'SEND':
-            expect = self.expect if self.expect else 'PROMPT'
-            escape = self.escape if self.escape else 'none'
-            timeout = self.timeout if self.timeout else 'INSTANT'
-            rpr = '%s, expect: %r, escape: %r, timeout: %r' %(rpr, expect, escape, timeout)
-
         return rpr
 
 
-def match_builtin_command(word):
-    found = None
-    for command, action in COMMAND_ACTION_MAPPING.items():
-        if re.search(command, word):
-            found = action
+class SendCommand(Command):
+    """Command sent to pty, or ENTER, MONITOR and FIND which send one. Timeout
+    is in seconds, None for session default. Output matcher is compiled from
+    expects and escapes once, on first use, loops reuse it."""
+    __slots__ = ('expect', 'escape', 'fail_fast', 'timeout', 'bg_run', 'command_wait_passphrase', '_matcher')
+    DEFAULTS = dict(Command.DEFAULTS, expect=None, escape=None, fail_fast=False, timeout=None,
+                    bg_run=False, command_wait_passphrase=False)
+    
+    def __init__(self, fields):
+        super(SendCommand, self).__init__(fields)
+        self._matcher = fields.get('matcher')
+        if self.timeout is not None: self.timeout = float(self.timeout)
+        # commands which will run in background mode
+        if self.action == 'SEND' and not self.builtin: self.bg_run = self.command[-1:] == '&'
+        # command needs to wait for passphrase, which means the prompt will be invisible
+        if self.expect and len(self.expect) == 1 and re.search(waitpassphrase_command_pattern, self.expect[0], re.I):
+            self.command_wait_passphrase = True
+    
+    @property
+    def matcher(self):
+        if self._matcher is None: self._matcher = output_matcher(self.expect, self.escape)
+        return self._matcher
+    
+    def __repr__(self):
+        if self.action != 'SEND': return super(SendCommand, self).__repr__()
+        expect = self.expect if self.expect else 'PROMPT'
+        escape = self.escape if self.escape else 'none'
+        timeout = self.timeout if self.timeout else 'INSTANT'
+        return '%s, expect: %r, escape: %r, timeout: %r' %(self.command, expect, escape, timeout)
+
+
+class MonitorCommand(SendCommand):
+    __slots__ = ('watch', 'interval')
+    DEFAULTS = dict(SendCommand.DEFAULTS, **dict.fromkeys(__slots__))
+
+
+class FindCommand(SendCommand):
+    __slots__ = ('target_file', 'find_dir')
+    DEFAULTS = dict(SendCommand.DEFAULTS, **dict.fromkeys(__slots__))
 
-    return found
+
+class ConnectCommand(Command):
+    __slots__ = ('user', 'password', 'timeout', 'boot_expect', 'boot_escape')
+    DEFAULTS = dict(Command.DEFAULTS, **dict.fromkeys(__slots__))
+    
+    def __repr__(self):
+        login_info = None
+        if self.user:
+            login_info = '%r, ' %(self.user)
+        if self.password:
+            login_info = (login_info or '') + '%r' %(self.password)
+        append = 'login info: (' + (login_info if login_info else 'None') + ')'
+        if self.boot_expect:
+            append = append + ', boot expect: %s' %(self.boot_expect)
+        if self.boot_escape:
+            append = append + ', boot escape: %s' %(self.boot_escape)
+        rpr = '%s, %s' %(self.command, append)
+        return rpr + (', timeout: %r' %(self.timeout) if self.timeout else '')
+
+
+class WorkerCommand(Command):
+    __slots__ = ('sequence_file', 'loops', 'wait')
+    DEFAULTS = dict(Command.DEFAULTS, sequence_file=None, loops=None, wait=False)
+
+
+class LoopCommand(Command):
+    """LOOP of a subsequence, or SUBSEQUENCE mark, ``lineno`` is the line of
+    LOOP in its sequence file, for problems found when program is checked."""
+    __slots__ = ('subsequence_name', 'loops', 'lineno')
+    DEFAULTS = dict(Command.DEFAULTS, **dict.fromkeys(__slots__))
+
+
+# command record kind of each action, other builtin actions need no more fields
+COMMAND_RECORDS = {
+    'ENTER': SendCommand,
+    'MONITOR': MonitorCommand,
+    'FIND': FindCommand,
+    'CONNECT': ConnectCommand,
+    'NEW_WORKER': WorkerCommand,
+    'LOOP': LoopCommand,
+    'SUBSEQUENCE': LoopCommand,
+}
+
+
+def command_record(fields):
+    """Build command record of its action kind from fields dict."""
+    action = fields.get('action')
+    if action == 'SEND' and not fields.get('builtin'): return SendCommand(fields)
+    return COMMAND_RECORDS.get(action, Command)(fields)
+
+
+@functools.lru_cache(maxsize=pattern_cache_size)
+def match_builtin_command(word):
+    """Builtin action of command keyword, None for commands sent to pty."""
+    match = BUILTIN_KEYWORD_PATTERN.match(word)
+    return BUILTIN_KEYWORD_ACTIONS[match.lastgroup] if match else None
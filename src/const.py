@@ -4,6 +4,9 @@ log_enabled = True                          # if log is enabled
 stop_on_failure = False                     # if test stops when failure is detected
 loop_iterations = 1                         # test loop iterations
 sequence_file_entry = ''                    # entry sequence file, the sequence to start all tests
+pty_record = False                          # if pty byte streams of workers are recorded
+pty_replay = ''                             # pty record file to replay for entry sequence worker
+pty_replay_realtime = False                 # if recorded delays are kept on replay
 
 #print_window_message = True
 local_shell_prompt = '>>>'                  # local shell prompt string
@@ -11,17 +14,33 @@ session_connect_retry = 3                   # session connect retry count
 session_recover_retry = 3                   # session recover retry count
 session_prompt_retry = 4                    # session prompt set/get retry count
 session_prompt_retry_timeout = 5            # session prompt set/get retry timeout
-max_sequences = 5                           # maximum worker processes
+max_sequences = 5                           # worker processes in pool, more sequences wait in queue
+async_hubs = 0                              # asyncio hub processes running all sequences, 0 for a process per sequence
 window_refresh_interval = 5.0               # time period for refreshing window result printing
 builtin_monitor_interval = 3.0              # time period for builtin monitor command
 prompt_offset_range = 16                    # offset range to check if prompt string is reached
 base_serial_port = 2003                     # base serial port for telnet connection
+pattern_cache_size = 512                    # maximum compiled search patterns cached
+output_spill_threshold = 8*1024*1024        # command output characters kept in memory before spilling to disk
+output_excerpt_size = 4096                  # characters of output head/tail carried in errors and messages
+until_search_window = 64*1024               # maximum characters of output rematched for read until patterns per chunk
+log_queue_limit = 16*1024*1024              # maximum characters queued in log writer, more are dropped
+log_flush_size = 256*1024                   # queued characters to trigger a log writer flush
+log_flush_interval = 1.0                    # maximum seconds log data stays queued before flush
+log_compression = 'gzip'                    # sequence log compression, 'gzip', 'lzma' or None
+log_rotate_size = 64*1024*1024              # sequence log segment size on disk to rotate
+log_rotate_loops = 0                        # test loops per sequence log segment to rotate, 0 to disable
+log_keep_segments = 0                       # sequence log segments kept on disk, oldest removed, 0 to keep all
 
 # sequence related definitions
 seq_continue_nextline = "\\"                # sequence line syntax for continue in newline
 seq_comment_header = '#'                    # sequence line syntax for commenting
 seq_item_delimiter = ';'                    # sequence line syntax for spliting items
 seq_subitem_delimiter = ','                 # sequence line syntax for spliting subitems
+seq_escape_fail_fast = 'FAILFAST'           # sequence escape keyword to check escapes while command running
+seq_cache_enabled = True                    # if compiled sequences are cached and reused
+seq_cache_dir = ''                          # compiled sequence cache folder, empty for __seqcache__ beside sequence file
+seq_preflight_parallel_files = 32           # sequence files found before preflight loads the rest in parallel, with cache only
 
 # timeout definitions
 ssh_timeout = 20.0                          # default ssh connect timeout
@@ -41,3 +60,7 @@ bootup_watch_period = 30.0                  # watch period to watch if target sy
 bootup_watch_timeout = 600.0                # timeout for watching system booting up
 
 sock_retry_timeout = 90.0                   # retry timeout for socket IPC
+ipc_queue_limit = 1024                      # max messages queued to send to master
+ipc_batch_interval = 0.05                   # seconds to gather messages sent in one write
+ipc_backoff_max = 1.0                       # max seconds between IPC reconnect attempts
+status_board_slots = 1024                   # worker status slots in shared memory
@@ -1,4 +1,5 @@
 import sys
+import shutil
 
 
 CURSOR_CONTROL = "\033["
@@ -51,3 +52,62 @@ def erase_lines_downward(line=1):
         erase_line()
         move_down_lines()
         cursor_lines -= 1
+
+
+class FrameRenderer(object):
+    """Status window drawn in place, previous frame is kept and only changed
+    lines are rewritten, with one write per frame. Workers more than fit in
+    terminal are shown a page per frame. If stream is not a terminal, each
+    frame is written as one compact line instead."""
+    def __init__(self, stream=None, interactive=None):
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty() if interactive is None else interactive
+        self.lines = []
+        self.page = 0
+
+    def fit(self, header, rows):
+        """Lines of frame fitting terminal height, a page of rows if they don't."""
+        height, width = self.size()
+        room = height - 1 - len(header)
+        if len(rows) > room:
+            room = max(room - 1, 1)
+            pages = (len(rows) + room - 1)//room
+            self.page = self.page % pages
+            shown = rows[self.page*room:(self.page+1)*room]
+            shown.append('... page %d/%d of %d workers' %(self.page+1, pages, len(rows)))
+            self.page += 1
+            rows = shown
+        # wrapped lines would break line count of frame
+        return [line[:width-1] for line in header + rows]
+
+    def size(self):
+        size = shutil.get_terminal_size()
+        return max(size.lines, 4), max(size.columns, 20)
+
+    def render(self, header, rows, compact=''):
+        if not self.interactive:
+            if compact: self.stream.write(compact + '\n')
+            self.stream.flush()
+            return
+        lines = self.fit(header, rows)
+        prev = self.lines
+        out = []
+        # cursor is at line below previous frame, go back to its first line
+        if prev: out.append('\r' + CURSOR_CONTROL + str(len(prev)) + CURSOR_UPWARDS)
+        skip = 0
+        for i, line in enumerate(lines):
+            if i < len(prev) and prev[i] == line:
+                skip += 1
+                continue
+            if skip: out.append(CURSOR_CONTROL + str(skip) + CURSOR_DOWNWARDS)
+            skip = 0
+            out.append(ERASE_LINE + line + '\n')
+        if skip: out.append(CURSOR_CONTROL + str(skip) + CURSOR_DOWNWARDS)
+        # erase lines left of a longer previous frame
+        extra = len(prev) - len(lines)
+        if extra > 0:
+            out.append((ERASE_LINE + CURSOR_CONTROL + '1' + CURSOR_DOWNWARDS)*extra)
+            out.append(CURSOR_CONTROL + str(extra) + CURSOR_UPWARDS)
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.lines = lines
@@ -0,0 +1,189 @@
+import os
+import time
+import json
+import struct
+import socket
+import threading
+from collections import deque
+
+from const import (sock_retry_timeout,
+                   ipc_queue_limit,
+                   ipc_batch_interval,
+                   ipc_backoff_max)
+
+FRAME_HEADER = struct.Struct('!IQQ')    # payload length, sender id and sequence number of a frame
+
+
+def encode_frame(message, sender=0, seq=0):
+    """Frame message as length prefixed JSON payload, numbered by ``seq`` in
+    frames of ``sender``."""
+    if not isinstance(message, str): message = json.dumps(message, ensure_ascii=True)
+    payload = message.encode('utf-8')
+    return FRAME_HEADER.pack(len(payload), sender, seq) + payload
+
+
+class FrameReader(object):
+    """Split byte stream of a connection into messages, a message is decoded
+    from JSON, or kept as string if it's not JSON. Frames a sender resends on
+    a new connection are dropped if already read, ``seen`` maps sender id to
+    the last sequence number read, share it between readers of all
+    connections so resent frames are recognized."""
+    def __init__(self, seen=None):
+        self.buffer = bytearray()
+        self.seen = seen if seen is not None else {}
+        self.duplicates = 0
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        start = 0
+        while len(self.buffer) - start >= FRAME_HEADER.size:
+            length, sender, seq = FRAME_HEADER.unpack_from(self.buffer, start)
+            end = start + FRAME_HEADER.size + length
+            if end > len(self.buffer): break
+            if seq and seq <= self.seen.get(sender, 0):
+                self.duplicates += 1
+                start = end
+                continue
+            if seq: self.seen[sender] = seq
+            payload = self.buffer[start+FRAME_HEADER.size:end].decode('utf-8', 'replace')
+            try:
+                messages.append(json.loads(payload))
+            except ValueError:
+                messages.append(payload)
+            start = end
+        del self.buffer[:start]
+        return messages
+
+
+class IpcClient(object):
+    """Persistent framed connection to master. Messages are queued and sent by
+    a background thread, messages queued within ``batch_interval`` are sent
+    with one write. The queue holds at most ``queue_limit`` messages, senders
+    wait when it's full. A lost connection is reconnected with exponential
+    backoff, and sending fails when it can't be reconnected in ``retry_timeout``
+    seconds, the error is raised on next send or flush.
+    A batch interrupted by a lost connection is resent whole on the new one,
+    frames carry this client's id and sequence numbers, so master drops those
+    it already read, see FrameReader."""
+    def __init__(self, path, queue_limit=ipc_queue_limit, batch_interval=ipc_batch_interval,
+                 retry_timeout=sock_retry_timeout, backoff_max=ipc_backoff_max):
+        self.path = path
+        self.queue_limit = queue_limit
+        self.batch_interval = batch_interval
+        self.retry_timeout = retry_timeout
+        self.backoff_max = backoff_max
+        self.sock = None
+        self.sender = int.from_bytes(os.urandom(8), 'big')
+        self.seq = 0
+        self.queue = deque()
+        self.sending = 0
+        self.error = None
+        self.closed = False
+        self.sent_messages = 0
+        self.sent_batches = 0
+        self.reconnects = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='IpcClient', daemon=True)
+        self._thread.start()
+
+    def send(self, message):
+        """Queue message to send, wait if queue is full."""
+        with self._cond:
+            t_end = time.time() + self.retry_timeout
+            while not self.error and len(self.queue) >= self.queue_limit and time.time() < t_end:
+                self._cond.wait(max(t_end - time.time(), 0))
+            if self.error: raise self.error
+            if self.closed: raise ValueError('Send on closed IPC client.')
+            if len(self.queue) >= self.queue_limit:
+                raise RuntimeError('IPC send queue full for %.1f sec' %(self.retry_timeout))
+            self.seq += 1
+            self.queue.append(encode_frame(message, self.sender, self.seq))
+            self._cond.notify_all()
+
+    def flush(self):
+        """Wait until all queued messages are sent."""
+        with self._cond:
+            while not self.error and (self.queue or self.sending):
+                self._cond.wait()
+            if self.error: raise self.error
+
+    def close(self):
+        """Send queued messages and close connection."""
+        if self.closed: return
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._disconnect()
+
+    def _connect(self):
+        t_end = time.time() + self.retry_timeout
+        backoff = 0.01
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.retry_timeout)
+                sock.connect(self.path)
+                self.sock = sock
+                return
+            except OSError as err:
+                sock.close()
+                if time.time() + backoff > t_end:
+                    raise RuntimeError('IPC connect to %s failed: %r' %(self.path, err))
+            time.sleep(backoff)
+            backoff = min(backoff*2, self.backoff_max)
+
+    def _disconnect(self):
+        if self.sock: self.sock.close()
+        self.sock = None
+
+    def _send_batch(self, data):
+        t_end = time.time() + self.retry_timeout
+        while True:
+            if not self.sock: self._connect()
+            try:
+                self.sock.sendall(data)
+                return
+            except OSError as err:
+                # master closed connection, resend batch on a new one, master
+                # drops frames of it already read by sequence number
+                self._disconnect()
+                self.reconnects += 1
+                if time.time() > t_end:
+                    raise RuntimeError('IPC send to %s failed: %r' %(self.path, err))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.queue and not self.closed:
+                    self._cond.wait()
+                if self.closed and not self.queue: return
+            # linger a while, messages close together go in one write
+            if self.batch_interval and not self.closed: time.sleep(self.batch_interval)
+            with self._cond:
+                frames = list(self.queue)
+                self.queue.clear()
+                self.sending = len(frames)
+                self._cond.notify_all()
+            try:
+                self._send_batch(b''.join(frames))
+            except Exception as err:
+                with self._cond:
+                    self.error = err
+                    self.sending = 0
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self.sent_messages += len(frames)
+                self.sent_batches += 1
+                self.sending = 0
+                self._cond.notify_all()
+
+    def __repr__(self):
+        return '%s(%r, sent: %d messages in %d writes, reconnects: %d)' %(type(self).__name__, self.path,
+                                                                         self.sent_messages, self.sent_batches,
+                                                                         self.reconnects)
@@ -0,0 +1,295 @@
+import os
+import time
+import threading
+import gzip
+import lzma
+import json
+from collections import deque
+from os import linesep as newline
+
+from const import (log_queue_limit,
+                   log_flush_size,
+                   log_flush_interval,
+                   log_compression,
+                   log_rotate_size,
+                   log_rotate_loops,
+                   log_keep_segments)
+
+
+class LogSegments(object):
+    """Compressed, rotating log file. Log data is written to numbered segments
+    next to ``path``, a new segment starts when current segment reaches
+    ``rotate_size`` bytes on disk or ``rotate_loops`` test loops. With
+    ``keep_segments``, only latest segments are kept on disk, all are kept by
+    default. An index file records which loop range is in which segment, it
+    is rewritten whenever a segment is opened or a test loop starts, so it
+    stays current if the process dies.
+    lzma segments can't be flushed partially, data is durable once the segment
+    is closed, gzip segments are sync flushed on every flush."""
+    COMPRESSIONS = {
+        'gzip': ('.gz', lambda f: gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)),
+        'lzma': ('.xz', lambda f: lzma.LZMAFile(f, mode='wb', preset=1)),
+    }
+
+    def __init__(self, path, compression=log_compression, rotate_size=log_rotate_size,
+                 rotate_loops=log_rotate_loops, keep_segments=log_keep_segments):
+        if compression and compression not in self.COMPRESSIONS:
+            raise ValueError('Unsupported log compression: %r' %(compression))
+        self.base = path[:-len('.log')] if path.endswith('.log') else path
+        self.index_path = self.base + '.index'
+        self.compression = compression
+        self.rotate_size = rotate_size
+        self.rotate_loops = rotate_loops
+        self.keep_segments = keep_segments
+        self.segments = []      # [path, first loop, last loop, removed]
+        self.loop = 0
+        self.raw = None
+        self.stream = None
+        self.closed = False
+        self._open_segment()
+
+    @property
+    def name(self):
+        return self.segments[-1][0]
+
+    def _open_segment(self):
+        ext = self.COMPRESSIONS[self.compression][0] if self.compression else ''
+        path = '%s.%03d.log%s' %(self.base, len(self.segments), ext)
+        # never overwrite a segment of another log
+        self.raw = open(path, mode='xb')
+        self.stream = self.COMPRESSIONS[self.compression][1](self.raw) if self.compression else self.raw
+        self.segments.append([path, self.loop, self.loop, False])
+        self.write_index()
+
+    def _close_segment(self):
+        if self.stream is not self.raw: self.stream.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+
+    def rotate(self):
+        self._close_segment()
+        if self.keep_segments:
+            alive = [x for x in self.segments if not x[3]]
+            for segment in alive[:len(alive)-self.keep_segments+1]:
+                try:
+                    os.remove(segment[0])
+                except OSError:
+                    pass
+                segment[3] = True
+        self._open_segment()
+
+    def write(self, data):
+        self.stream.write(data.encode('utf-8', 'backslashreplace'))
+        if self.rotate_size and self.raw.tell() >= self.rotate_size: self.rotate()
+        return len(data)
+
+    def start_loop(self, loop):
+        """Mark data written after as log of test loop ``loop``."""
+        segment = self.segments[-1]
+        self.loop = loop
+        if self.rotate_loops and segment[1] and loop - segment[1] >= self.rotate_loops:
+            self.rotate()
+            segment = self.segments[-1]
+        if not segment[1]: segment[1] = loop
+        segment[2] = loop
+        self.write_index()
+
+    def flush(self):
+        self.stream.flush()
+        self.raw.flush()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def write_index(self):
+        lines = ['# segment first_loop last_loop']
+        for path, first, last, removed in self.segments:
+            lines.append('%s %d %d%s' %(path.split(os.sep)[-1], first, last, ' removed' if removed else ''))
+        # replace index atomically, readers never see a partial index
+        with open(self.index_path + '.tmp', mode='w') as fp:
+            fp.write(newline.join(lines) + newline)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def close(self):
+        if self.closed: return
+        self._close_segment()
+        self.write_index()
+        self.closed = True
+
+
+class LogWriter(object):
+    """Asynchronous batched log writer, a file-like object whose writes are
+    queued and written by a background thread. Queued writes are coalesced
+    into one write, flushed when ``flush_size`` bytes are pending or
+    ``flush_interval`` seconds elapse. The queue is bounded by ``queue_limit``
+    bytes, writes beyond are dropped and counted instead of blocking.
+    If writing to file fails, eg, ENOSPC or EIO, the writer thread stops
+    with the error kept in ``error``, flush and close return at once and
+    data written after is dropped.
+    ``file`` is a log path, or a file-like object such as LogSegments."""
+    def __init__(self, file, queue_limit=log_queue_limit,
+                 flush_size=log_flush_size, flush_interval=log_flush_interval):
+        self.file = open(file, mode='w') if isinstance(file, str) else file
+        self.queue_limit = queue_limit
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = deque()
+        self.queue_bytes = 0
+        self.max_queue_bytes = 0
+        self.written_bytes = 0
+        self.dropped_bytes = 0
+        self.closed = False
+        self.error = None
+        self._flush_requested = False
+        self._flush_durable = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='LogWriter', daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self):
+        return self.file.name
+
+    def write(self, data):
+        """Queue data to write, return count of characters accepted."""
+        if not data: return 0
+        with self._cond:
+            if self.closed: raise ValueError('I/O operation on closed log writer.')
+            size = len(data)
+            if self.error is not None or self.queue_bytes + size > self.queue_limit:
+                self.dropped_bytes += size
+                return size
+            self.queue.append(data)
+            self.queue_bytes += size
+            self.max_queue_bytes = max(self.max_queue_bytes, self.queue_bytes)
+            if self.queue_bytes >= self.flush_size: self._cond.notify()
+        return size
+
+    def start_loop(self, loop):
+        """Mark log data queued after as log of test loop ``loop``, in order
+        with queued data, for log files rotating by loops."""
+        if not hasattr(self.file, 'start_loop'): return
+        with self._cond:
+            if not self.closed: self.queue.append(loop)
+
+    def flush(self, durable=False):
+        """Wait until all queued data is written and flushed, with durable
+        flush, file data is also synced to disk."""
+        with self._cond:
+            if self.closed: return
+            self._flush_requested = True
+            self._flush_durable = self._flush_durable or durable
+            self._cond.notify()
+            while (self.queue or self._flush_requested) and self.error is None:
+                self._cond.wait()
+
+    def close(self):
+        """Write all queued data, sync it to disk and close log file."""
+        if self.closed: return
+        self.flush(durable=True)
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        self._thread.join()
+        try:
+            self.file.close()
+        except (OSError, ValueError):
+            # closing flushes data of a file already failed
+            if self.error is None: raise
+
+    def stats(self):
+        return {'queue_bytes': self.queue_bytes,
+                'max_queue_bytes': self.max_queue_bytes,
+                'written_bytes': self.written_bytes,
+                'dropped_bytes': self.dropped_bytes}
+
+    def _write(self, items):
+        chunks = []
+        for item in items:
+            if isinstance(item, str):
+                chunks.append(item)
+                continue
+            # loop marker, write data queued before it first
+            if chunks: self.file.write(''.join(chunks))
+            chunks = []
+            self.file.start_loop(item)
+        if chunks: self.file.write(''.join(chunks))
+
+    def _run(self):
+        t_flush = time.time() + self.flush_interval
+        while True:
+            with self._cond:
+                while not self.closed and not self._flush_requested and \
+                        self.queue_bytes < self.flush_size and time.time() < t_flush:
+                    self._cond.wait(max(t_flush - time.time(), 0))
+                if self.closed and not self.queue: return
+                items = list(self.queue)
+                written = self.queue_bytes
+                self.queue.clear()
+                self.queue_bytes = 0
+                flush_requested, durable = self._flush_requested, self._flush_durable
+            # write outside lock, so writers never wait for disk
+            try:
+                self._write(items)
+                self.file.flush()
+                if durable: os.fsync(self.file.fileno())
+            except Exception as err:
+                with self._cond:
+                    # data of this round may be written partially, count it dropped
+                    self.error = err
+                    self.dropped_bytes += written + self.queue_bytes
+                    self.queue.clear()
+                    self.queue_bytes = 0
+                    self._flush_requested = False
+                    self._cond.notify_all()
+                return
+            self.written_bytes += written
+            t_flush = time.time() + self.flush_interval
+            if flush_requested:
+                with self._cond:
+                    # data queued meanwhile is written on next round before waking flushers
+                    self._flush_requested = bool(self.queue)
+                    if not self._flush_requested:
+                        self._flush_durable = False
+                        self._cond.notify_all()
+
+    def __repr__(self):
+        return '%s(%r, written: %d, dropped: %d, max queue: %d%s)' %(type(self).__name__, self.name,
+                                                                      self.written_bytes, self.dropped_bytes,
+                                                                      self.max_queue_bytes,
+                                                                      ', error: %r' %(self.error) if self.error else '')
+
+
+class EventLog(object):
+    """Append-only JSONL event log, one JSON object per line. Writes are
+    buffered and flushed at most every ``flush_interval`` seconds, so events
+    are cheap to record for every command."""
+    def __init__(self, path, flush_interval=log_flush_interval, buffer_size=64*1024):
+        self.file = open(path, mode='x', buffering=buffer_size)
+        self.flush_interval = flush_interval
+        self.t_flush = time.time() + flush_interval
+        self.count = 0
+
+    @property
+    def name(self):
+        return self.file.name
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def emit(self, **fields):
+        if self.file.closed: return
+        self.file.write(json.dumps(fields, separators=(',', ':')) + '\n')
+        self.count += 1
+        if time.time() >= self.t_flush: self.flush()
+
+    def flush(self):
+        if self.file.closed: return
+        self.file.flush()
+        self.t_flush = time.time() + self.flush_interval
+
+    def close(self):
+        if self.file.closed: return
+        self.file.close()
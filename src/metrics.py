@@ -0,0 +1,138 @@
+import os
+from bisect import bisect_left
+from os import linesep as newline
+
+
+# fixed bucket upper bounds, last bucket is always +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+RETRY_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+THROUGHPUT_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+HISTOGRAMS = {
+    'ucs_command_latency_seconds': ('Sequence command latency, from start to command return.', LATENCY_BUCKETS),
+    'ucs_connect_latency_seconds': ('Session connect latency, from start to prompt set.', LATENCY_BUCKETS),
+    'ucs_prompt_retries': ('Prompt detection retries of prompt setting commands.', RETRY_BUCKETS),
+    'ucs_read_throughput_bytes_per_second': ('Command output read throughput.', THROUGHPUT_BUCKETS),
+    'ucs_queue_wait_seconds': ('Sequence wait in worker pool queue, from queued to started.', LATENCY_BUCKETS),
+}
+
+COUNTERS = {
+    'ucs_commands_total': 'Sequence commands completed, by result.',
+    'ucs_read_bytes_total': 'Bytes read from sessions.',
+    'ucs_loops_total': 'Test loops completed, by result.',
+}
+
+
+class Histogram(object):
+    """Fixed-bucket histogram, mergeable by adding bucket counts."""
+    def __init__(self, bounds, counts=None, total=0.0):
+        self.bounds = bounds
+        self.counts = list(counts) if counts else [0]*(len(bounds)+1)
+        self.total = total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, counts, total):
+        for i, c in enumerate(counts): self.counts[i] += c
+        self.total += total
+
+    def quantile(self, q):
+        """Estimate quantile q, interpolated linearly inside the bucket it falls in."""
+        count = self.count
+        if not count: return None
+        rank = q*count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                if i == len(self.bounds): return self.bounds[-1]
+                lower = self.bounds[i-1] if i > 0 else 0
+                return lower + (self.bounds[i] - lower)*(rank - seen)/c
+            seen += c
+        return self.bounds[-1]
+
+
+def _label_str(labels):
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join('%s="%s"' %(k, escape(v)) for k, v in labels)
+
+
+class MetricSet(object):
+    """Histograms and counters keyed by name and labels. Workers take delta
+    snapshots to send, master merges snapshots and exports them in Prometheus
+    text format."""
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def __bool__(self):
+        return bool(self.histograms or self.counters)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms: self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+        self.histograms[key].observe(value)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self, reset=True):
+        """JSON serializable snapshot, with reset, it is a delta since last snapshot."""
+        snap = {'H': [[name, labels, h.counts, h.total] for (name, labels), h in self.histograms.items()],
+                'C': [[name, labels, v] for (name, labels), v in self.counters.items()]}
+        if reset:
+            self.histograms = {}
+            self.counters = {}
+        return snap
+
+    def merge(self, snap):
+        for name, labels, counts, total in snap.get('H', []):
+            key = (name, tuple(tuple(x) for x in labels))
+            if key not in self.histograms: self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+            self.histograms[key].merge(counts, total)
+        for name, labels, value in snap.get('C', []):
+            key = (name, tuple(tuple(x) for x in labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def prometheus_text(self):
+        lines = []
+        for name, (doc, bounds) in sorted(HISTOGRAMS.items()):
+            series = sorted((labels, h) for (n, labels), h in self.histograms.items() if n == name)
+            if not series: continue
+            lines += ['# HELP %s %s' %(name, doc), '# TYPE %s histogram' %(name)]
+            for labels, h in series:
+                cumulative = 0
+                for bound, c in zip(list(bounds) + ['+Inf'], h.counts):
+                    cumulative += c
+                    lines.append('%s_bucket{%s} %d' %(name, _label_str(labels + (('le', bound),)), cumulative))
+                lines.append('%s_sum{%s} %r' %(name, _label_str(labels), h.total))
+                lines.append('%s_count{%s} %d' %(name, _label_str(labels), cumulative))
+        for name, doc in sorted(COUNTERS.items()):
+            series = sorted((labels, v) for (n, labels), v in self.counters.items() if n == name)
+            if not series: continue
+            lines += ['# HELP %s %s' %(name, doc), '# TYPE %s counter' %(name)]
+            lines += ['%s{%s} %d' %(name, _label_str(labels), v) for labels, v in series]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Rewrite Prometheus text file atomically, scrapers never read a partial file."""
+        with open(path + '.tmp', mode='w') as fp:
+            fp.write(self.prometheus_text())
+        os.replace(path + '.tmp', path)
+
+    def quantile_summary(self, name='ucs_command_latency_seconds', quantiles=(0.5, 0.95, 0.99)):
+        """Summary lines of histogram quantiles, one line per label set."""
+        lines = []
+        for (n, labels), h in sorted(self.histograms.items()):
+            if n != name: continue
+            labels = dict(labels)
+            title = ('[%s] %s' %(labels.pop('sequence', ''), ' '.join(str(v) for v in labels.values()))).rstrip()
+            values = ' / '.join('%.3f' %(h.quantile(q)) for q in quantiles)
+            lines.append('* %s: %s, %d runs' %(title, values, h.count))
+        return newline.join(lines)
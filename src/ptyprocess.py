@@ -10,7 +10,7 @@ import struct
 import sys
 import termios
 import time
-import select
+import selectors
 
 try:
     import builtins  # Python 3
@@ -194,6 +194,79 @@ def _setwinsize(fd, rows, cols):
     s = struct.pack('HHHH', rows, cols, 0, 0)
     fcntl.ioctl(fd, TIOCSWINSZ, s)
 
+class ReceiveBuffer(object):
+    '''Growable receive buffer for data read from a pseudoterminal.
+
+    Data is read straight into a ``bytearray`` with ``readinto``, consumers
+    get a zero-copy ``memoryview`` of the unconsumed bytes with :meth:`peek`
+    and release them with :meth:`consume`. A view returned by :meth:`peek` is
+    only valid until the next :meth:`fill` or :meth:`consume` call.
+
+    Memory ceiling: the buffer never holds more than ``limit`` unconsumed
+    bytes, :meth:`fill` reads nothing once the ceiling is reached and the
+    remaining data stays in the kernel pty buffer (which in turn blocks the
+    child's writes) until a consumer releases space.
+    '''
+    def __init__(self, size=64*1024, limit=16*1024*1024):
+        self.limit = limit
+        self._buf = bytearray(size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, size):
+        """Make room for ``size`` more bytes at the tail, return the room available."""
+        used = self._end - self._start
+        size = min(size, self.limit - used)
+        if size <= 0: return 0
+        if self._end + size > len(self._buf):
+            if used + size <= len(self._buf):
+                # compact unconsumed data to the buffer head, length is unchanged
+                self._buf[0:used] = self._buf[self._start:self._end]
+            else:
+                # grow by doubling, a new bytearray keeps exported views valid
+                newbuf = bytearray(max(len(self._buf)*2, used + size))
+                newbuf[0:used] = self._buf[self._start:self._end]
+                self._buf = newbuf
+            self._start, self._end = 0, used
+        return size
+
+    def fill(self, readinto, size):
+        """Read at most ``size`` bytes with ``readinto`` callable into the tail,
+        return the count of bytes read, 0 if the buffer is full."""
+        size = self._reserve(size)
+        if size <= 0: return 0
+        with memoryview(self._buf) as view:
+            n = readinto(view[self._end:self._end+size])
+        self._end += n or 0
+        return n or 0
+
+    def peek(self):
+        """Zero-copy view of all unconsumed bytes."""
+        return memoryview(self._buf)[self._start:self._end]
+
+    def find(self, sub, start=0):
+        """Offset of ``sub`` in unconsumed bytes from offset ``start``, -1 if not found."""
+        pos = self._buf.find(sub, self._start + start, self._end)
+        return pos - self._start if pos >= 0 else -1
+
+    def consume(self, size=None):
+        """Release ``size`` unconsumed bytes, all of them if size is None."""
+        if size is None or size >= self._end - self._start:
+            self._start = self._end = 0
+        else:
+            self._start += size
+
+    def take(self, size=None):
+        """Return a copy of ``size`` unconsumed bytes and release them."""
+        end = self._end if size is None else min(self._start + size, self._end)
+        data = bytes(self._buf[self._start:end])
+        self.consume(end - self._start)
+        return data
+
+
 class PtyProcess(object):
     '''This class represents a process running in a pseudoterminal.
     
@@ -217,6 +290,10 @@ class PtyProcess(object):
         write_to_stdout = sys.stdout.write
 
     encoding = None
+
+    # Adaptive read size bounds for draining pty buffered data.
+    read_size_min = 1024
+    read_size_max = 1024*1024
     
     argv = None
     env = None
@@ -229,6 +306,9 @@ class PtyProcess(object):
         readf = io.open(fd, 'rb', buffering=0)
         writef = io.open(fd, 'wb', buffering=0, closefd=False)
         self.fileobj = io.BufferedRWPair(readf, writef)
+        # all reads go through receive buffer on the raw fd, fileobj is only
+        # written, its BufferedReader would keep data the selector can't see
+        self._rawreader = readf
 
         self.terminated = False
         self.closed = False
@@ -243,6 +323,14 @@ class PtyProcess(object):
         # Used by terminate() to give kernel time to update process status.
         # Time in seconds.
         self.delayafterterminate = 0.1
+        # Readiness selector of pty fd, created on first wait_readable().
+        self._selector = None
+        # Current adaptive read size, see fill_available().
+        self.read_size = self.read_size_min
+        # Receive buffer shared by all nonblocking read paths.
+        self.recv_buffer = ReceiveBuffer()
+        # Byte stream recorder, see replay.PtyRecorder.
+        self.recorder = None
 
     @classmethod
     def spawn(
@@ -461,7 +549,11 @@ class PtyProcess(object):
         and SIGINT). '''
         if not self.closed:
             self.flush()
+            if self._selector is not None:
+                self._selector.close()
+                self._selector = None
             self.fileobj.close() # Closes the file descriptor
+            if self.recorder is not None: self.recorder.record_close()
             # Give kernel time to update process status.
             time.sleep(self.delayafterclose)
             if self.isalive():
@@ -581,79 +673,124 @@ class PtyProcess(object):
         Linux, and the empty-string return used on BSD platforms and (seemingly)
         on recent Solaris.
         """
-        try:
-            s = self.fileobj.read1(size)
-        except (OSError, IOError) as err:
-            if err.args[0] == errno.EIO:
-                # Linux-style EOF
-                self.flag_eof = True
-                raise EOFError('End Of File (EOF). Exception style platform.')
-            raise
-        if s == b'':
-            # BSD-style EOF (also appears to work on recent Solaris (OpenIndiana))
-            self.flag_eof = True
-            raise EOFError('End Of File (EOF). Empty string style platform.')
-
-        return s
+        if not self.recv_buffer: self._fill(size)
+        return self.recv_buffer.take(size)
 
     def readline(self):
-        """Read one line from the pseudoterminal, and return it as unicode.
+        """Read one line from the pseudoterminal, and return it as bytes.
 
         Can block if there is nothing to read. Raises :exc:`EOFError` if the
-        terminal was closed.
+        terminal was closed and nothing is left to read.
+
+        The line is read through the receive buffer like other reads, bytes
+        after the line are kept there for following reads.
         """
+        scanned = 0
+        while True:
+            pos = self.recv_buffer.find(b'\n', scanned)
+            if pos >= 0: return self.recv_buffer.take(pos + 1)
+            scanned = len(self.recv_buffer)
+            try:
+                # a line longer than buffer ceiling is returned as it is
+                if self._fill(self.read_size) == 0: return self.recv_buffer.take()
+            except EOFError:
+                if not self.recv_buffer: raise
+                return self.recv_buffer.take()
+
+    def wait_readable(self, timeout=None):
+        """Block until the pseudoterminal has data to read or ``timeout``
+        seconds elapse, return True if child's fd is ready. A timeout of None
+        blocks until ready, a timeout <= 0 polls without blocking.
+
+        EOF also makes the fd ready, callers should check :meth:`eof` when
+        the following read returns nothing."""
+        if self.fd < 0: raise EOFError('Invalid file descriptor, %d' %(self.fd))
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.fd, selectors.EVENT_READ)
+        if timeout is not None and timeout < 0: timeout = 0
+        return bool(self._selector.select(timeout))
+
+    def _fill(self, size):
+        """Read at most ``size`` bytes into receive buffer, may block if there
+        is nothing to read. Raises :exc:`EOFError` if the terminal was closed."""
         try:
-            s = self.fileobj.readline()
+            n = self.recv_buffer.fill(self._rawreader.readinto, size)
         except (OSError, IOError) as err:
             if err.args[0] == errno.EIO:
                 # Linux-style EOF
                 self.flag_eof = True
+                if self.recorder is not None: self.recorder.record_eof()
                 raise EOFError('End Of File (EOF). Exception style platform.')
             raise
-        if s == b'':
+        if n == 0 and len(self.recv_buffer) < self.recv_buffer.limit:
             # BSD-style EOF (also appears to work on recent Solaris (OpenIndiana))
             self.flag_eof = True
+            if self.recorder is not None: self.recorder.record_eof()
             raise EOFError('End Of File (EOF). Empty string style platform.')
+        if n and self.recorder is not None:
+            with self.recv_buffer.peek() as view:
+                self.recorder.record_read(view[len(view)-n:])
 
-        return s
+        return n
 
-    def read_all_nonblocking(self, readafterdelay=0, size=4*1024):
-        """Nonblocking read all available data from the pseudoterminal, 
-        return b'' if child's fd is not ready."""
-        if readafterdelay and readafterdelay > 0:
-            time.sleep(readafterdelay)
-    
-        s = b''
+    def fill_available(self, limit=4*1024*1024, settle=0.0):
+        """Nonblocking drain everything the pseudoterminal has buffered into
+        receive buffer, up to ``limit`` bytes, return the count of bytes read.
+
+        The read size adapts to the stream, it doubles while reads come back
+        full and halves when they come back mostly empty, bounded by
+        ``read_size_min`` and ``read_size_max``. With ``settle`` > 0, keep
+        draining as long as new data arrives within ``settle`` seconds."""
+        drained = 0
         if self.fd < 0: raise EOFError('Invalid file descriptor, %d' %(self.fd))
         try:
-            while select.select([self.fd,], [], [], 0.0)[0]:
-                s = s + self.read(size=size)
-                time.sleep(0.02)
-            # flush all for ensurance
-            if select.select([self.fd,], [], [], 0.0)[0]:
-                s = s + self.read(size=size*1024)
+            while drained < limit and self.wait_readable(settle if drained else 0.0):
+                n = self._fill(self.read_size)
+                if n == 0: break    # receive buffer reaches memory ceiling
+                drained += n
+                if n >= self.read_size:
+                    self.read_size = min(self.read_size*2, self.read_size_max)
+                elif n < self.read_size//4:
+                    self.read_size = max(self.read_size//2, self.read_size_min)
         except EOFError:
             pass
 
-        return s
+        return drained
+
+    def read_all_nonblocking(self, readafterdelay=0, settle=0.02):
+        """Nonblocking read all available data from the pseudoterminal, data
+        arriving within ``settle`` seconds is also read, return b'' if child's
+        fd is not ready."""
+        if readafterdelay and readafterdelay > 0:
+            time.sleep(readafterdelay)
+
+        self.fill_available(limit=self.recv_buffer.limit, settle=settle)
+        return self.recv_buffer.take()
+
+    def read_available(self, limit=4*1024*1024):
+        """Nonblocking drain everything the pseudoterminal has buffered, up to
+        ``limit`` bytes, return b'' if child's fd is not ready."""
+        self.fill_available(limit=limit)
+        return self.recv_buffer.take()
 
     def read_nonblocking(self, size=16):
         """Nonblocking read from pseudoterminal, return b'' if child's fd
         is not ready."""
-        s = b''
         if self.fd < 0: raise EOFError('Invalid file descriptor, %d' %(self.fd))
         try:
-            if select.select([self.fd,], [], [], 0.0)[0]:
-                s = self.read(size=size)
+            if not self.recv_buffer and self.wait_readable(0.0):
+                self._fill(size)
         except EOFError:
             pass
 
-        return s
+        return self.recv_buffer.take(size)
 
     def _writeb(self, b, flush=True):
         n = self.fileobj.write(b)
         if flush:
             self.fileobj.flush()
+        if n and self.recorder is not None: self.recorder.record_write(b[:n])
         return n
 
     def write(self, s, flush=True):
@@ -0,0 +1,198 @@
+"""Record and replay of pty byte streams, for reproducing runs against real
+UCS hardware offline:
+
+    python replay.py info RECORD
+    python replay.py play RECORD [--session N] [--realtime]
+
+A record file starts with MAGIC, followed by records of a 9 bytes header
+(kind, microseconds since previous record, payload length) and payload.
+SPAWN starts a pty session with its argv as payload, READ and WRITE carry
+bytes read from and written to the pty, EOF and CLOSE end the session.
+
+Replay runs as the child of a pty, in place of the recorded command. Recorded
+reads of the session are written back once the agent has written as many
+bytes as it did before them in the recording, so replay follows the agent
+deterministically. By default reads are written as fast as possible, with
+realtime, recorded delays between agent writes and reads are kept as well."""
+import os
+import sys
+import time
+import struct
+import select
+import argparse
+import tty
+import termios
+
+MAGIC = b'UCSPTYREC1\n'
+HEADER = struct.Struct('!BII')
+SPAWN, READ, WRITE, EOF, CLOSE = range(5)
+KIND_NAMES = ('SPAWN', 'READ', 'WRITE', 'EOF', 'CLOSE')
+
+
+class PtyRecorder(object):
+    """Record timestamped byte streams of pty processes into a record file."""
+    def __init__(self, path, buffer_size=64*1024):
+        self.file = open(path, mode='xb', buffering=buffer_size)
+        self.file.write(MAGIC)
+        self.t_last = time.time()
+        self.records = 0
+        self.bytes = 0
+
+    @property
+    def name(self):
+        return self.file.name
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def record(self, kind, data=b''):
+        if self.file.closed: return
+        t_now = time.time()
+        # saturate at uint32, a gap over 71 minutes is shortened on realtime replay
+        delta = min(max(int((t_now - self.t_last)*1000000), 0), 0xffffffff)
+        self.t_last = t_now
+        self.file.write(HEADER.pack(kind, delta, len(data)))
+        self.file.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def attach(self, pty, argv):
+        """Start recording pty spawned with argv."""
+        self.record(SPAWN, '\0'.join(argv).encode())
+        pty.recorder = self
+
+    def record_read(self, data):
+        self.record(READ, data)
+
+    def record_write(self, data):
+        self.record(WRITE, data)
+
+    def record_eof(self):
+        self.record(EOF)
+        self.file.flush()
+
+    def record_close(self):
+        self.record(CLOSE)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed: self.file.close()
+
+
+def read_records(path):
+    """Yield (kind, seconds since recording started, payload) of record file."""
+    with open(path, mode='rb') as fp:
+        if fp.read(len(MAGIC)) != MAGIC: raise ValueError('Not a pty record file: %s' %(path))
+        t_offset = 0.0
+        while True:
+            header = fp.read(HEADER.size)
+            if len(header) < HEADER.size: break
+            kind, delta, length = HEADER.unpack(header)
+            t_offset += delta/1000000.0
+            yield kind, t_offset, fp.read(length)
+
+
+def read_sessions(path):
+    """Split records into sessions, list of (argv, records), records start
+    with SPAWN record."""
+    sessions = []
+    for kind, t, data in read_records(path):
+        if kind == SPAWN: sessions.append((data.decode().split('\0'), []))
+        if sessions: sessions[-1][1].append((kind, t, data))
+    return sessions
+
+
+class PtyReplay(object):
+    """Replay transport, replaces commands spawned by agent with replay of
+    recorded sessions, in recorded order."""
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.sessions = read_sessions(path)
+        self.spawned = 0
+
+    def argv(self, argv):
+        """Command to spawn in place of ``argv``, replaying next recorded session."""
+        if self.spawned >= len(self.sessions):
+            raise EOFError('No more recorded session to replay for: %s' %(' '.join(argv)))
+        replay_argv = [sys.executable, os.path.abspath(__file__), 'play', self.path, '--session', str(self.spawned)]
+        if self.realtime: replay_argv.append('--realtime')
+        self.spawned += 1
+        return replay_argv
+
+
+def play(records, realtime=False, infd=0, outfd=1):
+    """Write recorded reads of a session to ``outfd``, each once bytes read from
+    ``infd`` catch up with recorded writes before it."""
+    received = 0
+    expected = 0
+    t_anchor = t_write = None
+    for kind, t, data in records:
+        if kind in (SPAWN, WRITE):
+            expected += len(data) if kind == WRITE else 0
+            t_write = t
+            t_anchor = None
+            continue
+        # wait until agent has written what it wrote before this record
+        while received < expected:
+            select.select([infd], [], [])
+            try:
+                chunk = os.read(infd, 4096)
+            except OSError:
+                chunk = b''
+            if not chunk: return
+            received += len(chunk)
+        # recorded delays count from the write completing the wait
+        if t_anchor is None: t_anchor = time.time() - t_write
+        if realtime:
+            t_wait = t_anchor + t - time.time()
+            if t_wait > 0: time.sleep(t_wait)
+        if kind == READ:
+            while data:
+                data = data[os.write(outfd, data):]
+        elif kind == EOF:
+            return
+        elif kind == CLOSE:
+            # agent closed pty, wait for hangup
+            while True:
+                select.select([infd], [], [])
+                try:
+                    if not os.read(infd, 4096): return
+                except OSError:
+                    return
+
+
+def info(path):
+    lines = []
+    for index, (argv, records) in enumerate(read_sessions(path)):
+        counts = dict((name, 0) for name in KIND_NAMES)
+        nbytes = dict((name, 0) for name in KIND_NAMES)
+        for kind, t, data in records:
+            counts[KIND_NAMES[kind]] += 1
+            nbytes[KIND_NAMES[kind]] += len(data)
+        duration = records[-1][1] - records[0][1] if records else 0.0
+        lines.append('Session %d: %s, %.3f sec, %d reads %d bytes, %d writes %d bytes, end: %s'
+                     %(index, ' '.join(argv), duration, counts['READ'], nbytes['READ'], counts['WRITE'],
+                       nbytes['WRITE'], 'CLOSE' if counts['CLOSE'] else 'EOF' if counts['EOF'] else 'NONE'))
+    return os.linesep.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pty session record and replay.')
+    parser.add_argument('action', choices=['info', 'play'], help='show record info or replay a session.')
+    parser.add_argument('path', help='pty record file.')
+    parser.add_argument('--session', type=int, default=0, help='index of session to replay.')
+    parser.add_argument('--realtime', action='store_true', help='keep recorded delays on replay.')
+    opts = parser.parse_args()
+    if opts.action == 'info':
+        print(info(opts.path))
+        sys.exit(0)
+    argv, records = read_sessions(opts.path)[opts.session]
+    saved = termios.tcgetattr(0) if os.isatty(0) else None
+    # raw mode, recorded reads already carry the echo of recorded terminal
+    if saved: tty.setraw(0, termios.TCSANOW)
+    try:
+        play(records, realtime=opts.realtime)
+    finally:
+        if saved: termios.tcsetattr(0, termios.TCSANOW, saved)
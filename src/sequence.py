@@ -1,23 +1,39 @@
 import os
 from os import linesep as newline
-import re
-
-from agent import (connect_commands,
-                   waitpassphrase_command_pattern)
+import sys
+import marshal
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import (ProcessPoolExecutor,
+                                wait,
+                                FIRST_COMPLETED)
+
+from agent import connect_commands
 from const import (seq_comment_header,
                    seq_continue_nextline,
                    seq_item_delimiter,
                    seq_subitem_delimiter,
+                   seq_escape_fail_fast,
                    sequence_file_entry,
-                   builtin_monitor_interval)
-from builtin import (BuiltinCommand,
+                   builtin_monitor_interval,
+                   seq_cache_enabled,
+                   seq_cache_dir,
+                   seq_preflight_parallel_files)
+from builtin import (SendCommand,
+                     COMMAND_ACTION_MAPPING,
+                     command_record,
                      match_builtin_command)
 
 import utils
 from utils import SequenceError
 
 
-SUBSEQUENCES = {}
+PROGRAMS = {}       # compiled sequence programs loaded by this process, by sequence file path
+
+# bump when parsed commands change for same sequence text, to drop stale caches
+SEQUENCE_CACHE_VERSION = 3
+SEQUENCE_CACHE_MAGIC = 'UCSSEQ%d-py%d.%d' %(SEQUENCE_CACHE_VERSION, sys.version_info[0], sys.version_info[1])
 
 
 def sequence_check_builtin_syntax(word, line, limit, count):
@@ -40,6 +56,8 @@ def sequence_expect_parser(expect_info):
 
     if len(expects) == 1 and 'PROMPT' in expects: return None
 
+    for expect in expects: utils.check_pattern(expect)
+
     return expects
 
 # parse escape info
@@ -50,10 +68,21 @@ def sequence_escape_parser(escape_info):
     else:
         escapes = []
 
+    escapes = [x for x in escapes if x.strip() != seq_escape_fail_fast]
     if not escapes: return None
 
+    for escape in escapes: utils.check_pattern(escape)
+
     return escapes
 
+# parse escape info for fail fast mode, escapes are checked while command output streams in
+def sequence_fail_fast_parser(escape_info):
+    if not escape_info: return False
+
+    escapes = utils.sequence_item_split(escape_info, seq_subitem_delimiter)
+
+    return any(x.strip() == seq_escape_fail_fast for x in escapes)
+
 # parse sequence lines
 def sequence_line_parser(line):
     # skip empty lines
@@ -66,8 +95,8 @@ def sequence_line_parser(line):
     #seq_cmd_args = [x for x in seq_items[0].split(' ') if x]
     seq_cmd_args = utils.sequence_item_split(seq_items[0], ' ')
     cmd_keyword = seq_cmd_args[0] if seq_cmd_args else 'SEND-ENTER'
-    # initialize sequence command instance
-    seq_cmd_inst = BuiltinCommand()
+    # collect sequence command fields, record of its action kind is built at last
+    seq_cmd_inst = {}
     seq_cmd_inst['command'] = ' '.join(seq_cmd_args)
     seq_cmd_inst['argv'] = seq_cmd_args
     seq_cmd_inst['builtin'] = False
@@ -108,20 +137,18 @@ def sequence_line_parser(line):
             # parse 'SUBSEQUENCE' arguments
             elif seq_cmd_inst['action'] == 'SUBSEQUENCE':
                 if len(seq_cmd_args) > 1:
-                    seq_cmd_inst.subsequence_name = seq_cmd_args[1]
-                    if seq_cmd_inst.subsequence_name not in SUBSEQUENCES:
-                        SUBSEQUENCES[seq_cmd_inst.subsequence_name] = {}
-                return seq_cmd_inst
+                    seq_cmd_inst['subsequence_name'] = seq_cmd_args[1]
+                return command_record(seq_cmd_inst)
             # parse 'LOOP' arguments
             elif seq_cmd_inst['action'] == 'LOOP':
                 seq_cmd_inst['subsequence_name'] = seq_cmd_args[1]
                 seq_cmd_inst['loops'] = int(seq_cmd_args[2]) if len(seq_cmd_args) > 2 else 1
 
     # check line item count
-    if seq_cmd_inst.builtin:
-        sequence_check_builtin_syntax(seq_cmd_inst.command, line, 4, seq_item_count)
+    if seq_cmd_inst['builtin']:
+        sequence_check_builtin_syntax(seq_cmd_inst['command'], line, 4, seq_item_count)
     else:
-        sequence_check_normal_syntax(seq_cmd_inst.command, line, 4, seq_item_count)
+        sequence_check_normal_syntax(seq_cmd_inst['command'], line, 4, seq_item_count)
 
     # PARSE CONNECTION COMMANDS
     if cmd_keyword in connect_commands:
@@ -135,7 +162,6 @@ def sequence_line_parser(line):
                 seq_items = seq_items[:-1]
             except ValueError:
                 pass
-        seq_cmd_inst['timeout'] = seq_cmd_inst['timeout']
         login_info = g(seq_items, 1)
         expect_info = g(seq_items, 2)
         escape_info = g(seq_items, 3)
@@ -145,13 +171,13 @@ def sequence_line_parser(line):
         seq_cmd_inst['boot_expect'] = sequence_expect_parser(expect_info)
         seq_cmd_inst['boot_escape'] = sequence_escape_parser(escape_info)
 
-        if seq_cmd_inst['user']:
+        if seq_cmd_inst.get('user'):
             seq_cmd_inst['password'] = info2 if info2 else info1
         else:
             seq_cmd_inst['user'] = info1.strip() if info1 else info1
             seq_cmd_inst['password'] = info2
 
-        if cmd_keyword == 'ssh' and '@' not in seq_cmd_args[1] and seq_cmd_inst['user']:
+        if cmd_keyword == 'ssh' and '@' not in seq_cmd_args[1] and seq_cmd_inst.get('user'):
             seq_cmd_inst['argv'][1] = seq_cmd_inst['user'] + '@' + seq_cmd_args[1]
             seq_cmd_inst['command'] = ' '.join(seq_cmd_inst['argv'])
 
@@ -164,64 +190,308 @@ def sequence_line_parser(line):
                     seq_items = seq_items[:-1]
                 except ValueError:
                     pass
-            seq_cmd_inst['timeout'] = seq_cmd_inst['timeout']
             expect_info = g(seq_items, 1)
             escape_info = g(seq_items, 2)
             seq_cmd_inst['expect'] = sequence_expect_parser(expect_info)
             seq_cmd_inst['escape'] = sequence_escape_parser(escape_info)
+            seq_cmd_inst['fail_fast'] = sequence_fail_fast_parser(escape_info)
 
-    return seq_cmd_inst
+    return command_record(seq_cmd_inst)
 
 
 def sequence_finalize(test_seq):
     for index, item in enumerate(test_seq):
-        # commands which will run in background mode
-        if item['action'] == 'SEND':
-            test_seq[index]['bg_run'] = True if item['command'][-1] == '&' else False
-        # command needs to wait for passphrase, which means the prompt will be invisible.
-        if item['expect'] is not None and \
-                len(item['expect']) == 1 and \
-                re.search(waitpassphrase_command_pattern, item['expect'][0], re.I):
-            test_seq[index]['command_wait_passphrase'] = True
-            # pass phrase is invisible in Pty terminal.
-            test_seq[index+1]['text_invisible'] = True
+        # pass phrase is invisible in Pty terminal.
+        if isinstance(item, SendCommand) and item.command_wait_passphrase and index+1 < len(test_seq):
+            test_seq[index+1].text_invisible = True
+
+
+def sequence_statements(fp):
+    """Yield (line number, statement) read from sequence file, comments are
+    removed and continued lines joined, line number is the statement's first."""
+    preserved_line = ''
+    first_lineno = 0
+    for lineno, line in enumerate(fp, 1):
+        line = utils._str(line)
+        # skip sequence comments
+        seq_comment_header_pos = line.find(seq_comment_header)
+        if seq_comment_header_pos >= 0:
+            line = line[0 : seq_comment_header_pos]
+        # strip ' \n' in right side for all lines, put ';' to the end of line for expect_info
+        line = line.rstrip()
+
+        if not line: continue
+
+        if not preserved_line: first_lineno = lineno
+        if line[-1] == seq_continue_nextline:
+            preserved_line = preserved_line + line[0:-1]
+        else:
+            yield first_lineno, preserved_line + line
+            preserved_line = ''
 
 
-def sequence_reader(sequence_file):
+def sequence_compile(sequence_file):
+    """Parse sequence file, return (commands, subsequence marks), a mark is
+    (subsequence name, index of command it's placed before). Statements are
+    parsed as they are read, errors are raised with file and line number."""
     if not os.path.exists(sequence_file):
         raise OSError('sequence file [%s] not found' %(sequence_file))
 
     test_seq = []
+    marks = []
     with open(sequence_file, mode='r') as fp:
-        preserved_line = ''
-        for line in fp:
-            line = utils._str(line)
-            # skip sequence comments
-            seq_comment_header_pos = line.find(seq_comment_header)
-            if seq_comment_header_pos >= 0:
-                line = line[0 : seq_comment_header_pos]
-            # strip ' \n' in right side for all lines, put ';' to the end of line for expect_info
-            line = line.rstrip()
-
-            if not line: continue
-
-            if line[-1] == seq_continue_nextline:
-                preserved_line = preserved_line + line[0:-1]
-            else:
-                if preserved_line:
-                    line = preserved_line + line
-                    preserved_line = ''
+        for lineno, line in sequence_statements(fp):
+            try:
                 inst = sequence_line_parser(line)
-
-                if inst:
-                    if inst.action == 'SUBSEQUENCE' and inst.subsequence_name in SUBSEQUENCES:
-                        if 'start' in SUBSEQUENCES[inst.subsequence_name]:
-                            SUBSEQUENCES[inst.subsequence_name]['end'] = len(test_seq)
-                        else:
-                            SUBSEQUENCES[inst.subsequence_name]['start'] = len(test_seq)
-                    else:
-                        test_seq.append(inst)
+            except SequenceError as err:
+                raise SequenceError('%s:%d: %s' %(sequence_file, lineno, err))
+            except IndexError:
+                raise SequenceError('%s:%d: Missing arguments: %s' %(sequence_file, lineno, line))
+            except ValueError as err:
+                raise SequenceError('%s:%d: Invalid argument: %s, %s' %(sequence_file, lineno, line, err))
+
+            if inst:
+                if inst.action == 'LOOP': inst.lineno = lineno
+                if inst.action == 'SUBSEQUENCE' and inst.subsequence_name:
+                    marks.append((inst.subsequence_name, len(test_seq)))
+                elif inst.action != 'SUBSEQUENCE':
+                    test_seq.append(inst)
 
     sequence_finalize(test_seq)
 
-    return test_seq
+    return test_seq, marks
+
+
+def sequence_cache_path(sequence_file):
+    folder = seq_cache_dir or os.path.join(os.path.dirname(sequence_file), '__seqcache__')
+    name = os.path.basename(sequence_file)
+    # cache folder may be shared by sequences of different folders
+    if seq_cache_dir: name = hashlib.sha1(os.path.abspath(sequence_file).encode()).hexdigest()[:12] + '_' + name
+    return os.path.join(folder, name + '.cache')
+
+
+def sequence_cache_key():
+    """Parser settings compiled commands depend on, besides sequence text."""
+    return repr((SEQUENCE_CACHE_MAGIC, seq_comment_header, seq_continue_nextline, seq_item_delimiter,
+                 seq_subitem_delimiter, seq_escape_fail_fast, builtin_monitor_interval,
+                 sequence_file_entry[:sequence_file_entry.rfind(os.sep)+1],
+                 sorted(COMMAND_ACTION_MAPPING.items())))
+
+
+def sequence_dump(sequence_file, test_seq, marks, stat, digest):
+    """Store compiled sequence in cache, atomically, a failed store only skips caching."""
+    path = sequence_cache_path(sequence_file)
+    # matchers aren't fields, records compile them from expects and escapes when first used
+    commands = [cmd.cmd_dict for cmd in test_seq]
+    temp = '%s.%d.tmp' %(path, os.getpid())
+    try:
+        data = marshal.dumps((sequence_cache_key(), stat.st_mtime_ns, stat.st_size, digest, marks, commands))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp, mode='wb') as fp:
+            fp.write(data)
+        os.replace(temp, path)
+    except (OSError, ValueError):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        return None
+    return path
+
+
+def sequence_load(sequence_file, stat):
+    """Load compiled sequence from cache, return (commands, marks, digest), commands
+    is None if cache is missing or stale. A cache with the same mtime and size as
+    sequence file is used as is, otherwise it's used if sequence text hash matches,
+    digest of sequence text is returned then."""
+    digest = None
+    try:
+        with open(sequence_cache_path(sequence_file), mode='rb') as fp:
+            key, mtime, size, cached_digest, marks, commands = marshal.loads(fp.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None, None, digest
+    if key != sequence_cache_key(): return None, None, digest
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        digest = sequence_digest(sequence_file)
+        if digest != cached_digest: return None, None, digest
+    test_seq = []
+    for fields in commands:
+        test_seq.append(command_record(fields))
+    return test_seq, [tuple(mark) for mark in marks], digest
+
+
+def sequence_digest(sequence_file):
+    with open(sequence_file, mode='rb') as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def sequence_read(sequence_file, stat):
+    """Read sequence file through compiled sequence cache, return (commands, marks)."""
+    if not seq_cache_enabled: return sequence_compile(sequence_file)
+
+    test_seq, marks, digest = sequence_load(sequence_file, stat)
+    if test_seq is None:
+        test_seq, marks = sequence_compile(sequence_file)
+        sequence_dump(sequence_file, test_seq, marks, stat, digest or sequence_digest(sequence_file))
+    elif digest:
+        # sequence file touched only, refresh mtime in cache
+        sequence_dump(sequence_file, test_seq, marks, stat, digest)
+
+    return test_seq, marks
+
+
+class SequenceProgram(object):
+    """Compiled sequence file, commands with subsequence table of its own,
+    subsequence name to (start, end) of its body in commands. First mark of
+    a subsequence is its start, next is its end, a subsequence without end
+    isn't defined."""
+    def __init__(self, sequence_file, commands, marks, stat=None):
+        self.sequence_file = sequence_file
+        self.commands = commands
+        self.marks = marks
+        self.stat = (stat.st_mtime_ns, stat.st_size) if stat else None
+        self.subsequences = {}
+        starts = {}
+        for name, index in marks:
+            if name in starts: self.subsequences[name] = (starts[name], index)
+            else: starts[name] = index
+    
+    @property
+    def children(self):
+        """Sequence files started by RUN-SEQUENCE commands."""
+        return [command.sequence_file for command in self.commands if command.action == 'NEW_WORKER']
+    
+    def check(self):
+        """Return problems found in program, LOOP of undefined subsequence and
+        subsequences looping each other, each with file and line of its LOOP."""
+        problems = []
+        loops = dict((name, []) for name in self.subsequences)
+        lines = {}
+        for index, command in enumerate(self.commands):
+            if command.action != 'LOOP': continue
+            if command.subsequence_name not in self.subsequences:
+                problems.append('%s:%d: LOOP of undefined subsequence: %s' %(self.sequence_file, command.lineno,
+                                                                            command.subsequence_name))
+                continue
+            # LOOPs inside a subsequence body run each time it runs
+            for name, (start, end) in self.subsequences.items():
+                if start <= index < end:
+                    loops[name].append(command.subsequence_name)
+                    lines.setdefault((name, command.subsequence_name), command.lineno)
+        cycle = sequence_find_cycle(loops)
+        if cycle:
+            # LOOP closing the cycle
+            problems.append('%s:%d: LOOP never ends: %s' %(self.sequence_file, lines[(cycle[-2], cycle[-1])],
+                                                           ' -> '.join(cycle)))
+        return problems
+    
+    def __repr__(self):
+        return '%s: %d commands, subsequences: %r' %(self.sequence_file, len(self.commands), self.subsequences)
+
+
+def sequence_program(sequence_file):
+    """Compiled program of sequence file, loaded once by a process and reloaded
+    if sequence file changes."""
+    try:
+        stat = os.stat(sequence_file)
+    except OSError:
+        raise OSError('sequence file [%s] not found' %(sequence_file))
+    program = PROGRAMS.get(sequence_file)
+    if program and program.stat == (stat.st_mtime_ns, stat.st_size): return program
+    test_seq, marks = sequence_read(sequence_file, stat)
+    program = PROGRAMS[sequence_file] = SequenceProgram(sequence_file, test_seq, marks, stat)
+    return program
+
+
+def sequence_reader(sequence_file):
+    return sequence_program(sequence_file).commands
+
+
+def sequence_find_cycle(graph):
+    """Return a cycle of graph, node to its next nodes, as node list, None if
+    there isn't any."""
+    visited = set()
+    for root in graph:
+        if root in visited: continue
+        path = [root]
+        stack = [iter(graph.get(root) or ())]
+        visited.add(root)
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                path.pop()
+            elif node in path:
+                return path[path.index(node):] + [node]
+            elif node not in visited:
+                visited.add(node)
+                path.append(node)
+                stack.append(iter(graph.get(node) or ()))
+    return None
+
+
+def sequence_inspect(sequence_file):
+    """Load and check sequence file, return (RUN-SEQUENCE children, problems)."""
+    try:
+        program = sequence_program(sequence_file)
+    except (SequenceError, OSError) as err:
+        return [], [str(err)]
+    return program.children, program.check()
+
+
+def sequence_preflight(sequence_file, workers=None, parallel_files=seq_preflight_parallel_files):
+    """Resolve sequence tree of entry sequence file before it runs, every file
+    reached by RUN-SEQUENCE is loaded and checked as it's found. Files are
+    loaded in this process, their programs are kept for the run, once more
+    than ``parallel_files`` files are found, the rest is loaded by up to
+    ``workers`` forked processes, only with sequence cache, which carries
+    their work to sequence workers. Raise SequenceError with all problems
+    found, return children of each file."""
+    children = {sequence_file: None}
+    parents = {}
+    problems = []
+
+    def resolve(path, inspected):
+        """Record inspected file, return children not found before."""
+        found, errors = inspected
+        children[path] = found
+        if path in parents: errors = ['%s (RUN-SEQUENCE in %s)' %(e, parents[path]) for e in errors]
+        problems.extend(errors)
+        new_children = [child for child in found if child not in children]
+        for child in new_children:
+            children[child] = None
+            parents[child] = path
+        return new_children
+
+    # one process per CPU at most, a single one loads no faster than this one
+    workers = min(workers or 1, os.cpu_count() or 1)
+    pending = [sequence_file]
+    while pending and not (workers > 1 and seq_cache_enabled and len(children) > parallel_files):
+        path = pending.pop(0)
+        pending.extend(resolve(path, sequence_inspect(path)))
+    if pending:
+        # forked processes keep settings from command line
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(sequence_inspect, path): path for path in pending}
+            while futures:
+                done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for child in resolve(futures.pop(future), future.result()):
+                        futures[executor.submit(sequence_inspect, child)] = child
+    cycle = sequence_find_cycle(children)
+    if cycle: problems.append('RUN-SEQUENCE never ends: %s' %(' -> '.join(cycle)))
+    if problems: raise SequenceError(newline.join(problems))
+    return children
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile sequence files into sequence cache ahead of running.')
+    parser.add_argument('files', nargs='+', help='sequence files to compile.')
+    opts = parser.parse_args()
+    for sequence_file in opts.files:
+        stat = os.stat(sequence_file)
+        test_seq, marks = sequence_compile(sequence_file)
+        path = sequence_dump(sequence_file, test_seq, marks, stat, sequence_digest(sequence_file))
+        print('%s: %d commands, %d subsequence marks, cache: %s' %(sequence_file, len(test_seq), len(marks),
+                                                                    path or 'NOT WRITABLE'))
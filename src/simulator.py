@@ -0,0 +1,392 @@
+"""UCS target simulator, emulates the consoles UCS AutoRobot agent works with
+inside a pty, no UCS server is required:
+
+    python simulator.py [options] ssh|telnet|connect|solshell|shell [args ...]
+
+Sessions emulated are Linux shells behind ssh and telnet login, serial port
+consoles behind telnet with '\\r' line-wrap quirks, Cisco SOL consoles behind
+connect/solshell, and bmc_diag/efi_diag/i2c_uart intershells started from any
+shell. Sessions nest, connect commands issued inside a session open a new
+session, 'exit' or escape characters return to previous session.
+
+Install shims to run the agent against simulator, then prepend DIR to PATH:
+
+    python simulator.py [options] --install-shims DIR"""
+import os
+import sys
+import time
+import select
+import shlex
+import argparse
+import tty
+import termios
+from collections import deque
+
+from const import base_serial_port
+
+
+SHIMS = ('ssh', 'telnet', 'connect', 'solshell')
+SOL_BANNER = 'CISCO Serial Over LAN:\r\nPress Ctrl+x to Exit the session\r\n'
+LISTING = 'diag.log  udibmc_m6.stripped  Dsh.efi  i2c_uart  test.seq'
+INTERSHELLS = {
+    # name: (image suffix, prompt, exit command, exit control char)
+    'bmc_diag': ('udibmc_m6.stripped', 'udibmc_m6.stripped % ', 'exit', None),
+    'efi_diag': ('Dsh.efi', 'Dsh> ', 'exit', None),
+    'i2c_uart': ('i2c_uart', 'i2c-uart# ', None, '\x10'),
+}
+
+
+class Session(object):
+    """One emulated console session, state is one of 'yesno', 'login', 'password',
+    'wait_enter', 'shell' and 'telnet_escape'."""
+    def __init__(self, kind, host='localhost', user='root', serial=False, intershell=None):
+        self.kind = kind
+        self.host = host
+        self.user = user or 'root'
+        self.serial = serial
+        self.intershell = intershell
+        self.cwd = '~'
+        self.state = 'shell'
+        self.escape_pending = False
+
+    @property
+    def hostname(self):
+        return 'ucs-' + self.host.replace('.', '-')
+
+    @property
+    def prompt(self):
+        if self.state == 'telnet_escape': return 'telnet> '
+        if self.intershell: return INTERSHELLS[self.intershell][1]
+        if self.kind == 'shell': return 'sim$ '
+        return '[%s@%s %s]%s ' %(self.user, self.hostname, self.cwd, '#' if self.user == 'root' else '$')
+
+
+class Simulator(object):
+    """Session stack driven by pty input, returns output to write. Commands
+    with output latency or duration run as a job, input typed meanwhile is
+    echoed and queued, Ctrl+C cancels the job."""
+    def __init__(self, latency=0.0, output_size=4096, columns=80, yes_no=False, password=None):
+        self.latency = latency
+        self.output_size = output_size
+        self.columns = columns
+        self.yes_no = yes_no
+        self.password = password
+        self.stack = []
+        self.line = ''
+        self.column = 0
+        self.last_cr = False
+        self.job = None         # [t_end, output, t_next_repeat, repeat_interval, repeat_text]
+        self.queued = deque()
+        self.out = []
+
+    @property
+    def session(self):
+        return self.stack[-1] if self.stack else None
+
+    @property
+    def finished(self):
+        return not self.stack
+
+    def emit(self, text):
+        self.out.append(text)
+        # column tracks where serial console echo wraps
+        pos = max(text.rfind('\n'), text.rfind('\r'))
+        self.column = len(text) - pos - 1 if pos >= 0 else self.column + len(text)
+
+    def take_output(self):
+        out = ''.join(self.out)
+        self.out = []
+        return out
+
+    def show_prompt(self):
+        if self.session: self.emit(self.session.prompt)
+
+    def open_session(self, kind, args):
+        """Start a session for connect command ``kind`` with its arguments."""
+        hosts = [x for x in args if not x.startswith('-')]
+        target = hosts[0] if hosts else '10.0.0.1'
+        user, _, host = target.rpartition('@')
+        if kind == 'ssh':
+            if '-l' in args and args.index('-l') + 1 < len(args): user = args[args.index('-l')+1]
+            session = Session('ssh', host=host, user=user or 'root')
+            self.stack.append(session)
+            if self.yes_no:
+                session.state = 'yesno'
+                self.emit("The authenticity of host '%s (%s)' can't be established.\r\n"
+                          "ECDSA key fingerprint is SHA256:x2Eo4Ih5zd1nFm6pS9Rk0fY7bQ.\r\n"
+                          "Are you sure you want to continue connecting (yes/no)? " %(host, host))
+            else:
+                session.state = 'password'
+                self.emit("%s@%s's password: " %(session.user, host))
+        elif kind == 'telnet':
+            port = int(hosts[1]) if len(hosts) > 1 and hosts[1].isdigit() else 23
+            session = Session('telnet', host=host, serial=(port >= base_serial_port))
+            self.stack.append(session)
+            self.emit("Trying %s...\r\nConnected to %s.\r\nEscape character is '^]'.\r\n" %(host, host))
+            if session.serial:
+                session.state = 'wait_enter'
+            else:
+                session.state = 'login'
+                self.emit('\r\n%s login: ' %(session.hostname))
+        elif kind in ('connect', 'solshell'):
+            session = Session('sol', host=host if hosts else 'sol-host', serial=True)
+            session.state = 'wait_enter'
+            self.stack.append(session)
+            self.emit(SOL_BANNER)
+        else:
+            self.stack.append(Session('shell'))
+            self.show_prompt()
+
+    def close_session(self, message=''):
+        closed = self.stack.pop()
+        if message: self.emit(message)
+        elif closed.intershell is None and closed.kind != 'shell':
+            self.emit('Connection to %s closed.\r\n' %(closed.host))
+        self.show_prompt()
+
+    def start_job(self, output, duration=0.0, repeat_interval=0.0, repeat_text=''):
+        """Emit command output and prompt after latency and duration, or emit
+        ``repeat_text`` every ``repeat_interval`` seconds until interrupted."""
+        t_now = time.time()
+        if repeat_interval:
+            self.emit(repeat_text)
+            self.job = [float('inf'), '', t_now + repeat_interval, repeat_interval, repeat_text]
+            return
+        delay = self.latency + duration
+        if delay <= 0:
+            self.emit(output)
+            self.show_prompt()
+            return
+        self.job = [t_now + delay, output, None, 0, '']
+
+    def tick(self):
+        """Progress running job, return seconds until next job event or None."""
+        if not self.job: return None
+        t_now = time.time()
+        t_end, output, t_next, interval, text = self.job
+        if interval and t_now >= t_next:
+            self.emit(text)
+            t_next = self.job[2] = t_now + interval
+        if t_now >= t_end:
+            self.job = None
+            self.emit(output)
+            self.show_prompt()
+            while self.queued and not self.job and self.stack: self.enter(self.queued.popleft())
+            return self.tick()
+        return max((min(t_end, t_next) if interval else t_end) - t_now, 0)
+
+    def feed(self, data):
+        """Process input characters, return output to write."""
+        for ch in data:
+            session = self.session
+            if session is None: break
+            was_cr, self.last_cr = self.last_cr, (ch == '\r')
+            if ch == '\n' and was_cr and session.serial: continue
+            if ch in '\r\n':
+                line, self.line = self.line, ''
+                if session.state != 'password': self.emit('\r\n')
+                if self.job: self.queued.append(line)
+                else: self.enter(line)
+            elif ch == '\x03':
+                self.line = ''
+                self.queued.clear()
+                self.job = None
+                if session.state == 'telnet_escape': session.state = 'shell'
+                self.emit('^C\r\n')
+                self.show_prompt()
+            elif ch == '\x1d' and session.kind == 'telnet':
+                session.state = 'telnet_escape'
+                self.emit('\r\n')
+                self.show_prompt()
+            elif ch == '\x18' and session.kind == 'sol' and not session.intershell:
+                self.line = ''
+                self.close_session('\r\n')
+            elif ch == '\x10' and session.intershell and INTERSHELLS[session.intershell][3] == ch:
+                session.escape_pending = True
+            elif ch in '\x7f\x08':
+                if self.line:
+                    self.line = self.line[:-1]
+                    self.emit('\b \b')
+            elif ch >= ' ':
+                if session.escape_pending and ch == 'd':
+                    session.escape_pending = False
+                    self.close_session('\r\n')
+                    continue
+                self.line += ch
+                if session.state != 'password':
+                    # serial console flushes a '\r' once its line buffer overflows
+                    if session.serial and self.column >= self.columns: self.emit('\r')
+                    self.emit(ch)
+        return self.take_output()
+
+    def enter(self, line):
+        session = self.session
+        state = session.state
+        if state == 'yesno':
+            if line.strip() == 'yes':
+                session.state = 'password'
+                self.emit("Warning: Permanently added '%s' (ECDSA) to the list of known hosts.\r\n" %(session.host))
+                self.emit("%s@%s's password: " %(session.user, session.host))
+            else:
+                self.close_session('Host key verification failed.\r\n')
+        elif state == 'login':
+            session.user = line.strip() or session.user
+            session.state = 'password'
+            self.emit('Password: ')
+        elif state == 'password':
+            self.emit('\r\n')
+            if self.password is not None and line != self.password:
+                self.emit('Permission denied, please try again.\r\n' if session.kind == 'ssh' else 'Login incorrect\r\n')
+                self.emit("%s@%s's password: " %(session.user, session.host) if session.kind == 'ssh' else 'Password: ')
+                return
+            session.state = 'shell'
+            self.emit('Last login: Mon Apr 13 17:34:58 2026 from 10.0.0.254\r\n')
+            self.show_prompt()
+        elif state == 'wait_enter':
+            session.state = 'shell'
+            self.show_prompt()
+        elif state == 'telnet_escape':
+            if line.strip() in ('q', 'quit'):
+                self.close_session('Connection closed.\r\n')
+            else:
+                session.state = 'shell'
+                self.show_prompt()
+        elif session.intershell:
+            self.run_intershell(line)
+        else:
+            self.run_shell(line)
+
+    def dump(self, size):
+        lines = []
+        count = 0
+        while count < size:
+            line = 'Test %06d  memory pattern walk ....... PASS' %(len(lines))
+            lines.append(line)
+            count += len(line) + 2
+        return ''.join(x + '\r\n' for x in lines)
+
+    def run_intershell(self, line):
+        session = self.session
+        words = line.split()
+        if not words: return self.show_prompt()
+        if words[0] == INTERSHELLS[session.intershell][2]: return self.close_session('\r\n')
+        if words[0] == 'dump': return self.start_job(self.dump(int(words[1]) if len(words) > 1 else self.output_size))
+        self.start_job('%s: OK\r\n' %(words[0]))
+
+    def run_shell(self, line):
+        session = self.session
+        try:
+            words = shlex.split(line)
+        except ValueError:
+            words = line.split()
+        if not words: return self.show_prompt()
+        cmd = words[0]
+        for name, (image, prompt, exit_cmd, exit_char) in INTERSHELLS.items():
+            if cmd.split('/')[-1] == image:
+                self.stack.append(Session(session.kind, host=session.host, user=session.user,
+                                          serial=session.serial, intershell=name))
+                return self.start_job('Starting %s ...\r\n' %(image))
+        if cmd in SHIMS:
+            return self.open_session(cmd, words[1:])
+        if cmd in ('exit', 'quit', 'logout'):
+            return self.close_session('logout\r\n' if session.kind != 'sol' else '\r\n')
+        if cmd == 'echo':
+            return self.start_job(' '.join(words[1:]) + '\r\n')
+        if cmd == 'cd':
+            session.cwd = (words[1].rstrip('/').split('/')[-1] or '/') if len(words) > 1 else '~'
+            return self.start_job('')
+        if cmd == 'pwd':
+            return self.start_job('/root\r\n')
+        if cmd == 'ls':
+            return self.start_job(LISTING + '\r\n')
+        if cmd in ('rm', 'true', 'stty', 'export'):
+            return self.start_job('')
+        if cmd == 'ping':
+            host = words[-1]
+            out = 'PING %s (%s) 56(84) bytes of data.\r\n' %(host, host)
+            out += ''.join('64 bytes from %s: icmp_seq=%d ttl=64 time=0.045 ms\r\n' %(host, i+1) for i in range(2))
+            return self.start_job(out, duration=0.01)
+        if cmd == 'ifconfig':
+            return self.start_job('%s\r\n' %(session.host))
+        if cmd == 'sleep':
+            try:
+                duration = float(words[1])
+            except (IndexError, ValueError):
+                duration = 0.0
+            return self.start_job('', duration=duration)
+        if cmd == 'while':
+            # pulse loop, runs until interrupted
+            return self.start_job('', repeat_interval=240.0, repeat_text='Hit CTRL+C\r\n')
+        if cmd == 'dump':
+            return self.start_job(self.dump(int(words[1]) if len(words) > 1 else self.output_size))
+        self.start_job('-bash: %s: command not found\r\n' %(cmd))
+
+
+def write_all(fd, data, baud=0):
+    data = data.encode('latin-1', 'replace')
+    # console line throughput, 10 bits per byte
+    chunk = max(baud//100, 1) if baud else len(data)
+    while data:
+        written = os.write(fd, data[:chunk])
+        data = data[written:]
+        if baud and data: time.sleep(written*10.0/baud)
+
+
+def install_shims(path, options):
+    """Write ssh/telnet/connect/solshell shell shims running simulator with ``options``."""
+    if not os.path.isdir(path): os.makedirs(path)
+    script = os.path.abspath(__file__)
+    for name in SHIMS:
+        shim = os.path.join(path, name)
+        with open(shim, mode='w') as fp:
+            fp.write('#!/bin/sh\nexec %s %s %s %s "$@"\n' %(shlex.quote(sys.executable), shlex.quote(script),
+                                                             ' '.join(shlex.quote(x) for x in options), name))
+        os.chmod(shim, 0o755)
+    return path
+
+
+def run(sim, kind, args, baud=0, infd=0, outfd=1):
+    if os.isatty(infd):
+        saved = termios.tcgetattr(infd)
+        # keep input typed before simulator starts, agent sends newline right after spawn
+        tty.setraw(infd, termios.TCSANOW)
+    else:
+        saved = None
+    try:
+        sim.open_session(kind, args)
+        write_all(outfd, sim.take_output(), baud)
+        while not sim.finished:
+            timeout = sim.tick()
+            out = sim.take_output()
+            if out: write_all(outfd, out, baud)
+            if sim.finished: break
+            if select.select([infd], [], [], timeout)[0]:
+                data = os.read(infd, 4096)
+                if not data: break
+                out = sim.feed(data.decode('latin-1'))
+                if out: write_all(outfd, out, baud)
+    finally:
+        if saved: termios.tcsetattr(infd, termios.TCSAFLUSH, saved)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UCS target simulator.')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before command output.')
+    parser.add_argument('--output-size', type=int, default=4096, help='bytes of output for dump command.')
+    parser.add_argument('--baud', type=int, default=0, help='console line speed in baud, 0 for unlimited.')
+    parser.add_argument('--columns', type=int, default=80, help='serial console width to wrap echo with \\r.')
+    parser.add_argument('--yes-no', action='store_true', help='ask ssh host key confirmation.')
+    parser.add_argument('--password', default=None, help='password to accept, any if not set.')
+    parser.add_argument('--install-shims', metavar='DIR', help='install connect command shims and exit.')
+    parser.add_argument('session', nargs='?', default='shell', help='ssh, telnet, connect, solshell or shell.')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='connect command arguments.')
+    opts = parser.parse_args()
+    if opts.install_shims:
+        options = ['--latency', str(opts.latency), '--output-size', str(opts.output_size), '--baud', str(opts.baud),
+                   '--columns', str(opts.columns)] + (['--yes-no'] if opts.yes_no else []) + \
+                  (['--password', opts.password] if opts.password is not None else [])
+        print(install_shims(opts.install_shims, options))
+        sys.exit(0)
+    simulator = Simulator(latency=opts.latency, output_size=opts.output_size, columns=opts.columns,
+                          yes_no=opts.yes_no, password=opts.password)
+    run(simulator, opts.session, opts.args, baud=opts.baud)
@@ -1,4 +1,5 @@
 import os
+import sys
 import argparse
 import const
 
@@ -21,6 +22,26 @@ parser.add_argument('-S', '--stop-on-failure', dest='stop_on_failure',
                     action='store_true', help='set stop on failure.')
 parser.add_argument('-L', '--log-enabled', dest='log_enabled',
                     action='store_true', help='enable file logging.')
+parser.add_argument('-Z', '--log-compression', dest='log_compression', default=const.log_compression,
+                    choices=['gzip', 'lzma', 'none'], help='set sequence log compression.')
+parser.add_argument('-R', '--log-rotate-loops', metavar='Loops', dest='log_rotate_loops',
+                    default=const.log_rotate_loops, type=int, help='set test loops per sequence log segment.')
+parser.add_argument('-K', '--log-keep-segments', metavar='Segments', dest='log_keep_segments',
+                    default=const.log_keep_segments, type=int,
+                    help='keep only latest segments of each sequence log, oldest are removed, all kept if not set.')
+parser.add_argument('-P', '--record-pty', dest='pty_record', action='store_true',
+                    help='record pty byte streams of workers.')
+parser.add_argument('--replay', metavar='Record file', dest='pty_replay', default='',
+                    help='replay pty record file for entry sequence instead of connecting.')
+parser.add_argument('--replay-realtime', dest='pty_replay_realtime', action='store_true',
+                    help='keep recorded delays on replay.')
+parser.add_argument('-W', '--workers', metavar='Workers', dest='max_sequences', default=const.max_sequences,
+                    type=int, help='set worker processes to run sequences.')
+parser.add_argument('-A', '--async-hubs', metavar='Hubs', dest='async_hubs', nargs='?', const=1,
+                    default=const.async_hubs, type=int,
+                    help='run all sequences as asyncio tasks of hub processes, 1 hub if no number given.')
+parser.add_argument('--no-sequence-cache', dest='seq_cache_enabled', action='store_false',
+                    help='parse sequence files every time instead of using compiled sequence cache.')
 parser.add_argument('-D', '--debug-mode', dest='debug_mode_on',
                     action='store_true', help='enable debug mode.')
 #parser.add_argument('-P', '--print-window-message', dest='print_window_message',
@@ -35,6 +56,15 @@ const.log_enabled = cmd_options.log_enabled
 const.stop_on_failure = cmd_options.stop_on_failure
 const.loop_iterations = cmd_options.loop
 const.debug_mode_on = cmd_options.debug_mode_on
+const.log_compression = cmd_options.log_compression if cmd_options.log_compression != 'none' else None
+const.log_rotate_loops = cmd_options.log_rotate_loops
+const.log_keep_segments = max(cmd_options.log_keep_segments, 0)
+const.pty_record = cmd_options.pty_record
+const.pty_replay = cmd_options.pty_replay
+const.pty_replay_realtime = cmd_options.pty_replay_realtime
+const.max_sequences = max(cmd_options.max_sequences, 1)
+const.async_hubs = max(cmd_options.async_hubs, 0)
+const.seq_cache_enabled = cmd_options.seq_cache_enabled
 #const.print_window_message = cmd_options.print_window_message
 
 # check files and folders
@@ -42,16 +72,29 @@ if not os.path.isdir('./test_sequences'): os.mkdir('./test_sequences')
 if not os.path.isdir('./log'): os.mkdir('./log')
 if not os.path.isdir('./log/failure'): os.mkdir('./log/failure')
 if not os.path.isdir('./log/errordump'): os.mkdir('./log/errordump')
+if not os.path.isdir('./log/events'): os.mkdir('./log/events')
+if not os.path.isdir('./log/record'): os.mkdir('./log/record')
 if not os.path.isdir('./csvdump'): os.mkdir('./csvdump')
 
 
 from worker import start_master
 from worker import run_sequence_worker
+from sequence import sequence_preflight
+from utils import SequenceError
 
 if __name__ == '__main__':
     # Display tool information before launching
     print('\n%s, Version: %s' %(NAME, VERSION))
     print('Cisco UCS Server Testing Automation Tool.')
     print('Author: ' + AUTHOR)
+    # resolve whole sequence tree before first command runs, debug mode runs
+    # in this process only, a large tree is loaded in parallel otherwise
+    try:
+        sequence_tree = sequence_preflight(const.sequence_file_entry,
+                                           workers=None if const.debug_mode_on else const.max_sequences)
+    except (SequenceError, OSError) as err:
+        print('Sequence preflight failed:%s%s' %(os.linesep, err))
+        sys.exit(1)
+    print('Sequence preflight: %d sequence files resolved.' %(len(sequence_tree)))
     if const.debug_mode_on: run_sequence_worker(None, const.sequence_file_entry, loops=const.loop_iterations)
     else: start_master(const.sequence_file_entry, entry_running_loops=const.loop_iterations)
@@ -0,0 +1,149 @@
+import os
+import time
+import signal
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+
+from const import status_board_slots
+
+# fields of a worker slot, all stored as doubles
+SLOT_FIELDS = ('PID', 'TOTAL_LOOPS', 'PASS', 'FAIL', 'UNKNOWN', 'LOOP', 'LINE', 'HEARTBEAT', 'STATE', 'GEN')
+PID, TOTAL_LOOPS, PASS, FAIL, UNKNOWN, LOOP, LINE, HEARTBEAT, STATE, GEN = range(len(SLOT_FIELDS))
+
+# slot states, a sequence is active while QUEUED, RUNNING or WAITING
+STATE_NAMES = ('FREE', 'QUEUED', 'RUNNING', 'WAITING', 'COMPLETED', 'CANCELLED', 'CRASHED')
+FREE, QUEUED, RUNNING, WAITING, COMPLETED, CANCELLED, CRASHED = range(len(STATE_NAMES))
+ACTIVE_STATES = (QUEUED, RUNNING, WAITING)
+FINISHED_STATES = (COMPLETED, CANCELLED, CRASHED)
+
+
+class StatusSlot(object):
+    """Status counters of one worker, written by that worker only. A slot is
+    reused once its sequence finishes, a handle is bound to the generation
+    of the slot it is made for, and sees the slot FREE after it's reused."""
+    def __init__(self, board, index, generation=None):
+        self.board = board
+        self.index = index
+        self.offset = index*len(SLOT_FIELDS)
+        self.generation = board.values[self.offset+GEN] if generation is None else generation
+
+    def set(self, field, value):
+        self.board.values[self.offset+field] = value
+
+    def add(self, field, value=1):
+        self.board.values[self.offset+field] += value
+
+    def beat(self, line):
+        """Mark worker alive, running sequence line index ``line``."""
+        self.board.values[self.offset+LINE] = line
+        self.board.values[self.offset+HEARTBEAT] = time.time()
+
+    @property
+    def state(self):
+        if self.board.values[self.offset+GEN] != self.generation: return FREE
+        return int(self.board.values[self.offset+STATE])
+
+    def transition(self, from_states, to_state):
+        """Set slot state if it is one of from_states, return if it's set."""
+        with self.board.lock:
+            if self.state not in from_states: return False
+            self.set(STATE, to_state)
+            return True
+
+    def read(self):
+        return dict(zip(SLOT_FIELDS, self.board.values[self.offset:self.offset+len(SLOT_FIELDS)]))
+
+
+class StatusBoard(object):
+    """Shared memory array of worker status slots. Master creates the board
+    before workers are forked, a worker takes a slot for each sequence it
+    runs and updates it in place, master reads slots lock-free for display,
+    so loop results need no message. Values are read without locking, a
+    display may see counters one loop apart. Master releases slots of
+    finished sequences once it has read them, they are allocated again."""
+    def __init__(self, slots=status_board_slots):
+        self.slots = slots
+        self.shm = SharedMemory(create=True, size=slots*len(SLOT_FIELDS)*8)
+        self.values = self.shm.buf.cast('d')
+        self.allocated = Value('i', 0)
+        self.released = Value('i', 0, lock=False)
+        # guards slot allocation and state transitions
+        self.lock = self.allocated.get_lock()
+        self.owner = os.getpid()
+
+    def allocate(self, total_loops=0, state=RUNNING):
+        """Take a released or new slot, return None if the board is full."""
+        with self.lock:
+            if self.released.value:
+                index = next(i for i in range(self.allocated.value)
+                             if self.values[i*len(SLOT_FIELDS)+STATE] == FREE)
+                self.released.value -= 1
+            elif self.allocated.value < self.slots:
+                index = self.allocated.value
+                self.allocated.value += 1
+            else:
+                return None
+            offset = index*len(SLOT_FIELDS)
+            generation = self.values[offset+GEN] + 1
+            for field in range(len(SLOT_FIELDS)): self.values[offset+field] = 0
+            slot = StatusSlot(self, index, generation)
+            slot.set(GEN, generation)
+            slot.set(TOTAL_LOOPS, total_loops)
+            slot.set(HEARTBEAT, time.time())
+            slot.set(STATE, state)
+        return slot
+
+    def reuse(self, slot, total_loops=0, state=RUNNING):
+        """Take slot of a completed sequence again, counters carry on, return
+        False if it's released already."""
+        with self.lock:
+            if slot.state != COMPLETED: return False
+            slot.add(TOTAL_LOOPS, total_loops)
+            slot.set(HEARTBEAT, time.time())
+            slot.set(STATE, state)
+        return True
+
+    def release(self, index):
+        """Free slot of a finished sequence for reuse, return its field values,
+        None if it's not finished."""
+        with self.lock:
+            slot = StatusSlot(self, index)
+            if slot.state not in FINISHED_STATES: return None
+            values = slot.read()
+            slot.set(STATE, FREE)
+            self.released.value += 1
+        return values
+
+    def cancel(self, slot):
+        """Cancel sequence of slot, a queued one never starts, a running one
+        is killed with its worker process. PID of slot is the process running
+        the sequence, in pool mode it's the pool worker, it's killed with
+        SIGKILL like a worker process of its own, then master reaps it and
+        spawns a new pool worker. Sequences of hubs aren't cancelled here,
+        the hub cancels their tasks, see SequenceHub.cancel."""
+        with self.lock:
+            if slot.state == QUEUED:
+                slot.set(STATE, CANCELLED)
+            elif slot.state in (RUNNING, WAITING):
+                slot.set(STATE, CANCELLED)
+                # killed inside lock, worker can't move on to another slot meanwhile
+                try:
+                    os.kill(int(slot.read()['PID']), signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def active_slots(self):
+        """Slots of sequences queued or running."""
+        return [slot for slot in (StatusSlot(self, i) for i in range(self.allocated.value))
+                if slot.state in ACTIVE_STATES]
+
+    def slot(self, index, generation=None):
+        return StatusSlot(self, index, generation) if index is not None and 0 <= index < self.slots else None
+
+    def close(self):
+        if self.values is None: return
+        self.values.release()
+        self.values = None
+        self.shm.close()
+        # only creator removes shared memory
+        if os.getpid() == self.owner: self.shm.unlink()
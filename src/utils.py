@@ -3,9 +3,20 @@ import sys
 from os import linesep as newline
 import datetime
 import re
+import codecs
+import functools
+import itertools
+import mmap
+import tempfile
+from collections import namedtuple
 import subprocess
 from subprocess import Popen, PIPE
 
+from const import (pattern_cache_size,
+                   output_spill_threshold,
+                   output_excerpt_size,
+                   until_search_window)
+
 
 # Warnings that won't block test.
 #class SendWarning(Exception):
@@ -156,7 +167,8 @@ if PY3:
 
     def _str(text, encoding="utf-8", errors="ignore"):
         if isinstance(text, str): return text
-        return text.decode(encoding, errors=errors) if isinstance(text, bytes) else str(text)
+        if isinstance(text, (bytes, bytearray, memoryview)): return str(text, encoding, errors)
+        return str(text)
 
 else:
     def _str(text, encoding='utf-8'):
@@ -180,6 +192,9 @@ ANSI_ESCAPES = re.compile(r'''
     )
 ''', re.VERBOSE)
 
+# Unfinished 7-bit C1 ANSI sequence at the end of a stream chunk
+ANSI_ESCAPE_PARTIAL = re.compile(r'\x1B(?:\[[0-?]*[ -/]*)?')
+
 try:
     from shutil import which  # Python >= 3.3
 except ImportError:
@@ -283,17 +298,31 @@ def split_command_args(command):
     return [x.strip() for x in command.split(' ') if x.strip()]
 
 
-def new_log_path(sequence='', suffix=''):
-    now = datetime.datetime.now().strftime('%b-%d-%H%M-%G')
+# sequence jobs run by this process, pool workers and hubs run many
+JOB_COUNTER = itertools.count(1)
+
+
+def new_job_id():
+    """Id of a new sequence job, unique in this process."""
+    return next(JOB_COUNTER)
+
+
+def new_log_path(sequence='', suffix='', ext='log', job=None):
+    # seconds and process id keep names unique for workers started together,
+    # job id for sequences started together by one process
+    now = datetime.datetime.now().strftime('%b-%d-%H%M%S-%G')
     if not sequence: sequence = 'unknown'
-    sequence = sequence.split('.')[0]
+    sequence = '%s_%d' %(sequence.split('.')[0], os.getpid())
+    if job is not None: sequence = '%s-%d' %(sequence, job)
 
     if in_search('failure', suffix): base = './log/failure'
     elif in_search('errordump', suffix): base = './log/errordump'
+    elif in_search('events', suffix): base = './log/events'
+    elif in_search('record', suffix): base = './log/record'
     else: base = './log'
 
-    if suffix: logpath = '%s/%s_%s_%s.log' %(base, now, sequence, suffix)
-    else: logpath = '%s/%s_%s.log' %(base, now, sequence)
+    if suffix: logpath = '%s/%s_%s_%s.%s' %(base, now, sequence, suffix, ext)
+    else: logpath = '%s/%s_%s.%s' %(base, now, sequence, ext)
 
     return logpath
 
@@ -351,6 +380,33 @@ def strip_ansi_escape(text):
     return result
 
 
+class StreamDecoder(object):
+    """Streaming stage for pty output, decode bytes and strip ANSI escape
+    sequences chunk by chunk. State is kept between chunks, a multi-byte
+    character or an escape sequence cut at the chunk edge is held back until
+    the next chunk completes it, so each byte is decoded and stripped once."""
+    def __init__(self, encoding='utf-8', errors='ignore'):
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        self.pending = ''
+
+    def feed(self, data, final=False):
+        text = self.decoder.decode(data, final)
+        if self.pending:
+            text = self.pending + text
+            self.pending = ''
+        epos = text.rfind('\x1b')
+        if epos < 0: return text
+        # hold back unfinished escape sequence at the chunk edge
+        if not final and ANSI_ESCAPE_PARTIAL.fullmatch(text, epos):
+            self.pending = text[epos:]
+            text = text[:epos]
+        return ANSI_ESCAPES.sub('', text)
+
+    def reset(self):
+        self.decoder.reset()
+        self.pending = ''
+
+
 def prompt_strip_date(prompt_read):
     regex = r"[A-Za-z]{3} [A-Za-z]{3} \d{2} \d{2}:\d{2}:\d{2} "
     prompt_read = _str(prompt_read)
@@ -462,23 +518,344 @@ def ucs_dupsubstr_verify(s):
     return False
 
 
+# Characters which make a search pattern a regex instead of a literal
+REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+# Search pattern classified and compiled once, 'search' is the case-insensitive
+# regex for existence search, 'find' the case-sensitive regex for position find,
+# both are None if not needed, 'error' is set for invalid regex.
+SearchPattern = namedtuple('SearchPattern', ['literal', 'search', 'find', 'error'])
+
+
+@functools.lru_cache(maxsize=pattern_cache_size)
+def compile_pattern(p):
+    """Classify search pattern as literal or regex and compile it, cached with LRU eviction."""
+    if not REGEX_METACHARS.intersection(p if isinstance(p, str) else p.decode('latin-1')):
+        # literal only needs the regex for case-insensitive search when it has cased characters
+        search = re.compile(re.escape(p), re.M | re.I) if p.lower() != p.upper() else None
+        return SearchPattern(True, search, None, None)
+    try:
+        return SearchPattern(False, re.compile(p, re.M | re.I), re.compile(p, re.M), None)
+    except re.error as err:
+        # invalid regex, only do literal matching
+        return SearchPattern(False, None, None, str(err))
+
+
+def check_pattern(p):
+    """Raise SequenceError if search pattern is an invalid regex, literals
+    are valid without compiling. Any regex metacharacter makes a pattern a
+    regex, so literal text like 'Error: [' is rejected when sequence is parsed
+    and has to be escaped as 'Error: \\['."""
+    if not p or not REGEX_METACHARS.intersection(p): return
+    error = compile_pattern(p).error
+    if error:
+        raise SequenceError('Invalid regex pattern %r: %s' %(p, error))
+
+
 def in_search(p, s, do_find=False):
     if not p: return -1 if do_find else False
+    cp = compile_pattern(p)
     # find, return match position
     if do_find:
         pos = s.find(p)
-        if pos < 0:
-            try:
-                pos = re.search(p, s, re.M).start()
-            except:
-                pass
+        if pos < 0 and cp.find is not None:
+            match = cp.find.search(s)
+            if match is not None: pos = match.start()
         return pos
     # search, return True/False existence
     if p in s: return True
-    try:
-        return (re.search(p, s, re.M | re.I) is not None)
-    except:
-        return False
+    return cp.search is not None and cp.search.search(s) is not None
+
+
+# Pattern found in command output, 'start' and 'end' are offsets in the output
+OutputMatch = namedtuple('OutputMatch', ['pattern', 'start', 'end'])
+
+# regex with group references, or anchors and lookbehinds depending on where search starts
+STANDALONE_REGEX = re.compile(r'\\[1-9AbB]|\(\?P=|\(\?<[=!]|(?<!\[)\^')
+# regex with anchors matching at search start
+ANCHOR_REGEX = re.compile(r'\\A|(?<!\[)\^')
+
+
+def line_number(s, pos):
+    """Line number of offset ``pos`` in ``s``, counting from 1, ``s`` can also be
+    a bytes-like buffer like mmap which has no count()."""
+    linesep = '\n' if isinstance(s, str) else b'\n'
+    if hasattr(s, 'count'): return s.count(linesep, 0, pos) + 1
+    count = 1
+    cur = s.find(linesep, 0, pos)
+    while cur >= 0:
+        count += 1
+        cur = s.find(linesep, cur+1, pos)
+    return count
+
+
+class OutputMatcher(object):
+    """Matcher compiled once for one sequence line, check a command output for
+    ordered expects, any escape and command error signatures without copying
+    the output. Escapes and error signatures are combined into one alternation
+    each and found in one scan, expects are found one after another from the
+    end of the previous match, so the output is scanned once for each kind.
+    Escapes follow in_search semantics, a case-sensitive literal or a
+    case-insensitive regex match, error signatures are case-insensitive.
+    Regexes with group references or start anchors aren't combined, they are
+    searched alone in place, start anchors also match at search start like
+    in_search on the output after it.
+
+    A binary matcher matches UTF-8 encoded output in bytes-like buffers, eg,
+    mmap of spilled output, see :meth:`binary`."""
+    anchor_window = 4096
+
+    def __init__(self, expects=None, escapes=None, errors=None, binary=False):
+        self.expects = list(expects) if expects else []
+        self.escapes = list(escapes) if escapes else []
+        self.errors = list(errors) if errors else []
+        self.is_binary = binary
+        self._binary = None
+        t = self._t
+        self.expect_patterns = [compile_pattern(t(p)) for p in self.expects]
+        self.expect_alone = [self._standalone(p) for p in self.expects]
+        self.escape_alone = [i for i, p in enumerate(self.escapes) if self._standalone(p)]
+        self.escape_regex = self._combine([(i, t(p)) for i, p in enumerate(self.escapes) if i not in self.escape_alone])
+        # escapes that can't be combined are searched one by one
+        if self.escape_regex is None: self.escape_alone = list(range(len(self.escapes)))
+        self.error_regex = re.compile(t('|').join(re.escape(t(e)) for e in self.errors), re.I) if self.errors else None
+
+    def _t(self, text):
+        return text.encode('utf-8') if self.is_binary else text
+
+    @staticmethod
+    def _standalone(p):
+        cp = compile_pattern(p)
+        return not cp.literal and not cp.error and STANDALONE_REGEX.search(p) is not None
+
+    def _combine(self, patterns):
+        t = self._t
+        alternatives = []
+        for i, p in patterns:
+            cp = compile_pattern(p)
+            literal = t('(?-i:%s)') %(re.escape(p))
+            if cp.literal: alternatives.append((i, re.escape(p)))
+            elif cp.error: alternatives.append((i, literal))
+            else: alternatives.append((i, t('%s|(?:%s)') %(literal, p)))
+        if not alternatives: return None
+        regex = t('|').join(t('(?P<p%d>%s)') %(i, x) for i, x in alternatives)
+        try:
+            return re.compile(regex, re.M | re.I)
+        except re.error:
+            # patterns with group references can't be combined, search them one by one
+            return None
+
+    def binary(self):
+        """Binary version of this matcher, built once."""
+        if self.is_binary: return self
+        if self._binary is None:
+            self._binary = OutputMatcher(self.expects, self.escapes, self.errors, binary=True)
+        return self._binary
+
+    def _search_alone(self, p, s, pos, endpos, regex):
+        """Search pattern in output between ``pos`` and ``endpos`` as literal and
+        with compiled ``regex``, return OutputMatch of the first one found. The
+        output is searched in place, never sliced, since it may be an mmap of
+        spilled output. Anchors still match at ``pos`` like at the start of the
+        output after it, a match there is tried on a bounded window."""
+        t = self._t
+        start = s.find(t(p), pos, endpos)
+        found = (start, start + len(t(p))) if start >= 0 else None
+        if regex is not None:
+            match = regex.search(s, pos, endpos)
+            if match is not None and (found is None or match.start() < found[0]):
+                found = match.span()
+            if pos > 0 and (found is None or found[0] > pos) and ANCHOR_REGEX.search(p):
+                match = regex.match(s[pos:min(endpos, pos + self.anchor_window)])
+                if match is not None: found = (pos, pos + match.end())
+        if found is None: return None
+        return OutputMatch(p, found[0], found[1])
+
+    def find_missing_expect(self, s):
+        """Find expects one after another, return OutputMatch of the first missing
+        expect with the offset where its search started, None if all are found."""
+        pos = 0
+        for p, cp, alone in zip(self.expects, self.expect_patterns, self.expect_alone):
+            if alone:
+                match = self._search_alone(p, s, pos, len(s), cp.find)
+                if match is None: return OutputMatch(p, pos, pos)
+                pos = match.end
+                continue
+            start = s.find(self._t(p), pos)
+            if start >= 0:
+                pos = start + len(self._t(p))
+                continue
+            match = cp.find.search(s, pos) if cp.find is not None else None
+            if match is None: return OutputMatch(p, pos, pos)
+            pos = match.end()
+        return None
+
+    def find_escape(self, s, pos=0, endpos=None):
+        """Return OutputMatch of the first escape found between offsets ``pos`` and
+        ``endpos``, None if no escape found."""
+        if not self.escapes: return None
+        if endpos is None: endpos = len(s)
+        match = self.escape_regex.search(s, pos, endpos) if self.escape_regex is not None else None
+        found = OutputMatch(self.escapes[int(match.lastgroup[1:])], match.start(), match.end()) if match else None
+        for i in self.escape_alone:
+            p = self.escapes[i]
+            match = self._search_alone(p, s, pos, endpos, compile_pattern(self._t(p)).search)
+            if match is not None and (found is None or match.start < found.start): found = match
+        return found
+
+    def find_error(self, s):
+        """Return OutputMatch of the first command error signature found, None if no error found."""
+        if self.error_regex is None: return None
+        match = self.error_regex.search(s)
+        if match is None: return None
+        error = match.group().lower()
+        return OutputMatch(next(e for e in self.errors if self._t(e.lower()) == error), match.start(), match.end())
+
+
+class EscapeWatcher(object):
+    """Watch streaming command output for escapes of an OutputMatcher. Only
+    completed lines are checked, so anchored patterns won't match a partial
+    line, the incomplete last line is carried over to the next chunk."""
+    max_carry = 64*1024
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.carry = ''
+        self.lines = 0
+
+    def feed(self, chunk):
+        """Check new output chunk, return (OutputMatch, line number) of the first
+        escape found, None if no escape found."""
+        text = self.carry + chunk
+        end = text.rfind('\n') + 1
+        # check overlong line without linesep anyway, keep its tail for matching across chunks
+        if end == 0 and len(text) > self.max_carry: end = len(text) - 256
+        self.carry = text[end:]
+        if end <= 0: return None
+        match = self.matcher.find_escape(text, 0, end)
+        if match is not None: return match, self.lines + line_number(text, match.start)
+        self.lines += text.count('\n', 0, end)
+        return None
+
+
+def search_window(text, lines=0, limit=until_search_window):
+    """Trim ``text`` already matched to the window later output can still match
+    in, starting from its last incomplete line, ``lines`` more lines before for
+    patterns spanning lines. Overlong window keeps its last ``limit`` characters."""
+    start = len(text)
+    for _ in range(lines + 1):
+        start = text.rfind('\n', 0, start)
+        if start < 0: break
+    text = text[start+1:]
+    return text[-limit:] if len(text) > limit else text
+
+
+def output_excerpt(out, size=output_excerpt_size):
+    """Bounded excerpt of output, head and tail of ``size`` characters each."""
+    if len(out) <= 2*size: return out
+    return out[:size] + newline + '...[%d characters omitted]...' %(len(out) - 2*size) + newline + out[-size:]
+
+
+class OutputCapture(object):
+    """Command output capture, kept in memory up to ``threshold`` characters
+    and spilled to a temporary file beyond, so a runaway command can't blow
+    worker memory up. Spilled output is matched over an mmap of the file with
+    a binary OutputMatcher, only bounded head/tail excerpts of it are carried
+    in errors and messages."""
+    def __init__(self, threshold=output_spill_threshold, excerpt_size=output_excerpt_size):
+        self.threshold = threshold
+        self.excerpt_size = excerpt_size
+        self.length = 0
+        self.parts = []
+        self.head = ''
+        self.tail = ''
+        self.file = None
+        self._mmap = None
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def write(self, text):
+        if not text: return
+        self.length += len(text)
+        if len(self.head) < self.excerpt_size:
+            self.head = self.head + text[:self.excerpt_size-len(self.head)]
+        self.tail = (self.tail + text)[-self.excerpt_size:]
+        if self.file is None:
+            self.parts.append(text)
+            if self.length > self.threshold: self._spill()
+        else:
+            self.file.write(text.encode('utf-8'))
+
+    def _spill(self):
+        self.file = tempfile.TemporaryFile(prefix='ucs_output_')
+        for part in self.parts:
+            self.file.write(part.encode('utf-8'))
+        self.parts = []
+
+    def truncate(self, size):
+        """Remove the last ``size`` characters, which must be inside the tail, return them."""
+        if size <= 0: return ''
+        removed = self.tail[-size:]
+        if self.file is None:
+            value = ''.join(self.parts)[:-size]
+            self.parts = [value,] if value else []
+            self.head = value[:self.excerpt_size]
+            self.tail = value[-self.excerpt_size:]
+        else:
+            self.file.seek(-len(removed.encode('utf-8')), os.SEEK_END)
+            self.file.truncate()
+            self.tail = self.tail[:-size]
+        self.length -= size
+        return removed
+
+    def buffer(self):
+        """Whole output for matching, a string if kept in memory, otherwise a
+        read only mmap of spilled file with UTF-8 encoded output."""
+        if self.file is None:
+            if len(self.parts) > 1: self.parts = [''.join(self.parts),]
+            return self.parts[0] if self.parts else ''
+        if self._mmap is None:
+            self.file.flush()
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def value(self):
+        """Whole output if kept in memory, otherwise a bounded excerpt."""
+        return self.buffer() if self.file is None else self.excerpt()
+
+    def excerpt(self):
+        """Bounded excerpt of output, head and tail of ``excerpt_size`` characters each."""
+        if self.file is None: return output_excerpt(self.buffer(), self.excerpt_size)
+        return self.head + newline + '...[%d characters omitted]...' %(self.length - 2*self.excerpt_size) + \
+            newline + self.tail
+
+    def iter_text(self, blocksize=1024*1024):
+        """Iterate output text in blocks, without loading spilled output into memory."""
+        if self.file is None:
+            for part in self.parts: yield part
+            return
+        self.file.flush()
+        self.file.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        while True:
+            block = self.file.read(blocksize)
+            if not block: break
+            yield decoder.decode(block)
+        self.file.seek(0, os.SEEK_END)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.parts = []
 
 
 def reversed_find_term(startpos, p, s):
@@ -491,19 +868,18 @@ def reversed_find_term(startpos, p, s):
     return (cursor - slen)
 
 
-def sequence_item_split(line, delimiter=';'):
-    line = _str(line).strip(delimiter)
-    items = [item for item in line.split(delimiter) if item]
+@functools.lru_cache(maxsize=None)
+def _escaped_item_pattern(delimiter):
+    return re.compile(r"(?:\\%s|[^%s])+" %(re.escape(delimiter), re.escape(delimiter)))
 
-    # parse items containing escape charater
-    cur = len(items) - 1
-    while cur >= 0:
-        cur = cur - 1
-        if ord(items[cur][-1]) == 92:
-            items[cur] = items[cur][0:-1] + delimiter + items[cur+1]
-            del items[cur+1]
 
-    return items
+def sequence_item_split(line, delimiter=';'):
+    """Split sequence line into non-empty items, a delimiter escaped by
+    backslash doesn't split and is kept in item without backslash."""
+    line = _str(line)
+    if '\\' not in line: return [item for item in line.split(delimiter) if item]
+    escaped = '\\' + delimiter
+    return [item.replace(escaped, delimiter) for item in _escaped_item_pattern(delimiter).findall(line)]
 
 
 def local_run_cmd(cmd, timeout=None):
@@ -1,17 +1,20 @@
 import sys
-#import traceback
+import traceback
 import os
 import errno
 from os import linesep as newline
 import time
 import datetime
-from multiprocessing import Process, Value
+from multiprocessing import Process, Value, SimpleQueue
 import socket
+import selectors
+import threading
+import asyncio
 import re
-import json
 from enum import Enum
 
 from agent import UCSAgentWrapper
+from asyncagent import AsyncUCSAgent
 import const
 from const import (loop_iterations,
                    stop_on_failure,
@@ -19,83 +22,217 @@ from const import (loop_iterations,
                    local_shell_prompt,
                    sequence_file_entry,
                    max_sequences,
+                   async_hubs,
                    window_refresh_interval,
-                   sock_retry_timeout,
                    session_recover_retry,
+                   pty_record,
+                   pty_replay,
+                   pty_replay_realtime,
                    debug_mode_on)
 import utils
+from metrics import MetricSet
+from ipc import (IpcClient,
+                 FrameReader)
+import status
+from status import StatusBoard
+from replay import (PtyRecorder,
+                    PtyReplay)
+from logger import (LogWriter,
+                    LogSegments,
+                    EventLog)
 from utils import (ExpectError,
                    TimeoutError,
                    FileError,
+                   SequenceError,
                    RecoveryError)
-import sequence
-from sequence import sequence_reader
-from builtin import BuiltinCommand
+from sequence import sequence_program
+from builtin import SendCommand, FindCommand
 import cursor
 
 #mpl = multiprocessing.log_to_stderr()
 #mpl.setLevel(logging.INFO)
 
 UNIX_DOMAIN_SOCKET = None
+STATUS_BOARD = None
+JOB_QUEUE = None        # sequence jobs for worker pool, (sequence file, loops, slot, time queued)
+
+class SequenceFrame(object):
+    """Run state of sequence or LOOP body on worker frame stack, body is
+    program[start:end] of worker, a LOOP frame keeps state of its caller
+    to restore and program counter to return to."""
+    def __init__(self, start, end, caller=None, return_pc=None):
+        self.start = start
+        self.end = end
+        self.caller = caller
+        self.return_pc = return_pc
+        self.last_recover_loop = 0
+        self.recover_retry = session_recover_retry
+        self.reset()
+    
+    def reset(self):
+        """Reset loop scope state for a new or recovered loop."""
+        self.loop_result = Messages.LOOP_RESULT_PASS
+        self.failure_messages = []
+        self.spawned_workers = []
+
 
 #SEQUENCE WORKER
 class SequenceWorker(object):
     """Sequence agent worker class to run sequences, one worker corresponds
     to a specific sequence, parsed from given sequence file."""
-    def __init__(self, global_display_control, sequence_file, loops=1):
+    agent_class = UCSAgentWrapper
+
+    def __init__(self, global_display_control, sequence_file, loops=1, slot=None, queue_wait=None):
         self.sequence_file = sequence_file
-        self.logfile = open(utils.new_log_path(sequence=sequence_file.split(os.sep)[-1]), mode='w') if log_enabled else None
+        # all files of this sequence run are named by its job id
+        self.job_id = utils.new_job_id()
+        self.logfile = LogWriter(LogSegments(utils.new_log_path(sequence=sequence_file.split(os.sep)[-1],
+                                                                job=self.job_id))) if log_enabled else None
+        self.eventlog = EventLog(utils.new_log_path(sequence=sequence_file.split(os.sep)[-1],
+                                                    suffix='events', ext='jsonl', job=self.job_id)) if log_enabled else None
         self.display_control = global_display_control
         self.errordumpfile = None
         self.test_loops = loops
         self.complt_loops = 0
         self.errordump = None
-        self.spawned_workers= []
-        self.agent = UCSAgentWrapper(local_prompt=local_shell_prompt, logfile=self.logfile)
+        self.frames = []
+        self.metrics = MetricSet()
+        self.t_metrics = time.time()
+        self.ipc = None
+        # set once worker sends its last message, a stop after stop sends nothing
+        self.ipc_closed = False
+        # status slot in shared memory, loop results are counted there
+        self.status = STATUS_BOARD.slot(slot) if STATUS_BOARD else None
+        if self.status: self.status.set(status.PID, os.getpid())
+        self.own_slots = [self.status] if self.status else []
+        # slot of each subsequence, a LOOP invoked again takes it again
+        self.loop_slots = {}
+        if queue_wait is not None:
+            self.metrics.observe('ucs_queue_wait_seconds', queue_wait, sequence=sequence_file.split('.')[0])
+        recorder = PtyRecorder(utils.new_log_path(sequence=sequence_file.split(os.sep)[-1],
+                                                  suffix='record', ext='rec', job=self.job_id)) if pty_record else None
+        # only entry sequence is replayed, sequences it starts connect as usual
+        replay = PtyReplay(pty_replay, realtime=pty_replay_realtime) \
+            if pty_replay and sequence_file == sequence_file_entry else None
+        self.agent = self.agent_class(local_prompt=local_shell_prompt, logfile=self.logfile,
+                                      recorder=recorder, replay=replay)
         try:
-            self.test_sequence = sequence_reader(sequence_file)
+            self.program = sequence_program(sequence_file)
+            self.test_sequence = self.program.commands
         except Exception as err:
             self.stop_display_refresh()
             self.error_logging(err)
             raise err
     
+    # worker steps are generators yielding I/O requests, as agent steps do,
+    # they are run by the same pump, requests of agent steps go to agent
+    _pump = UCSAgentWrapper._pump
+    
+    def _io(self, op, *args):
+        """Do I/O request of worker steps with blocking calls, requests are
+        ('sleep', seconds),
+        ('join', worker): wait for worker started by spawn_worker to end,
+        ('flush_ipc',): wait until queued messages are sent to master,
+        ('close_ipc',): send queued messages to master and close connection,
+        ('sync_logs',): sync error logs logged since last sync,
+        ('close_logs',): close log files,
+        others are I/O requests of agent steps, see UCSAgentWrapper._io."""
+        if op == 'sleep': return time.sleep(args[0])
+        if op == 'join': return args[0].join()
+        # error logs are synced once logged, see sync_error_logs
+        if op == 'sync_logs': return None
+        if op in ('flush_ipc', 'close_ipc', 'close_logs'): return getattr(self, op)()
+        return self.agent._io(op, *args)
+    
     def send_ipc_msg(self, message):
-        if debug_mode_on: return
-
-        if not isinstance(message, str): message = json.dumps(message, ensure_ascii=True)
+        if debug_mode_on or self.ipc_closed: return
 
-        tosend = utils._bytes(message)
-        if not tosend: return
+        # carry metrics collected since last report with loop results
+        if isinstance(message, dict) and self.metrics and message.get('MSG') in (Messages.SEQUENCE_RUNNING_COMPLETE.value,
+                                                                               Messages.LOOP_RESULT_UNKNOWN.value,
+                                                                               Messages.LOOP_RESULT_PASS.value,
+                                                                               Messages.LOOP_RESULT_FAIL.value,
+                                                                               Messages.WORKER_METRICS.value):
+            message['METRICS'] = self.metrics.snapshot()
+            self.t_metrics = time.time()
+        if not message: return
 
-        t_end_ipc = time.time() + sock_retry_timeout
-        ipc_msg_sent = False
-        while time.time() <= t_end_ipc and not ipc_msg_sent:
-            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            try:
-                sock.setblocking(False)
-                sock.connect(UNIX_DOMAIN_SOCKET)
-                sock.sendall(tosend)
-                ipc_msg_sent = True
-            except OSError as err:
-                # socket connected failed or resource not available
-                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
-                                     errno.ECONNREFUSED, errno.ECONNABORTED,
-                                     errno.EBADF, errno.ENOTCONN, errno.EPIPE):
-                    break
-            finally:
-                sock.close()
-
-        if not ipc_msg_sent:
-            self.stop_display_refresh()
-            error = RuntimeError("Worker message can't be sent: %r" %(tosend))
-            self.error_logging(error)
-            raise error
+        try:
+            # one persistent connection per worker, messages are sent in background
+            if not self.ipc: self.ipc = IpcClient(UNIX_DOMAIN_SOCKET)
+            self.ipc.send(message)
+        except Exception as err:
+            self.ipc_error(err, message)
+    
+    def flush_ipc(self):
+        """Wait until queued messages are sent to master."""
+        if not self.ipc: return
+        try:
+            self.ipc.flush()
+        except Exception as err:
+            self.ipc_error(err, list(self.ipc.queue))
+    
+    def close_ipc(self):
+        """Send all queued messages to master and close connection."""
+        self.ipc_closed = True
+        if not self.ipc: return
+        ipc, self.ipc = self.ipc, None
+        try:
+            ipc.close()
+        except Exception as err:
+            self.ipc_error(err, list(ipc.queue))
+    
+    def ipc_error(self, err, message):
+        self.stop_display_refresh()
+        error = RuntimeError("Worker message can't be sent: %r, %r" %(message, err))
+        self.error_logging(error)
+        raise error
+    
+    def send_loop_result(self, loop_result, failure_messages):
+        """Count loop result in status slot, only failures are sent to master
+        with their messages, or every result if worker has no slot."""
+        sequence_name = self.sequence_file.split('.')[0]
+        self.metrics.count('ucs_loops_total', sequence=sequence_name, result=loop_result.name.split('_')[-1])
+        if self.status:
+            self.status.add({Messages.LOOP_RESULT_PASS: status.PASS,
+                             Messages.LOOP_RESULT_FAIL: status.FAIL,
+                             Messages.LOOP_RESULT_UNKNOWN: status.UNKNOWN}[loop_result])
+            if loop_result == Messages.LOOP_RESULT_PASS:
+                # metrics still need a message now and then
+                if time.time() - self.t_metrics >= window_refresh_interval:
+                    self.send_ipc_msg({'MSG': Messages.WORKER_METRICS.value, 'NAME': sequence_name})
+                return
+        ipc_message = {'MSG': loop_result.value,
+                       'NAME': sequence_name,
+                       'LOOP': self.complt_loops+1,
+                       'MSG_Q': failure_messages}
+        if self.status: ipc_message['SLOT'] = self.status.index
+        self.send_ipc_msg(ipc_message)
+    
+    def send_sequence_start(self, name, loops, state=status.RUNNING, pid=None, slot=None):
+        """Tell master a sequence starts, return status slot taken for it,
+        ``pid`` is the process running it if known already."""
+        if slot is None and STATUS_BOARD: slot = STATUS_BOARD.allocate(loops, state=state)
+        ipc_message = {'MSG': Messages.SEQUENCE_RUNNING_START.value,
+                       'NAME': name.split('.')[0],
+                       'LOOPS': loops}
+        if slot: ipc_message['SLOT'] = slot.index
+        if pid: ipc_message['PID'] = pid
+        self.send_ipc_msg(ipc_message)
+        return slot
+    
+    def send_worker_process(self, name, pid):
+        """Tell master process ``pid`` runs sequence, master watches it exit."""
+        self.send_ipc_msg({'MSG': Messages.WORKER_PROCESS.value,
+                           'NAME': name.split('.')[0],
+                           'PID': pid})
     
     def error_logging(self, errorinfo):
         if not self.errordumpfile:
             error_header = '******ERROR DUMP MESSAGE******' + newline + newline
             error_title = 'TEST SEQUENCE: %s' %(self.sequence_file) + newline + newline
-            self.errordumpfile = open(utils.new_log_path(sequence=self.sequence_file.split(os.sep)[-1], suffix='errordump'), mode='w')
+            self.errordumpfile = open(utils.new_log_path(sequence=self.sequence_file.split(os.sep)[-1], suffix='errordump',
+                                                         job=self.job_id), mode='x')
             self.errordumpfile.write(error_header + error_title)
             self.errordumpfile.flush()
 
@@ -103,6 +240,14 @@ class SequenceWorker(object):
             if not isinstance(errorinfo, str): errorinfo = repr(errorinfo)
             self.errordumpfile.write(errorinfo)
             self.errordumpfile.flush()
+        self.sync_error_logs()
+    
+    def sync_error_logs(self):
+        """Sync error dump to disk, and sequence log up to the error as well."""
+        if self.errordumpfile and not self.errordumpfile.closed:
+            os.fsync(self.errordumpfile.fileno())
+        if self.logfile and not self.logfile.closed:
+            self.logfile.flush(durable=True)
     
     def format_error_message(self, cmd, error):
         trace_msg = (error.args[0] if error.args else 'Null Traceback Message') + newline
@@ -115,250 +260,406 @@ class SequenceWorker(object):
         emsg = trace_msg + command_msg + session_msg + sequence_msg + loop_msg
         return emsg
     
-    def run_sequence_command(self, command):
+    def command_event(self, command, t_start, result, message=None):
+        """Record metrics and structured event of one sequence command."""
+        stats = self.agent.cmd_stats if self.agent else {}
+        t_total = time.time() - t_start
+        sequence_name = self.sequence_file.split('.')[0]
+        self.metrics.observe('ucs_command_latency_seconds', t_total, sequence=sequence_name, line=command.command)
+        self.metrics.count('ucs_commands_total', sequence=sequence_name, result=result)
+        if command.action == 'CONNECT':
+            self.metrics.observe('ucs_connect_latency_seconds', t_total, sequence=sequence_name)
+        if 'prompt_retries' in stats:
+            self.metrics.observe('ucs_prompt_retries', stats['prompt_retries'], sequence=sequence_name)
+        if stats.get('bytes'):
+            self.metrics.count('ucs_read_bytes_total', stats['bytes'], sequence=sequence_name)
+            t_read = stats.get('prompt', time.time()) - stats.get('first_byte', t_start)
+            if t_read > 0:
+                self.metrics.observe('ucs_read_throughput_bytes_per_second', stats['bytes']/t_read, sequence=sequence_name)
+        if not self.eventlog: return
+        elapsed = lambda k: round((stats[k] - t_start)*1000, 3) if k in stats else None
+        self.eventlog.emit(time=round(t_start, 6),
+                           sequence=self.sequence_file,
+                           loop=self.complt_loops+1,
+                           line=command.command,
+                           action=command.action,
+                           session=self.agent.current_session if self.agent else None,
+                           echo_ms=elapsed('echo'),
+                           first_byte_ms=elapsed('first_byte'),
+                           prompt_ms=elapsed('prompt'),
+                           total_ms=round(t_total*1000, 3),
+                           bytes=stats.get('bytes', 0),
+                           result=result,
+                           error=message.split(newline)[0] if message else None)
+
+    def _run_sequence_command_steps(self, command):
         result = Messages.ITEM_RESULT_PASS
         message = None
         output = ''
+        t_start = time.time()
         try:
-            output = self.agent.run_cmd(**command.cmd_dict)
+            output = yield from self.agent._run_command_steps(command)
 
         # This is the main entry for handling Worker/Agent Errors.
         except Exception as err:
-            err_msg = self.format_error_message(command.command, err)
-            err_to_raise = None
-            # Handling Expect Errors
-            if isinstance(err, ExpectError):
-                if stop_on_failure:
-                    err_to_raise = ExpectError(err_msg, prompt=err.prompt, output=err.output)
-                else:
-                    result = Messages.ITEM_RESULT_FAIL
-                    message = err_msg
-            # Handling Timeout Errors, should be really dangerous.
-            elif isinstance(err, TimeoutError):
-                err_to_raise = TimeoutError(err_msg, prompt=err.prompt, output=err.output)
-            # Handling Unknown errors
-            else:
-                self.errordump = err
-                self.error_logging(newline + 'UNKNOWN ERROR INFO:' + newline)
-                #self.error_logging(traceback.format_exc())
-                #self.error_logging(sys.exc_info()[2])
-                self.error_logging(err_msg + newline)
-                agent_info = 'AGENT INFO:' + newline + repr(self.agent)
-                self.error_logging(agent_info + newline)
-                result = Messages.ITEM_RESULT_UNKNOWN
+            result, message, err_to_raise = self.command_error(command, err, t_start)
             # Need to stop and raise process error
             if err_to_raise:
-                ipc_message = {'MSG': Messages.LOOP_RESULT_FAIL.value,
-                               'NAME': self.sequence_file.split('.')[0],
-                               'LOOP': self.complt_loops+1,
-                               'MSG_Q': [err_msg,]}
-                self.send_ipc_msg(ipc_message)
-                self.errordump = err_to_raise
-                self.stop()
+                yield from self._stop_steps()
                 raise err_to_raise
 
+        self.command_event(command, t_start, result.name.split('_')[-1], message)
         return result, message, output
     
+    def command_error(self, command, err, t_start):
+        """Handle error of sequence command, return (item result, message,
+        error to raise), worker must be stopped before raising error."""
+        err_msg = self.format_error_message(command.command, err)
+        # Handling Expect Errors
+        if isinstance(err, ExpectError):
+            if not stop_on_failure: return Messages.ITEM_RESULT_FAIL, err_msg, None
+            err_to_raise = ExpectError(err_msg, prompt=err.prompt, output=err.output)
+        # Handling Timeout Errors, should be really dangerous.
+        elif isinstance(err, TimeoutError):
+            err_to_raise = TimeoutError(err_msg, prompt=err.prompt, output=err.output)
+        # Handling Unknown errors
+        else:
+            self.errordump = err
+            self.error_logging(newline + 'UNKNOWN ERROR INFO:' + newline)
+            #self.error_logging(traceback.format_exc())
+            #self.error_logging(sys.exc_info()[2])
+            self.error_logging(err_msg + newline)
+            agent_info = 'AGENT INFO:' + newline + repr(self.agent)
+            self.error_logging(agent_info + newline)
+            return Messages.ITEM_RESULT_UNKNOWN, err_msg, None
+        self.command_event(command, t_start, 'TIMEOUT' if isinstance(err_to_raise, TimeoutError) else 'FAIL', err_msg)
+        self.send_loop_result(Messages.LOOP_RESULT_FAIL, [err_msg,])
+        self.errordump = err_to_raise
+        return Messages.ITEM_RESULT_FAIL, err_msg, err_to_raise
+    
+    # sequence commands to handler methods, commands sent to pty are COMMAND,
+    # builtin actions without a handler do nothing, handlers are worker steps
+    # returning program counter to go on with
+    OPS = {'COMMAND': 'op_command',
+           'INTR': 'op_intr',
+           'QUIT': 'op_quit',
+           'CLOSE': 'op_close',
+           'PULSE': 'op_pulse',
+           'WAIT': 'op_wait',
+           'SET_PROMPT': 'op_set_prompt',
+           'ENTER': 'op_enter',
+           'FIND': 'op_find',
+           'NEW_WORKER': 'op_new_worker',
+           'MONITOR': 'op_monitor',
+           'LOOP': 'op_loop'}
+    
+    def compile_program(self):
+        """Compile sequence into flat instruction array, one (handler, command,
+        argument) per command, argument of LOOP is (start, end) of its body,
+        argument of ENTER is the command record it sends."""
+        program = []
+        for command in self.test_sequence:
+            op = self.OPS.get(command.action if command.builtin else 'COMMAND', 'op_nothing')
+            argument = None
+            if op == 'op_loop':
+                argument = self.program.subsequences.get(command.subsequence_name)
+                if argument is None:
+                    raise SequenceError('Subsequence not defined: %s' %(command.subsequence_name))
+            elif op == 'op_enter':
+                # ENTER sends an empty line, program is shared by sequences of the same file,
+                # its command is left as it is
+                argument = SendCommand(dict(command.cmd_dict, command='', matcher=command.matcher))
+            program.append((getattr(self, op), command, argument))
+        return program
+    
     def run_all(self):
-        total = len(self.test_sequence)
-        last_recover_loop = 0
-        test_recover_retry = session_recover_retry
+        """Run sequence on a program counter over its instruction array, LOOP
+        body runs in a frame pushed on frame stack, returning to its caller
+        once its loops complete."""
+        return self._pump(self._run_all_steps())
+    
+    def _run_all_steps(self):
+        program = self.compile_program()
+        frames = self.frames = [SequenceFrame(0, len(program))]
         self.complt_loops = 0
-        while self.complt_loops < self.test_loops:
-            loop_result = Messages.LOOP_RESULT_PASS
-            loop_failure_messages = []
-            current = 0
-            self.spawned_workers = []
-            while current < total:
-                command = self.test_sequence[current]
-                if command.builtin:
-                    if command.action == 'INTR':
-                        try:
-                            self.agent.send_control('c')
-                        except Exception as err:
-                            self.error_logging(self.format_error_message('INTR', err) + newline + newline)
-                            loop_result = Messages.LOOP_RESULT_UNKNOWN
-                            loop_failure_messages = [repr(err)]
-                        self.agent.flush()
-
-                    elif command.action == 'QUIT':
-                        try:
-                            self.agent.quit()
-                        except Exception as err:
-                            self.error_logging(self.format_error_message('QUIT', err) + newline + newline)
-                            loop_result = Messages.LOOP_RESULT_UNKNOWN
-                            loop_failure_messages = [repr(err)]
-                        self.agent.flush()
-
-                    elif command.action == 'CLOSE':
-                        self.agent.close_pty()
-
-                    elif command.action == 'PULSE':
-                        try:
-                            self.agent.pty_pulse_session()
-                        except Exception as err:
-                            self.error_logging(self.format_error_message('PULSE', err) + newline + newline)
-                            loop_result = Messages.LOOP_RESULT_UNKNOWN
-                            loop_failure_messages = [repr(err)]
-
-                    elif command.action == 'WAIT':
-                        seconds = utils.parse_time_to_sec(command.argv[1])
-                        time.sleep(seconds)
-
-                    elif command.action == 'SET_PROMPT':
-                        try:
-                            self.agent.set_pty_prompt(command.argv[1])
-                        except Exception as err:
-                            self.error_logging(self.format_error_message('SET PROMPT', err) + newline + newline)
-                            loop_result = Messages.LOOP_RESULT_UNKNOWN
-                            loop_failure_messages = [repr(err)]
-
-                    elif command.action == 'ENTER':
-                        command.command = ''
-                        self.run_sequence_command(command)
-
-                    elif command.action == 'FIND':
-                        target_found = False
-                        outputs = []
-                        for d in command.find_dir:
-                            if 'cd' in d or re.search(r"^FS\d+:$", d.strip()): command.command = d
-                            else: command.command = 'cd ' + d
-                            self.run_sequence_command(command)
-                            result, message, output = self.run_sequence_command(BuiltinCommand(action='SEND',
-                                                                                               command='ls'))
-                            outputs.append(output)
-                            if utils.in_search(command.target_file, output):
-                                target_found = True
-                                break
-                        if not target_found:
-                            ferr = FileError('File not found: %s' %(command.target_file), outputs=outputs)
-                            self.error_logging(repr(ferr) + newline)
-                            loop_result = Messages.LOOP_RESULT_UNKNOWN
-                            loop_failure_messages = [repr(ferr), ]
-                            if self.errordump: loop_failure_messages.append(repr(self.errordump))
-
-                    elif command.action == 'NEW_WORKER':
-                        new_worker = Process(target=run_sequence_worker, args=(self.display_control,
-                                                                               command.sequence_file,
-                                                                               command.loops,))
-                        #if command.wait: new_worker.daemon = True
-                        new_worker.start()  # Start worker
-                        ipc_message = {'MSG': Messages.SEQUENCE_RUNNING_START.value,
-                                       'NAME': command.sequence_file.split('.')[0],
-                                       'LOOPS': command.loops}
-                        self.send_ipc_msg(ipc_message)
-                        #print('Spawned new worker [pid : %r] for sequence: %s' %(worker.pid, command.argv[1]))
-                        # wait for derived sequence worker to complete if wait flag is set
-                        if command.wait: new_worker.join()
-                        self.spawned_workers.append(new_worker)
-
-                    elif command.action == 'MONITOR':
-                        cont = True
-                        while cont:
-                            result, message, output = self.run_sequence_command(command)
-                            for w in command.watch:
-                                if w in output:
-                                    cont = False
-                                    break
-                            if cont: time.sleep(command.interval if command.interval > 0 else 0)
-
-                    elif command.action == 'LOOP':
-                        start = sequence.SUBSEQUENCES[command.subsequence_name]['start']
-                        end = sequence.SUBSEQUENCES[command.subsequence_name]['end']
-                        test_loops_save = self.test_loops
-                        complt_loops_save = self.complt_loops
-                        test_sequence_save = self.test_sequence
-                        sequence_file_save = self.sequence_file
-                        self.sequence_file = command.subsequence_name
-                        self.test_loops = command.loops
-                        self.test_sequence = self.test_sequence[start:end]
-                        ipc_message = {'MSG': Messages.SEQUENCE_RUNNING_START.value,
-                                       'NAME': self.sequence_file.split('.')[0],
-                                       'LOOPS': command.loops}
-                        self.send_ipc_msg(ipc_message)
-                        self.run_all()
-                        ipc_message = {'MSG': Messages.SEQUENCE_RUNNING_COMPLETE.value,
-                                       'NAME': self.sequence_file.split('.')[0]}
-                        self.send_ipc_msg(ipc_message)
-                        self.test_loops = test_loops_save
-                        self.test_sequence = test_sequence_save
-                        self.complt_loops = complt_loops_save
-                        self.sequence_file = sequence_file_save
-
-                else:
-                    result, message, output = self.run_sequence_command(command)
-                    if result == Messages.ITEM_RESULT_UNKNOWN:
-                        loop_result = Messages.LOOP_RESULT_UNKNOWN
-                        loop_failure_messages = [repr(self.errordump)]
-                    elif result == Messages.ITEM_RESULT_FAIL:
-                        loop_result = Messages.LOOP_RESULT_FAIL
-                        loop_failure_messages.append(message)
-                # reset loop environments, restart current loop from sequence begining
-                if loop_result == Messages.LOOP_RESULT_UNKNOWN:
-                    # DO LOOP RECOVERY
-                    if test_recover_retry == 0:
-                        err = RecoveryError('Recovery failed after %d retry at loop %d' %(session_recover_retry, self.complt_loops+1))
-                        self.error_logging(newline + '****************ERROR DUMP END****************' + newline)
-                        err_msg = newline + repr(err) + newline
-                        self.error_logging(err_msg + newline)
-                        self.stop()
-                        time.sleep(5)
+        pc = self.next_loop()
+        while frames:
+            frame = frames[-1]
+            if pc < frame.end:
+                handler, command, argument = program[pc]
+                if self.status: self.status.beat(pc - frame.start)
+                pc = yield from handler(frame, command, argument, pc)
+                yield ('sync_logs',)
+                # reset loop environments, restart current loop from its begining
+                if frame.loop_result == Messages.LOOP_RESULT_UNKNOWN:
+                    if self.recovery_exhausted(frame):
+                        yield from self._stop_steps()
+                        yield ('sleep', 5)
                         return
-                    if (self.complt_loops + 1) == last_recover_loop:
-                        test_recover_retry -= 1
-                    else:
-                        last_recover_loop = self.complt_loops + 1
-                        test_recover_retry = session_recover_retry
-
-                    ipc_message = {'MSG': loop_result.value,
-                                   'NAME': self.sequence_file.split('.')[0],
-                                   'LOOP': self.complt_loops+1,
-                                   'MSG_Q': loop_failure_messages}
-                    self.send_ipc_msg(ipc_message)
-                    # reset loop scope variables
-                    for worker in self.spawned_workers:
-                        worker.kill()
-                        time.sleep(0.1)
-                    self.agent.close_pty()
-                    loop_result = Messages.LOOP_RESULT_PASS
-                    loop_failure_messages = []
-                    self.spawned_workers = []
-                    current = 0
-                else:
-                    current += 1
-
-            ipc_message = {'MSG': loop_result.value,
-                           'NAME': self.sequence_file.split('.')[0],
-                           'LOOP': self.complt_loops+1,
-                           'MSG_Q': loop_failure_messages}
-            self.send_ipc_msg(ipc_message)
+                    for worker in frame.spawned_workers:
+                        self.cancel_worker(worker)
+                        yield ('sleep', 0.1)
+                    yield from self.agent._close_pty_steps()
+                    frame.reset()
+                    pc = frame.start
+                continue
+            self.send_loop_result(frame.loop_result, frame.failure_messages)
             # move on to next loop
-            #self.agent.close_pty()
             self.complt_loops += 1
+            pc = self.next_loop()
+    
+    def next_loop(self):
+        """Start next loop of top frame, or leave it if its loops complete,
+        return program counter to go on with."""
+        frame = self.frames[-1]
+        if self.complt_loops < self.test_loops:
+            if self.logfile: self.logfile.start_loop(self.complt_loops+1)
+            if self.status: self.status.set(status.LOOP, self.complt_loops+1)
+            frame.reset()
+            return frame.start
+        self.frames.pop()
+        if frame.caller is None: return None
+        # LOOP completes, back to its caller
+        if self.status: self.status.transition(status.ACTIVE_STATES, status.COMPLETED)
+        self.send_complete()
+        self.sequence_file, self.test_loops, self.complt_loops, self.status = frame.caller
+        return frame.return_pc
+    
+    def recovery_exhausted(self, frame):
+        """Count a recovery of current loop of frame, return True if recovery
+        retries run out, worker must be stopped then."""
+        if frame.recover_retry == 0:
+            err = RecoveryError('Recovery failed after %d retry at loop %d' %(session_recover_retry, self.complt_loops+1))
+            self.error_logging(newline + '****************ERROR DUMP END****************' + newline)
+            err_msg = newline + repr(err) + newline
+            self.error_logging(err_msg + newline)
+            return True
+        if (self.complt_loops + 1) == frame.last_recover_loop:
+            frame.recover_retry -= 1
+        else:
+            frame.last_recover_loop = self.complt_loops + 1
+            frame.recover_retry = session_recover_retry
+        self.send_loop_result(frame.loop_result, frame.failure_messages)
+        return False
+    
+    def builtin_error(self, frame, name, err):
+        self.error_logging(self.format_error_message(name, err) + newline + newline)
+        frame.loop_result = Messages.LOOP_RESULT_UNKNOWN
+        frame.failure_messages = [repr(err)]
+    
+    def op_nothing(self, frame, command, argument, pc):
+        yield from ()
+        return pc + 1
+    
+    def op_command(self, frame, command, argument, pc):
+        result, message, output = yield from self._run_sequence_command_steps(command)
+        if result == Messages.ITEM_RESULT_UNKNOWN:
+            frame.loop_result = Messages.LOOP_RESULT_UNKNOWN
+            frame.failure_messages = [repr(self.errordump)]
+        elif result == Messages.ITEM_RESULT_FAIL:
+            frame.loop_result = Messages.LOOP_RESULT_FAIL
+            frame.failure_messages.append(message)
+        return pc + 1
+    
+    def op_intr(self, frame, command, argument, pc):
+        try:
+            yield from self.agent._send_control_steps('c')
+        except Exception as err:
+            self.builtin_error(frame, 'INTR', err)
+        yield from self.agent._flush_steps()
+        return pc + 1
+    
+    def op_quit(self, frame, command, argument, pc):
+        try:
+            yield from self.agent._quit_steps()
+        except Exception as err:
+            self.builtin_error(frame, 'QUIT', err)
+        yield from self.agent._flush_steps()
+        return pc + 1
+    
+    def op_close(self, frame, command, argument, pc):
+        yield from self.agent._close_pty_steps()
+        return pc + 1
+    
+    def op_pulse(self, frame, command, argument, pc):
+        try:
+            yield from self.agent._pty_pulse_session_steps()
+        except Exception as err:
+            self.builtin_error(frame, 'PULSE', err)
+        return pc + 1
+    
+    def op_wait(self, frame, command, argument, pc):
+        seconds = utils.parse_time_to_sec(command.argv[1])
+        yield ('sleep', seconds)
+        return pc + 1
+    
+    def op_set_prompt(self, frame, command, argument, pc):
+        try:
+            yield from self.agent._set_pty_prompt_steps(command.argv[1])
+        except Exception as err:
+            self.builtin_error(frame, 'SET PROMPT', err)
+        return pc + 1
+    
+    def op_enter(self, frame, command, argument, pc):
+        yield from self._run_sequence_command_steps(argument)
+        return pc + 1
+    
+    def op_find(self, frame, command, argument, pc):
+        outputs = []
+        for d in command.find_dir:
+            # program is shared by sequences of the same file, don't touch its commands
+            cd = d if 'cd' in d or re.search(r"^FS\d+:$", d.strip()) else 'cd ' + d
+            yield from self._run_sequence_command_steps(FindCommand(dict(command.cmd_dict, command=cd)))
+            result, message, output = yield from self._run_sequence_command_steps(SendCommand({'action': 'SEND',
+                                                                                               'command': 'ls'}))
+            outputs.append(output)
+            if utils.in_search(command.target_file, output): return pc + 1
+        self.file_not_found(frame, command, outputs)
+        return pc + 1
+    
+    def file_not_found(self, frame, command, outputs):
+        ferr = FileError('File not found: %s' %(command.target_file), outputs=outputs)
+        self.error_logging(repr(ferr) + newline)
+        frame.loop_result = Messages.LOOP_RESULT_UNKNOWN
+        frame.failure_messages = [repr(ferr), ]
+        if self.errordump: frame.failure_messages.append(repr(self.errordump))
+    
+    def op_new_worker(self, frame, command, argument, pc):
+        # master must know the new worker before its first message,
+        # which may be sent by another process
+        slot = self.send_sequence_start(command.sequence_file, command.loops,
+                                        state=status.QUEUED if JOB_QUEUE else status.RUNNING)
+        yield ('flush_ipc',)
+        if JOB_QUEUE and slot:
+            # run by worker pool, or a sequence hub, once one is free
+            submit_sequence(command.sequence_file, command.loops, slot)
+            if command.wait: yield from self._wait_sequence_steps(slot)
+            frame.spawned_workers.append(slot)
+        else:
+            new_worker = self.spawn_worker(command, slot)
+            # wait for derived sequence worker to complete if wait flag is set
+            if command.wait: yield ('join', new_worker)
+            frame.spawned_workers.append(new_worker)
+        return pc + 1
+    
+    def spawn_worker(self, command, slot):
+        """Start worker process running sequence of RUN-SEQUENCE command, return it."""
+        new_worker = Process(target=run_sequence_worker, args=(self.display_control,
+                                                               command.sequence_file,
+                                                               command.loops,
+                                                               slot.index if slot else None,))
+        new_worker.start()  # Start worker
+        self.send_worker_process(command.sequence_file, new_worker.pid)
+        return new_worker
+    
+    def cancel_worker(self, worker):
+        """Cancel sequence started by RUN-SEQUENCE, worker process or slot of queued job."""
+        if isinstance(worker, Process): worker.kill()
+        else: STATUS_BOARD.cancel(worker)
+    
+    def op_monitor(self, frame, command, argument, pc):
+        while True:
+            result, message, output = yield from self._run_sequence_command_steps(command)
+            for w in command.watch:
+                if w in output: return pc + 1
+            yield ('sleep', command.interval if command.interval > 0 else 0)
+    
+    def op_loop(self, frame, command, argument, pc):
+        """Push frame of LOOP body, caller state is kept in it to restore."""
+        yield from ()
+        start, end = argument
+        caller = (self.sequence_file, self.test_loops, self.complt_loops, self.status)
+        self.frames.append(SequenceFrame(start, end, caller=caller, return_pc=pc+1))
+        self.sequence_file = command.subsequence_name
+        self.test_loops = command.loops
+        self.complt_loops = 0
+        slot = self.loop_slots.get(self.sequence_file)
+        if slot and STATUS_BOARD.reuse(slot, command.loops):
+            # counters carry on in slot master hasn't released yet
+            self.status = self.send_sequence_start(self.sequence_file, command.loops, pid=os.getpid(), slot=slot)
+        else:
+            self.status = self.send_sequence_start(self.sequence_file, command.loops, pid=os.getpid())
+        if self.status and self.status is not slot:
+            self.status.set(status.PID, os.getpid())
+            # drop slots released by master and taken by other sequences
+            self.own_slots = [x for x in self.own_slots if x.state != status.FREE]
+            self.own_slots.append(self.status)
+            self.loop_slots[self.sequence_file] = self.status
+        return self.next_loop()
+    
+    def _wait_sequence_steps(self, slot):
+        """Wait for sequence queued to worker pool to finish, pool grows by one
+        worker while this one waits, so nested waits never run out of workers."""
+        if self.status: self.status.transition((status.RUNNING,), status.WAITING)
+        while slot.state in status.ACTIVE_STATES:
+            yield ('sleep', 0.1)
+            if self.status: self.status.set(status.HEARTBEAT, time.time())
+        if self.status: self.status.transition((status.WAITING,), status.RUNNING)
+    
+    def log_start(self, queue_wait=None):
+        if self.logfile and not self.logfile.closed:
+            line = '*************THIS IS %s SEQUENCE LOG***************' %('MASTER' if self.sequence_file == sequence_file_entry else 'SLAVE')
+            self.logfile.write(line + newline + newline)
+            line = 'Sequence File: %s' %(self.sequence_file)
+            self.logfile.write(line + newline + newline)
+            if queue_wait is not None:
+                self.logfile.write('Queue Wait: %.3f sec' %(queue_wait) + newline + newline)
+    
+    def log_complete(self):
+        if self.logfile and not self.logfile.closed:
+            line = 'Test sequence completed successfully.'
+            self.logfile.write(newline + line + newline)
     
     def stop_display_refresh(self):
         if self.display_control is not None:
             self.display_control.value = 0
     
     def stop(self):
+        return self._pump(self._stop_steps())
+    
+    def _stop_steps(self):
         # send COMPLETED message
+        self.send_complete()
+        yield ('close_ipc',)
+        for slot in self.own_slots: slot.transition(status.ACTIVE_STATES, status.COMPLETED)
+        self.dump_stop_info()
+
+        if self.agent:
+            yield from self.agent._close_on_exception_steps()
+            self.agent = None
+
+        yield ('close_logs',)
+    
+    def send_complete(self):
         ipc_message = {'MSG': Messages.SEQUENCE_RUNNING_COMPLETE.value,
-                       'NAME': self.sequence_file.split('.')[0]}
+                       'NAME': self.sequence_file.split('.')[0],
+                       'PID': os.getpid()}
         self.send_ipc_msg(ipc_message)
-
+    
+    def send_crashed(self):
+        """Tell master sequence and LOOPs it runs stop without completing."""
+        names = [self.sequence_file] + [frame.caller[0] for frame in reversed(self.frames) if frame.caller]
+        for name in names:
+            self.send_ipc_msg({'MSG': Messages.SEQUENCE_RUNNING_CRASHED.value,
+                               'NAME': name.split('.')[0],
+                               'PID': os.getpid()})
+    
+    def dump_stop_info(self):
         if self.errordump:
             error_info = newline + 'DUMP ERROR INFO:' + newline + repr(self.errordump) + newline
             pty_info = 'AGENT INFO:' + newline + repr(self.agent) + newline
             self.error_logging(error_info + newline + pty_info + newline)
             self.errordump = None
 
-        if self.agent:
-            self.agent.close_on_exception()
-            self.agent = None
-
         if self.logfile and not self.logfile.closed:
-            self.logfile.flush()
+            self.logfile.write(newline + 'LOG WRITER: %r' %(self.logfile) + newline)
+    
+    def close_logs(self):
+        if self.logfile:
+            # agent closes log writer already, close is durable and idempotent
             self.logfile.close()
+            if self.logfile.dropped_bytes or self.logfile.error:
+                self.error_logging(newline + 'LOG WRITER: %r' %(self.logfile) + newline)
             self.logfile = None
 
         if self.errordumpfile and not self.errordumpfile.closed:
@@ -366,6 +667,10 @@ class SequenceWorker(object):
             self.errordumpfile.close()
             self.errordumpfile = None
 
+        if self.eventlog:
+            self.eventlog.close()
+            self.eventlog = None
+
 
 class Messages(Enum):
     """Signal definitions for sequence worker."""
@@ -377,16 +682,16 @@ class Messages(Enum):
     ITEM_RESULT_UNKNOWN = 6         # one item fail because of unknown errors
     ITEM_RESULT_PASS = 7            # one item pass
     ITEM_RESULT_FAIL = 8            # one item fail
+    WORKER_METRICS = 9              # metrics collected since last message
+    WORKER_PROCESS = 10             # process started to run a sequence, watched by master
+    SEQUENCE_RUNNING_CRASHED = 11   # sequence stopped by an error without completing
 
 
 # Sequence Worker entry, to start a worker based on a sequence file
-def run_sequence_worker(global_display_control, sequence_file, loops):
-    job = SequenceWorker(global_display_control=global_display_control, sequence_file=sequence_file, loops=loops)
-    if job.logfile and not job.logfile.closed:
-        line = '*************THIS IS %s SEQUENCE LOG***************' %('MASTER' if sequence_file == sequence_file_entry else 'SLAVE')
-        job.logfile.write(line + newline + newline)
-        line = 'Sequence File: %s' %(sequence_file)
-        job.logfile.write(line + newline + newline)
+def run_sequence_worker(global_display_control, sequence_file, loops, slot=None, queue_wait=None):
+    job = SequenceWorker(global_display_control=global_display_control, sequence_file=sequence_file, loops=loops,
+                         slot=slot, queue_wait=queue_wait)
+    job.log_start(queue_wait)
     
     #print(newline + '------Sequence Worker Started------' + newline)
     #print('Worker sequence file: %s' %(sequence_file))
@@ -399,25 +704,286 @@ def run_sequence_worker(global_display_control, sequence_file, loops):
     
     #print('Worker exit normally, sequence file: %s' %(sequence_file) + \
     #      (', log dumped into: %s' %(logfile.name) if logfile else ''))
-    if job.logfile and not job.logfile.closed:
-        line = 'Test sequence completed successfully.'
-        job.logfile.write(newline + line + newline)
+    job.log_complete()
     job.stop()
 
 
+def submit_sequence(sequence_file, loops, slot):
+    """Queue sequence job for worker pool, slot is in QUEUED state."""
+    JOB_QUEUE.put((sequence_file, loops, slot.index, slot.generation, time.time()))
+
+
+# Pool worker entry, to run sequence jobs from job queue until told to exit
+def run_pool_worker(global_display_control):
+    while True:
+        job = JOB_QUEUE.get()
+        if job is None: return
+        sequence_file, loops, index, generation, t_queued = job
+        slot = STATUS_BOARD.slot(index, generation)
+        # cancelled while queued
+        if not slot.transition((status.QUEUED,), status.RUNNING): continue
+        slot.set(status.PID, os.getpid())
+        # an error escaping worker ends pool worker, master reaps and replaces it
+        run_sequence_worker(global_display_control, sequence_file, loops, slot=index, queue_wait=time.time()-t_queued)
+
+
+class WorkerPool(object):
+    """Pre-forked pool of worker processes running sequence jobs from job
+    queue, at least ``size`` workers, plus one for each worker waiting for
+    a sequence it started if ``grow`` is set."""
+    def __init__(self, global_display_control, size=max_sequences, target=run_pool_worker, grow=True):
+        self.display_control = global_display_control
+        self.size = size
+        self.target = target
+        self.grow = grow
+        self.processes = []
+        self.closing = False
+    
+    def spawn(self):
+        process = Process(target=self.target, args=(self.display_control,))
+        process.start()
+        self.processes.append(process)
+        return process
+    
+    def resize(self, waiting=0):
+        """Spawn workers up to pool size, return new worker processes."""
+        if self.closing: return []
+        if not self.grow: waiting = 0
+        return [self.spawn() for i in range(self.size + waiting - len(self.processes))]
+    
+    def reap(self, process):
+        process.join()
+        if process in self.processes: self.processes.remove(process)
+    
+    def close(self, timeout=5.0):
+        self.closing = True
+        for process in self.processes: JOB_QUEUE.put(None)
+        t_end = time.time() + timeout
+        for process in self.processes:
+            process.join(max(t_end - time.time(), 0))
+            if process.is_alive(): process.kill()
+        self.processes = []
+
+
+# ASYNC SEQUENCE WORKER
+class AsyncSequenceWorker(SequenceWorker):
+    """Sequence worker running as a task of sequence hub, it runs the worker
+    steps of SequenceWorker with their I/O requests awaited on hub event loop,
+    waits for disk and master are done in executor."""
+    agent_class = AsyncUCSAgent
+    _pump = AsyncUCSAgent._pump
+
+    def __init__(self, global_display_control, sequence_file, loops=1, slot=None, queue_wait=None, hub=None):
+        self.hub = hub
+        self.logs_unsynced = False
+        super(AsyncSequenceWorker, self).__init__(global_display_control, sequence_file, loops=loops,
+                                                  slot=slot, queue_wait=queue_wait)
+        # sequences of a hub share its connection to master
+        self.ipc = hub.ipc
+    
+    async def _io(self, op, *args):
+        """Await I/O request of worker steps, see SequenceWorker._io."""
+        if op == 'sleep': return await asyncio.sleep(args[0])
+        if op == 'join': return await asyncio.wait([args[0]])
+        if op == 'sync_logs': return await self.sync_logs()
+        if op == 'close_logs':
+            # closing log writer syncs it to disk
+            await self.sync_logs()
+        if op in ('flush_ipc', 'close_ipc', 'close_logs'):
+            return await self.hub.loop.run_in_executor(None, getattr(self, op))
+        return await self.agent._io(op, *args)
+    
+    def close_ipc(self):
+        """Wait until queued messages are sent to master, hub closes connection."""
+        self.ipc_closed = True
+        if not self.ipc: return
+        ipc, self.ipc = self.ipc, None
+        try:
+            ipc.flush()
+        except Exception as err:
+            self.ipc_error(err, list(ipc.queue))
+    
+    def sync_error_logs(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # logs are closed in executor, see _io
+            return super(AsyncSequenceWorker, self).sync_error_logs()
+        # event loop never waits for disk, error logs are synced by sync_logs
+        self.logs_unsynced = True
+    
+    async def sync_logs(self):
+        """Sync error logs in executor, if error is logged since last sync."""
+        if not self.logs_unsynced: return
+        self.logs_unsynced = False
+        await self.hub.loop.run_in_executor(None, super(AsyncSequenceWorker, self).sync_error_logs)
+    
+    def spawn_worker(self, command, slot):
+        """Start task running sequence of RUN-SEQUENCE command in this hub,
+        status board is full so it runs without a slot, return the task."""
+        task = self.hub.start(command.sequence_file, command.loops)
+        self.send_worker_process(command.sequence_file, os.getpid())
+        return task
+    
+    def cancel_worker(self, worker):
+        if isinstance(worker, asyncio.Task): worker.cancel()
+        else: self.hub.cancel(worker)
+    
+    def abort(self, state):
+        """Stop without completing, sequence is cancelled or crashed, its
+        active slots are set to ``state``."""
+        return self._pump(self._abort_steps(state))
+    
+    def _abort_steps(self, state):
+        for slot in self.own_slots: slot.transition(status.ACTIVE_STATES, state)
+        # hub process lives on, master learns of sequences without a slot by message
+        if state == status.CRASHED: self.send_crashed()
+        self.dump_stop_info()
+
+        if self.agent:
+            yield from self.agent._close_on_exception_steps()
+            self.agent = None
+
+        yield ('close_logs',)
+
+
+# Async sequence worker entry, to run a sequence as a task of sequence hub
+async def run_async_sequence_worker(hub, global_display_control, sequence_file, loops, slot=None, queue_wait=None):
+    job = AsyncSequenceWorker(global_display_control=global_display_control, sequence_file=sequence_file, loops=loops,
+                              slot=slot, queue_wait=queue_wait, hub=hub)
+    job.log_start(queue_wait)
+    try:
+        await job.run_all()
+    except asyncio.CancelledError:
+        await job.abort(status.CANCELLED)
+        raise
+    except Exception:
+        # hub lives on, error escaping sequence goes to its error dump, unless it's stopped already
+        if job.agent: job.error_logging(newline + 'UNHANDLED ERROR:' + newline + traceback.format_exc() + newline)
+        await job.abort(status.CRASHED)
+        raise
+    job.log_complete()
+    await job.stop()
+
+
+class SequenceHub(object):
+    """Asyncio event loop running sequence jobs from job queue as tasks, one
+    hub process runs any number of sequences concurrently, each is an
+    AsyncSequenceWorker waiting on its pty with loop readers and timers.
+    A sequence is cancelled by setting its slot to CANCELLED, by any process,
+    the hub cancels its task."""
+    def __init__(self, global_display_control):
+        self.display_control = global_display_control
+        self.ipc = IpcClient(UNIX_DOMAIN_SOCKET)
+        self.loop = None
+        self.tasks = {}             # running task to its slot
+        self.cancelled = set()
+    
+    def intake(self, jobs):
+        """Read job queue in a thread and hand jobs to event loop, until told to exit."""
+        while True:
+            job = JOB_QUEUE.get()
+            self.loop.call_soon_threadsafe(jobs.put_nowait, job)
+            if job is None: return
+    
+    def start(self, sequence_file, loops, index=None, queue_wait=None):
+        """Start task running sequence, slot ``index`` is in RUNNING state."""
+        task = self.loop.create_task(self.run_job(sequence_file, loops, index, queue_wait))
+        # slot handle is made while task owns the slot, it never sees another sequence in it
+        self.tasks[task] = STATUS_BOARD.slot(index)
+        task.add_done_callback(self.task_done)
+        return task
+    
+    def task_done(self, task):
+        self.tasks.pop(task, None)
+        self.cancelled.discard(task)
+    
+    async def run_job(self, sequence_file, loops, index, queue_wait):
+        try:
+            await run_async_sequence_worker(self, self.display_control, sequence_file, loops,
+                                            slot=index, queue_wait=queue_wait)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # an error escaping sequence ends its task only, as worker process crashed,
+            # it's logged to error dump of the sequence
+            slot = STATUS_BOARD.slot(index)
+            if slot: slot.transition(status.ACTIVE_STATES, status.CRASHED)
+    
+    def cancel(self, slot):
+        """Cancel sequence of slot, a queued one never starts, a running one
+        is cancelled by the hub running it."""
+        slot.transition(status.ACTIVE_STATES, status.CANCELLED)
+        self.watch_cancelled()
+    
+    async def watch(self):
+        # sequences may be cancelled by other processes
+        while True:
+            await asyncio.sleep(0.1)
+            self.watch_cancelled()
+    
+    def watch_cancelled(self):
+        for task, slot in list(self.tasks.items()):
+            if slot is None or task in self.cancelled: continue
+            if slot.state == status.CANCELLED:
+                self.cancelled.add(task)
+                task.cancel()
+    
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        jobs = asyncio.Queue()
+        threading.Thread(target=self.intake, args=(jobs,), name='SequenceHubIntake', daemon=True).start()
+        watcher = self.loop.create_task(self.watch())
+        while True:
+            job = await jobs.get()
+            if job is None: break
+            sequence_file, loops, index, generation, t_queued = job
+            slot = STATUS_BOARD.slot(index, generation)
+            # cancelled while queued
+            if not slot.transition((status.QUEUED,), status.RUNNING): continue
+            slot.set(status.PID, os.getpid())
+            self.start(sequence_file, loops, index, time.time()-t_queued)
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+        watcher.cancel()
+        await self.loop.run_in_executor(None, self.ipc.close)
+
+
+# Hub worker entry, to run sequence jobs from job queue on one event loop until told to exit
+def run_hub_worker(global_display_control):
+    asyncio.run(SequenceHub(global_display_control).run())
+
+
 # MASTER WORKER
 class Master(object):
     """Master process class, for tracking statuses for all under-going test sequences."""
-    def __init__(self, init_sequence_file):
+    def __init__(self, init_sequence_file, board=None, pool=None):
         self.init_sequence_file = init_sequence_file
+        self.board = board
+        self.pool = pool
         self.failure_logfile = None
         self.worker_list = []
+        self.metrics = MetricSet()
+        self.metrics_path = utils.new_log_path(sequence=init_sequence_file.split(os.sep)[-1], suffix='metrics', ext='prom')
         self.ipc_sock = None
+        # listening socket, worker connections and worker process sentinels
+        # are waited together, data of a key is what it is
+        self.selector = selectors.DefaultSelector()
+        # processes started by workers, pidfd of each, or None if it's polled
+        self.pidfds = {}
+        # (name, pid) of sequences completed before master learned of their process
+        self.completed_pids = set()
+        # last frame sequence number read of each IPC client, shared by connections
+        # so frames a client resends after reconnect are read once
+        self.ipc_seen = {}
         self.init_ipc_sock()
     
     def init_ipc_sock(self):
         if debug_mode_on: return
 
+        if self.ipc_sock:
+            self.selector.unregister(self.ipc_sock)
+            self.ipc_sock.close()
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         sock.setblocking(False)     # set nonblocking recv requests
         try:
@@ -425,38 +991,146 @@ class Master(object):
         except OSError:
             pass
         sock.bind(UNIX_DOMAIN_SOCKET)
-        sock.listen(max_sequences)
+        sock.listen(128)
         self.ipc_sock = sock
+        self.selector.register(sock, selectors.EVENT_READ, 'LISTENER')
     
-    def recv_ipc_msg(self):
-        if debug_mode_on: return None
-        if not self.ipc_sock: self.init_ipc_sock()
-
-        recved = b''
-        message = None
+    def watch_worker(self, process):
+        """Watch worker process exit, sequences it leaves active are marked
+        as CRASHED."""
+        self.selector.register(process.sentinel, selectors.EVENT_READ, ('SENTINEL', process))
+    
+    def watch_pid(self, pid):
+        """Watch exit of process started by a worker, it's not a child of
+        master, so it's watched by pidfd, or polled where there is none."""
+        if pid in self.pidfds: return
         try:
-            conn, addr = self.ipc_sock.accept()
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self.reap_pid(pid)
+            return
+        except (AttributeError, OSError):
+            fd = None
+        self.pidfds[pid] = fd
+        if fd is not None: self.selector.register(fd, selectors.EVENT_READ, ('PIDFD', pid))
+    
+    def unwatch_pid(self, pid):
+        fd = self.pidfds.pop(pid, None)
+        if fd is None: return
+        self.selector.unregister(fd)
+        os.close(fd)
+    
+    def polled_exits(self):
+        """Processes exited among ones watched without pidfd."""
+        exits = []
+        for pid, fd in self.pidfds.items():
+            if fd is not None: continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                exits.append(('PIDFD', pid))
+            except OSError:
+                pass
+        return exits
+    
+    def maintain_pool(self):
+        """Keep worker pool at its size, plus workers waiting for sequences."""
+        if not self.pool: return
+        waiting = sum(1 for slot in self.board.active_slots() if slot.state == status.WAITING)
+        for process in self.pool.resize(waiting): self.watch_worker(process)
+    
+    def reap_worker(self, process):
+        if self.pool: self.pool.reap(process)
+        else: process.join()
+        self.crash_sequences(process.pid, 'exit code: %r' %(process.exitcode))
+        self.maintain_pool()
+    
+    def reap_pid(self, pid):
+        self.unwatch_pid(pid)
+        self.crash_sequences(pid, 'pid: %d' %(pid))
+    
+    def crash_sequences(self, pid, reason):
+        """Sequences process ``pid`` leaves active when it exits are CRASHED,
+        ones with status slots by their slots, others by their messages."""
+        for slot in self.board.active_slots() if self.board else []:
+            if int(slot.read()['PID']) != pid or not slot.transition(status.ACTIVE_STATES, status.CRASHED):
+                continue
+            names = [w['NAME'] for w in self.worker_list if slot.index in w['SLOTS']]
+            self.failure_logging(newline + 'WORKER CRASHED: %s, %s' %(names[0] if names else 'slot %d' %(slot.index),
+                                                                       reason) + newline)
+        for worker in self.worker_list:
+            if pid not in worker['PIDS']: continue
+            worker['PIDS'] = [x for x in worker['PIDS'] if x != pid]
+            if worker['STATUS'] == 'RUNNING' and not worker['PIDS'] and not worker['SLOTS']:
+                worker['STATUS'] = 'CRASHED'
+                self.failure_logging(newline + 'WORKER CRASHED: %s, %s' %(worker['NAME'], reason) + newline)
+    
+    def accept_ipc_conns(self):
+        while True:
+            try:
+                conn, addr = self.ipc_sock.accept()
+            except OSError as err:
+                # resource temporarily unavailable
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.init_ipc_sock()
+                return
+            conn.setblocking(False)
+            self.selector.register(conn, selectors.EVENT_READ, FrameReader(self.ipc_seen))
+    
+    def recv_ipc_msg(self, conn, reader):
+        """Receive all pending messages of a worker connection, in order."""
+        messages = []
+        while True:
             try:
-                while True:
-                    try:
-                        s = conn.recv(4096)
-                    except OSError:
-                        s = b''
-                    if not s and recved:
-                        try:
-                            message = json.loads(utils._str(recved))
-                        except ValueError:
-                            message = utils._str(recved)
-                        break
-                    recved = recved + s
-            finally:
+                s = conn.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                s = b''
+            if not s:
+                # worker closed connection
+                self.selector.unregister(conn)
                 conn.close()
-        except OSError as err:
-            # resource temporarily unavailable
-            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
-                self.init_ipc_sock()
+                break
+            messages.extend(reader.feed(s))
+        return messages
+    
+    def poll(self, timeout=0):
+        """Wait up to timeout seconds for worker events, and handle all ready
+        ones, return count of messages handled."""
+        if debug_mode_on:
+            time.sleep(timeout)
+            return 0
+        if not self.ipc_sock: self.init_ipc_sock()
 
-        return message
+        events = self.selector.select(timeout)
+        # accept new connections first, so messages of a worker sent before
+        # it started another worker are read before the new worker's
+        if any(key.data == 'LISTENER' for key, mask in events): self.accept_ipc_conns()
+        handled = 0
+        conns = [key for key, mask in events if isinstance(key.data, FrameReader)]
+        exits = [key.data for key, mask in events if isinstance(key.data, tuple)] + self.polled_exits()
+        # worker flushes its messages before exit, read them all before its exit is handled
+        if exits: conns = [key for key in self.selector.get_map().values() if isinstance(key.data, FrameReader)]
+        for key in conns:
+            for message in self.recv_ipc_msg(key.fileobj, key.data):
+                self.update_worker_status(message)
+                handled += 1
+        for tag, process in exits:
+            if tag == 'PIDFD':
+                self.reap_pid(process)
+                continue
+            self.selector.unregister(process.sentinel)
+            self.reap_worker(process)
+        return handled
+    
+    def close_ipc(self):
+        for pid in list(self.pidfds): self.unwatch_pid(pid)
+        for key in list(self.selector.get_map().values()):
+            if isinstance(key.data, FrameReader): key.fileobj.close()
+        self.selector.close()
+        if self.ipc_sock: self.ipc_sock.close()
+        self.ipc_sock = None
     
     def failure_logging(self, data):
         if not self.failure_logfile:
@@ -475,24 +1149,45 @@ class Master(object):
         arriver = msg['NAME']
         message = msg['MSG']
         status_updated = False
+        if msg.get('METRICS'): self.metrics.merge(msg['METRICS'])
+        if message == Messages.WORKER_METRICS.value: return True
+        # loop results of workers with a status slot are counted in the slot
+        counted = 'SLOT' in msg
+        pid = msg.get('PID')
         for worker in self.worker_list:
             # sequence worker has been started
             if arriver == worker['NAME']:
-                if message == Messages.SEQUENCE_RUNNING_COMPLETE.value:
-                    worker['STATUS'] = 'COMPLETED'
+                if message == Messages.SEQUENCE_RUNNING_START.value:
+                    # same sequence started again
+                    worker['TOTAL_LOOPS'] += msg['LOOPS']
+                    worker['STATUS'] = 'RUNNING'
+                    if counted and msg['SLOT'] not in worker['SLOTS']: worker['SLOTS'].append(msg['SLOT'])
+                    elif not counted and pid: self.track_pid(worker, pid)
+                elif message == Messages.WORKER_PROCESS.value:
+                    # child process may complete before its starter tells master
+                    if (arriver, pid) in self.completed_pids: self.completed_pids.discard((arriver, pid))
+                    else: self.track_pid(worker, pid)
+                elif message == Messages.SEQUENCE_RUNNING_COMPLETE.value:
+                    self.untrack_pid(worker, pid)
+                    if not worker['PIDS']: worker['STATUS'] = 'COMPLETED'
+                elif message == Messages.SEQUENCE_RUNNING_CRASHED.value:
+                    self.untrack_pid(worker, pid)
+                    if not worker['PIDS'] and not worker['SLOTS'] and worker['STATUS'] == 'RUNNING':
+                        worker['STATUS'] = 'CRASHED'
+                        self.failure_logging(newline + 'WORKER CRASHED: %s, pid: %d' %(arriver, pid) + newline)
                 elif message == Messages.LOOP_RESULT_UNKNOWN.value:
                     error_log = newline + 'ERROR LOOP: %d' %(msg['LOOP']) + newline + 'ERROR MESSAGES:' + newline
                     for elog in msg['MSG_Q']:
                         error_log = error_log + elog + newline
                     self.failure_logging(error_log)
                 elif message == Messages.LOOP_RESULT_FAIL.value:
-                    worker['FAILURE_LOOPS'] += 1
+                    if not counted: worker['FAILURE_LOOPS'] += 1
                     worker['FAILURE_MESSAGES'].update({msg['LOOP']: msg['MSG_Q']})
                     failure_loop_log = newline + 'FAILURE LOOP: %d' %(msg['LOOP']) + newline + 'FAILURE MESSAGES:' + newline + newline
                     for flog in msg['MSG_Q']:
                         failure_loop_log = failure_loop_log + flog + newline
                     self.failure_logging(failure_loop_log)
-                else:
+                elif not counted:
                     worker['SUCCESS_LOOPS'] += 1
 
                 status_updated = True
@@ -501,82 +1196,151 @@ class Master(object):
             if message != Messages.SEQUENCE_RUNNING_START.value:
                 raise RuntimeError('Invalid worker message received: %d' %(message))
 
-            if len(self.worker_list) >= max_sequences:
-                raise RuntimeError('Too many sequences started, maximum: %d' %(max_sequences))
-
             worker = {'NAME': arriver,
                       'FAILURE_LOOPS': 0,
                       'SUCCESS_LOOPS': 0,
                       'TOTAL_LOOPS': msg['LOOPS'],
                       'FAILURE_MESSAGES': {},
+                      'SLOTS': [msg['SLOT']] if counted else [],
+                      'PIDS': [],
                       'STATUS': 'RUNNING'}
             self.worker_list.append(worker)
+            if pid and not counted: self.track_pid(worker, pid)
 
         return True
     
+    def track_pid(self, worker, pid):
+        """Sequence of worker runs in process ``pid``, until it completes."""
+        worker['PIDS'].append(pid)
+        self.watch_pid(pid)
+    
+    def untrack_pid(self, worker, pid):
+        if pid in worker['PIDS']: worker['PIDS'].remove(pid)
+        elif pid and not worker['SLOTS']: self.completed_pids.add((worker['NAME'], pid))
+    
+    def collect_slots(self):
+        """Fold counts of finished sequences into their workers and release
+        their slots for reuse, so a long run never fills status board."""
+        if not self.board: return
+        for worker in self.worker_list:
+            for index in list(worker['SLOTS']):
+                values = self.board.release(index)
+                if values is None: continue
+                worker['SLOTS'].remove(index)
+                worker['SUCCESS_LOOPS'] += int(values['PASS'])
+                worker['FAILURE_LOOPS'] += int(values['FAIL'])
+                if not worker['SLOTS'] and not worker['PIDS']:
+                    worker['STATUS'] = status.STATE_NAMES[int(values['STATE'])]
+    
+    def worker_counts(self, worker):
+        """Loop counts of worker, counted by messages and in its status slots,
+        return (success loops, failure loops, status of latest slot)."""
+        success_loops = worker['SUCCESS_LOOPS']
+        failure_loops = worker['FAILURE_LOOPS']
+        latest = None
+        for index in worker['SLOTS']:
+            latest = self.board.slot(index).read()
+            success_loops += int(latest['PASS'])
+            failure_loops += int(latest['FAIL'])
+        return success_loops, failure_loops, latest
+    
+    def worker_state(self, worker):
+        """State of worker, by its status slots, or by its messages if it has none."""
+        if not worker['SLOTS']: return worker['STATUS']
+        states = [self.board.slot(index).state for index in worker['SLOTS']]
+        for state in (status.RUNNING, status.WAITING, status.QUEUED, status.CRASHED):
+            if state in states: return status.STATE_NAMES[state]
+        return 'COMPLETED'
+    
     @property
     def some_worker_running(self):
-        return any(w['STATUS'] == 'RUNNING' for w in self.worker_list)
+        # sequences queued by workers are active before master gets their messages
+        if self.board and self.board.active_slots(): return True
+        return any(w['STATUS'] == 'RUNNING' and not w['SLOTS'] for w in self.worker_list)
 
 
 # ************PROGRAM MAIN ENTRY****************
 def start_master(entry_sequence_file, entry_running_loops=1):
-    global UNIX_DOMAIN_SOCKET
+    global UNIX_DOMAIN_SOCKET, STATUS_BOARD, JOB_QUEUE
     UNIX_DOMAIN_SOCKET = utils.new_uds_name(entry_sequence_file)
     # A shared memory variable, a window display controller which can be set by all workers.
     global_display_control = Value('b', 1)
-    master = Master(init_sequence_file=entry_sequence_file)
-    # start first sequence worker
-    worker = Process(target=run_sequence_worker, args=(global_display_control,
-                                                       entry_sequence_file,
-                                                       entry_running_loops,))
-    #worker.daemon = True
-    worker.start()
-    worker_name = entry_sequence_file.split('.')[0]
+    # Shared memory status slots and sequence job queue, pool workers inherit them
+    STATUS_BOARD = StatusBoard()
+    JOB_QUEUE = SimpleQueue()
+    if async_hubs:
+        # sequences run as tasks of hubs, waits don't hold a process
+        pool = WorkerPool(global_display_control, size=async_hubs, target=run_hub_worker, grow=False)
+    else:
+        pool = WorkerPool(global_display_control)
+    master = Master(init_sequence_file=entry_sequence_file, board=STATUS_BOARD, pool=pool)
+    master.maintain_pool()
+    # queue first sequence
+    slot = STATUS_BOARD.allocate(entry_running_loops, state=status.QUEUED)
+    submit_sequence(entry_sequence_file, entry_running_loops, slot)
     message = {'MSG': Messages.SEQUENCE_RUNNING_START.value,
-               'NAME': worker_name,
-               'LOOPS': entry_running_loops}
+               'NAME': entry_sequence_file.split('.')[0],
+               'LOOPS': entry_running_loops,
+               'SLOT': slot.index}
     master.update_worker_status(message)
     t_start_prog = time.time()
-    # window message display
+    t_refresh = 0
+    # redraws changed lines only, or prints compact lines if stdout is not a terminal
+    renderer = cursor.FrameRenderer()
+    # window message display, worker messages are handled as they arrive and
+    # window is redrawn every refresh interval
     while global_display_control.value > 0:
-        master.update_worker_status(master.recv_ipc_msg())
-
-        window_header = newline + newline + 'RUNNING WORKERS: %d ' %(len(master.worker_list)) + newline
-        time_consume = str(datetime.timedelta(seconds=int(time.time()-t_start_prog)))
-        window_display = window_header + 'TIME CONSUME: %s' %(time_consume) + newline + newline
-        cursor_lines = 5
+        # wake up at least every second to check display control set by workers
+        master.poll(max(min(t_refresh - time.time(), 1.0), 0))
+        master.collect_slots()
+        master.maintain_pool()
+        finished = not master.some_worker_running
         # quit everything if all test workers finish
-        if not master.some_worker_running:
+        if finished:
             # handle all messages in buffer
-            while master.update_worker_status(master.recv_ipc_msg()):
+            while master.poll(0):
                 pass
-            if master.ipc_sock: master.ipc_sock.close()
             global_display_control.value = 0
+            pool.close()
+            master.close_ipc()
+        if not finished and time.time() < t_refresh: continue
 
+        time_consume = str(datetime.timedelta(seconds=int(time.time()-t_start_prog)))
+        window_header = ['', '', 'RUNNING WORKERS: %d ' %(len(master.worker_list)), 'TIME CONSUME: %s' %(time_consume), '']
+        window_rows = []
+        states = {}
+        total_success = total_failure = 0
         # update window display
         for worker in master.worker_list:
-            success_loops = worker['SUCCESS_LOOPS']
-            failure_loops = worker['FAILURE_LOOPS']
-            window_display = window_display + \
-                '* Worker [%s]: %d total loops, %d loops PASS, %d loops FAIL ...' %(worker['NAME'],
-                                                                                    worker['TOTAL_LOOPS'],
-                                                                                    success_loops,
-                                                                                    failure_loops) + newline
-            cursor_lines += 1
-
-        # print window display lines
-        sys.stdout.write(window_display)
-        sys.stdout.flush()
-        time.sleep(window_refresh_interval)
-        # to avoid to much system cost
-        if global_display_control.value > 0:
-            cursor.erase_lines_upward(cursor_lines)
+            success_loops, failure_loops, latest = master.worker_counts(worker)
+            state = master.worker_state(worker)
+            states[state] = states.get(state, 0) + 1
+            total_success += success_loops
+            total_failure += failure_loops
+            progress = ''
+            if state in ('QUEUED', 'WAITING'):
+                progress = ' %s' %(state.lower())
+            elif latest and state == 'RUNNING':
+                progress = ' loop %d line %d' %(latest['LOOP'], latest['LINE']+1)
+                idle = time.time() - latest['HEARTBEAT']
+                if idle >= window_refresh_interval: progress += ', idle %ds' %(idle)
+            window_rows.append('* Worker [%s]: %d total loops, %d loops PASS, %d loops FAIL ...%s' %(worker['NAME'],
+                                                                                                   worker['TOTAL_LOOPS'],
+                                                                                                   success_loops,
+                                                                                                   failure_loops,
+                                                                                                   progress))
+        compact = 'TIME CONSUME: %s, WORKERS: %d (%s), %d loops PASS, %d loops FAIL' \
+            %(time_consume, len(master.worker_list), ', '.join('%d %s' %(n, state.lower()) for state, n in sorted(states.items())),
+              total_success, total_failure)
+
+        # export metrics for dashboards
+        if master.metrics: master.metrics.write_prometheus(master.metrics_path)
+        renderer.render(window_header, window_rows, compact)
+        t_refresh = time.time() + window_refresh_interval
 
     window_summary_display = newline + 'RESULT SUMMARY:' + newline + newline
     for worker in master.worker_list:
-        success_loops = worker['SUCCESS_LOOPS']
-        failure_loops = worker['FAILURE_LOOPS']
+        success_loops, failure_loops, latest = master.worker_counts(worker)
         window_summary_display = newline + window_summary_display + \
             '* Sequence [%s]>> Total loops: %d, %d loops PASSED, %d loops FAILED' %(worker['NAME'],
                                                                                      success_loops+failure_loops,
@@ -588,6 +1352,14 @@ def start_master(entry_sequence_file, entry_running_loops=1):
         window_summary_display += newline
 
     sys.stdout.write(window_summary_display)
+    latency_summary = master.metrics.quantile_summary()
+    if latency_summary:
+        sys.stdout.write(newline + 'COMMAND LATENCY (p50 / p95 / p99 sec):' + newline + latency_summary + newline)
+        master.metrics.write_prometheus(master.metrics_path)
+        queue_summary = master.metrics.quantile_summary(name='ucs_queue_wait_seconds')
+        if queue_summary:
+            sys.stdout.write(newline + 'QUEUE WAIT (p50 / p95 / p99 sec):' + newline + queue_summary + newline)
+        sys.stdout.write(newline + 'Metrics exported to: %s' %(master.metrics_path) + newline)
     sys.stdout.write(newline)
     sys.stdout.write('Failure log dumped to: %s' %(master.failure_logfile.name if master.failure_logfile else 'NONE'))
     sys.stdout.write(newline + newline)
@@ -595,6 +1367,7 @@ def start_master(entry_sequence_file, entry_running_loops=1):
     if master.failure_logfile and not master.failure_logfile.closed:
         master.failure_logfile.flush()
         master.failure_logfile.close()
+    STATUS_BOARD.close()
     # Remove unix domain sock file
     if UNIX_DOMAIN_SOCKET: os.remove(UNIX_DOMAIN_SOCKET)
 
@@ -0,0 +1,40 @@
+import os
+import asyncio
+import tempfile
+
+import simulator
+from agent import UCSAgentWrapper
+from asyncagent import AsyncUCSAgent
+
+
+COMMANDS = [{'action': 'CONNECT', 'command': 'connect host'},
+            {'action': 'SEND', 'command': 'echo ok'},
+            {'action': 'SEND', 'command': 'dump 3000', 'timeout': 5}]
+
+
+def test_async_agent_runs_same_steps(monkeypatch):
+    shims = simulator.install_shims(tempfile.mkdtemp(prefix='ucs_test_'), ['--latency', '0'])
+    monkeypatch.setenv('PATH', shims + os.pathsep + os.environ['PATH'])
+
+    agent = UCSAgentWrapper()
+    try:
+        outputs = [agent.run_cmd(**command) for command in COMMANDS]
+        prompt = agent.prompt
+        agent.quit()
+        assert agent.pty is None
+    finally:
+        agent.close_pty()
+
+    async def run_async():
+        agent = AsyncUCSAgent()
+        try:
+            outputs = [await agent.run_cmd(**command) for command in COMMANDS]
+            assert agent.prompt == prompt
+            await agent.quit()
+            assert agent.pty is None
+            return outputs
+        finally:
+            await agent.close_pty()
+
+    assert asyncio.run(run_async()) == outputs
+    assert outputs[2].count('PASS') == len(simulator.Simulator().dump(3000).splitlines())
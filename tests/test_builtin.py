@@ -0,0 +1,51 @@
+import re
+
+import pytest
+
+from builtin import COMMAND_ACTION_MAPPING, keyword_pattern, match_builtin_command
+
+
+def search_one_by_one(mapping, word):
+    """Keyword dispatch of sequences before keywords were combined, last pattern found wins."""
+    found = None
+    for pattern, action in mapping.items():
+        if re.search(pattern, word): found = action
+    return found
+
+
+def combined(mapping, word):
+    pattern, actions = keyword_pattern(mapping)
+    match = pattern.match(word)
+    return actions[match.lastgroup] if match else None
+
+
+@pytest.mark.parametrize('word, action', [
+    ('RUN-SEQUENCE', 'NEW_WORKER'),
+    ('RUN_SEQUENCE-WAIT', 'NEW_WORKER'),
+    ('END-SUBSEQUENCE', 'SUBSEQUENCE'),
+    ('SUBSEQUENCE', 'SUBSEQUENCE'),
+    ('END-PULSE', 'INTR'),
+    ('CTRL-C', 'INTR'),
+    ('ctrl-x', 'QUIT'),
+    ('exit', 'QUIT'),
+    ('LOOP', 'LOOP'),
+    ('xDEFAULT1', 'SEND'),
+    ('echo', None),
+    ('LOOPS', None),
+])
+def test_builtin_keyword_dispatch(word, action):
+    assert match_builtin_command(word) == action
+    assert match_builtin_command.__wrapped__(word) == search_one_by_one(COMMAND_ACTION_MAPPING, word)
+
+
+def test_overlapping_keywords_last_found_wins():
+    overlapping = {r'^RUN': 'FIRST', r'^RUN.SEQUENCE$': 'SECOND', r'X$': 'THIRD'}
+    assert combined(overlapping, 'RUN-SEQUENCE') == 'SECOND'
+    assert combined(overlapping, 'RUN-X') == 'THIRD'
+    assert combined(overlapping, 'RUNNER') == 'FIRST'
+    # a later pattern found further in word still wins over an earlier one at word start
+    apart = {r'^Y': 'FIRST', r'X$': 'SECOND'}
+    assert combined(apart, 'YX') == 'SECOND'
+    for mapping in (overlapping, apart):
+        for word in ('RUN-SEQUENCE', 'RUN-X', 'RUNNER', 'YX', 'Y', 'none'):
+            assert combined(mapping, word) == search_one_by_one(mapping, word)
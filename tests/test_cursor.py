@@ -0,0 +1,37 @@
+import io
+
+from cursor import FrameRenderer, CURSOR_CONTROL, ERASE_LINE
+
+
+class Renderer(FrameRenderer):
+    def size(self):
+        return 24, 80
+
+
+def test_non_tty_output_is_written_as_compact_lines():
+    stream = io.StringIO()
+    renderer = Renderer(stream)
+    assert not renderer.interactive
+    renderer.render(['header'], ['a 1', 'b 1'], compact='a 1, b 1')
+    renderer.render(['header'], ['a 1', 'b 2'], compact='a 1, b 2')
+    assert stream.getvalue() == 'a 1, b 1\na 1, b 2\n'
+
+
+def test_redraw_rewrites_changed_lines_only():
+    stream = io.StringIO()
+    renderer = Renderer(stream, interactive=True)
+    renderer.render(['header'], ['a 1', 'b 1', 'c 1'])
+    assert stream.getvalue() == ''.join(ERASE_LINE + x + '\n' for x in ('header', 'a 1', 'b 1', 'c 1'))
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render(['header'], ['a 1', 'b 2', 'c 1'])
+    # back to first line, skip two unchanged lines, rewrite one, skip the last
+    assert stream.getvalue() == '\r' + CURSOR_CONTROL + '4A' + CURSOR_CONTROL + '2B' + \
+        ERASE_LINE + 'b 2\n' + CURSOR_CONTROL + '1B'
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render(['header'], ['a 1'])
+    # shorter frame erases lines left of previous one
+    assert stream.getvalue() == '\r' + CURSOR_CONTROL + '4A' + CURSOR_CONTROL + '2B' + \
+        (ERASE_LINE + CURSOR_CONTROL + '1B')*2 + CURSOR_CONTROL + '2A'
+    assert renderer.lines == ['header', 'a 1']
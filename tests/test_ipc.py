@@ -0,0 +1,53 @@
+import os
+import socket
+import tempfile
+import threading
+
+from ipc import IpcClient, FrameReader
+
+
+def recv_frames(conn, reader, limit=None):
+    """Read messages of a connection until it's closed or ``limit`` bytes are read."""
+    messages = []
+    received = 0
+    while limit is None or received < limit:
+        data = conn.recv(4096 if limit is None else min(4096, limit - received))
+        if not data: break
+        received += len(data)
+        messages.extend(reader.feed(data))
+    return messages
+
+
+def test_batch_resent_after_master_closes_is_read_once():
+    path = os.path.join(tempfile.mkdtemp(prefix='ucs_test_'), 'ipc.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(4)
+    listener.settimeout(10)
+    seen = {}
+    # one batch far larger than socket buffers, so sending it is cut by close
+    client = IpcClient(path, queue_limit=4096, batch_interval=0.5)
+    count = 3000
+    try:
+        for i in range(count): client.send({'seq': i, 'data': 'x'*1000})
+        conn, _ = listener.accept()
+        conn.settimeout(10)
+        reader = FrameReader(seen)
+        messages = recv_frames(conn, reader, limit=200*1024)
+        conn.close()
+        assert 0 < len(messages) < count
+        conn, _ = listener.accept()
+        conn.settimeout(10)
+        reader = FrameReader(seen)
+        # client closes the connection once the whole batch is sent
+        thread = threading.Thread(target=client.close)
+        thread.start()
+        messages += recv_frames(conn, reader)
+        thread.join(10)
+        conn.close()
+        assert client.reconnects >= 1
+        assert reader.duplicates > 0
+        assert [x['seq'] for x in messages] == list(range(count))
+    finally:
+        client.close()
+        listener.close()
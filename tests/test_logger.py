@@ -0,0 +1,91 @@
+import os
+import errno
+import io
+import threading
+
+from logger import LogWriter, LogSegments
+
+
+class FailingFile(io.StringIO):
+    """Log file failing every write after ``ok_writes`` writes."""
+    def __init__(self, ok_writes=0):
+        super().__init__()
+        self.name = 'failing.log'
+        self.ok_writes = ok_writes
+
+    def write(self, data):
+        if self.ok_writes <= 0: raise OSError(errno.ENOSPC, 'No space left on device')
+        self.ok_writes -= 1
+        return super().write(data)
+
+    def fileno(self):
+        raise OSError(errno.EIO, 'Input/output error')
+
+
+def run_with_timeout(func, timeout=5):
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_flush_and_close_return_when_write_fails():
+    writer = LogWriter(FailingFile())
+    writer.write('line one\n')
+    assert run_with_timeout(writer.flush)
+    assert isinstance(writer.error, OSError) and writer.error.errno == errno.ENOSPC
+    assert writer.dropped_bytes == len('line one\n')
+    writer.write('line two\n')
+    assert writer.dropped_bytes == 2*len('line one\n')
+    assert run_with_timeout(lambda: writer.flush(durable=True))
+    assert run_with_timeout(writer.close)
+    assert writer.closed and 'No space left' in repr(writer)
+
+
+def test_durable_flush_returns_when_fsync_fails():
+    logfile = FailingFile(ok_writes=10)
+    writer = LogWriter(logfile)
+    writer.write('data\n')
+    assert run_with_timeout(writer.flush)
+    assert writer.error is None and logfile.getvalue() == 'data\n'
+    writer.write('more\n')
+    assert run_with_timeout(lambda: writer.flush(durable=True))
+    assert writer.error.errno == errno.EIO
+    assert run_with_timeout(writer.close)
+
+
+def read_index(segments):
+    with open(segments.index_path) as fp:
+        return [line.split() for line in fp.read().splitlines()[1:]]
+
+
+def test_log_segments_kept_by_default(tmp_path):
+    segments = LogSegments(str(tmp_path / 'seq.log'), compression=None, rotate_loops=1)
+    for loop in range(1, 6):
+        segments.start_loop(loop)
+        segments.write('loop %d\n' %(loop))
+    segments.close()
+    index = read_index(segments)
+    assert len(index) == 5 and not any('removed' in x for x in index)
+    assert all(os.path.exists(str(tmp_path / x[0])) for x in index)
+
+
+def test_log_segments_pruned_when_enabled(tmp_path):
+    segments = LogSegments(str(tmp_path / 'seq.log'), compression=None, rotate_loops=1, keep_segments=2)
+    for loop in range(1, 6):
+        segments.start_loop(loop)
+        segments.write('loop %d\n' %(loop))
+    segments.close()
+    index = read_index(segments)
+    assert [x[-1] == 'removed' for x in index] == [True, True, True, False, False]
+    assert sorted(os.listdir(str(tmp_path))) == sorted([x[0] for x in index[-2:]] + ['seq.index'])
+
+
+def test_log_index_current_before_close(tmp_path):
+    segments = LogSegments(str(tmp_path / 'seq.log'), compression=None, rotate_loops=2)
+    assert read_index(segments) == [['seq.000.log', '0', '0']]
+    for loop in range(1, 4):
+        segments.start_loop(loop)
+    # index lists the segment just opened and loops started, without close
+    assert read_index(segments) == [['seq.000.log', '1', '2'], ['seq.001.log', '3', '3']]
+    segments.close()
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import tempfile
+
+import pytest
+
+import ptyprocess
+import simulator
+from agent import UCSAgentWrapper
+
+
+PROMPT = b'PROMPT> '
+
+
+def spawn_write(data):
+    """Child writing ``data`` in one write, then waiting."""
+    code = 'import os, time; os.write(1, %r); time.sleep(5)' %(data)
+    return ptyprocess.PtyProcess.spawn([sys.executable, '-c', code])
+
+
+def spawn_burst(size):
+    """Child writing ``size`` bytes and prompt in one write, then waiting."""
+    return spawn_write(b'x'*size + PROMPT)
+
+
+@pytest.mark.parametrize('size', [1500, 3000, 7000])
+def test_burst_below_reader_buffer_is_not_stranded(size):
+    # output between 1 and 8 KiB in a single write used to stay in the hidden
+    # BufferedReader buffer, with the fd no longer readable
+    pty = spawn_burst(size)
+    try:
+        data = b''
+        t_end = time.time() + 5
+        while not data.endswith(PROMPT) and time.time() < t_end:
+            assert pty.wait_readable(t_end - time.time())
+            data += pty.read_available()
+        assert data == b'x'*size + PROMPT
+        assert not pty.wait_readable(0.2)
+    finally:
+        pty.terminate(force=True)
+
+
+def test_read_after_read_available_sees_rest():
+    pty = spawn_burst(3000)
+    try:
+        assert pty.wait_readable(5)
+        data = pty.read(1024)
+        t_end = time.time() + 5
+        while not data.endswith(PROMPT) and time.time() < t_end:
+            assert pty.wait_readable(t_end - time.time())
+            data += pty.read_available()
+        assert data == b'x'*3000 + PROMPT
+    finally:
+        pty.terminate(force=True)
+
+
+def test_agent_command_with_burst_output(monkeypatch):
+    shims = simulator.install_shims(tempfile.mkdtemp(prefix='ucs_test_'), ['--latency', '0'])
+    monkeypatch.setenv('PATH', shims + os.pathsep + os.environ['PATH'])
+    agent = UCSAgentWrapper()
+    try:
+        agent.run_cmd(action='CONNECT', command='connect host')
+        t_start = time.time()
+        output = agent.run_cmd(action='SEND', command='dump 3000', timeout=5)
+        assert time.time() - t_start < 2
+        assert output.count('PASS') == len(simulator.Simulator().dump(3000).splitlines())
+    finally:
+        agent.close_pty()
+
+
+def test_readline_keeps_rest_in_receive_buffer():
+    pty = spawn_write(b'first\nsecond\n' + PROMPT)
+    try:
+        assert pty.readline() == b'first\r\n'
+        assert pty.readline() == b'second\r\n'
+        assert pty.read_available() == PROMPT
+        assert not pty.wait_readable(0.2)
+    finally:
+        pty.terminate(force=True)
+
+
+def test_agent_read_until_large_output(monkeypatch):
+    shims = simulator.install_shims(tempfile.mkdtemp(prefix='ucs_test_'), ['--latency', '0'])
+    monkeypatch.setenv('PATH', shims + os.pathsep + os.environ['PATH'])
+    agent = UCSAgentWrapper()
+    try:
+        agent.run_cmd(action='CONNECT', command='connect host')
+        agent._send_all('dump 4000000' + agent.pty_linesep)
+        t_start = time.time()
+        output = agent.read_until(agent.prompt, 30)
+        assert time.time() - t_start < 10
+        assert output.count('PASS') == len(simulator.Simulator().dump(4000000).splitlines())
+    finally:
+        agent.close_pty()
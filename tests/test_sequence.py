@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+import sequence
+from utils import SequenceError
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """Count sequence files compiled, instead of loaded from cache."""
+    compiled = []
+    compile = sequence.sequence_compile
+    def counting(sequence_file):
+        compiled.append(sequence_file)
+        return compile(sequence_file)
+    monkeypatch.setattr(sequence, 'sequence_compile', counting)
+    return compiled
+
+
+def write_sequence(path, text, mtime_ns=None):
+    with open(path, mode='w') as fp:
+        fp.write(text)
+    if mtime_ns is not None: os.utime(path, ns=(mtime_ns, mtime_ns))
+    return os.stat(path)
+
+
+def read_commands(path):
+    commands, marks = sequence.sequence_read(path, os.stat(path))
+    return [command.command for command in commands]
+
+
+def test_cache_used_while_file_unchanged(tmp_path, compiles):
+    path = str(tmp_path / 'main.seq')
+    write_sequence(path, 'echo aaa\necho bbb\n')
+    assert read_commands(path) == ['echo aaa', 'echo bbb']
+    assert os.path.exists(sequence.sequence_cache_path(path))
+    assert read_commands(path) == ['echo aaa', 'echo bbb']
+    assert compiles == [path]
+
+
+def test_cache_kept_when_only_mtime_changes(tmp_path, compiles):
+    path = str(tmp_path / 'main.seq')
+    stat = write_sequence(path, 'echo aaa\n')
+    read_commands(path)
+    # touched file with same text is checked by sha256, and cache refreshed with new mtime
+    os.utime(path, ns=(stat.st_mtime_ns + 10**9, stat.st_mtime_ns + 10**9))
+    assert read_commands(path) == ['echo aaa']
+    assert sequence.sequence_load(path, os.stat(path))[2] is None
+    assert compiles == [path]
+
+
+def test_cache_dropped_when_size_changes(tmp_path, compiles):
+    path = str(tmp_path / 'main.seq')
+    stat = write_sequence(path, 'echo aaa\n')
+    read_commands(path)
+    write_sequence(path, 'echo aaa\necho ccc\n', mtime_ns=stat.st_mtime_ns)
+    assert read_commands(path) == ['echo aaa', 'echo ccc']
+    assert compiles == [path, path]
+
+
+def test_cache_dropped_when_text_hash_changes(tmp_path, compiles):
+    path = str(tmp_path / 'main.seq')
+    stat = write_sequence(path, 'echo aaa\n')
+    read_commands(path)
+    # same size, new mtime, text differs
+    write_sequence(path, 'echo bbb\n', mtime_ns=stat.st_mtime_ns + 10**9)
+    assert read_commands(path) == ['echo bbb']
+    assert compiles == [path, path]
+    assert read_commands(path) == ['echo bbb']
+    assert compiles == [path, path]
+
+
+def test_stale_cache_of_other_parser_settings_dropped(tmp_path, compiles, monkeypatch):
+    path = str(tmp_path / 'main.seq')
+    write_sequence(path, 'echo aaa\n')
+    read_commands(path)
+    monkeypatch.setattr(sequence, 'SEQUENCE_CACHE_MAGIC', 'UCSSEQ-other')
+    assert read_commands(path) == ['echo aaa']
+    assert compiles == [path, path]
+
+
+def test_undefined_loop_reported_with_file_and_line(tmp_path):
+    path = str(tmp_path / 'main.seq')
+    write_sequence(path, '# header\necho a ; \\\nPROMPT\nLOOP nothere 2\n')
+    with pytest.raises(SequenceError) as err:
+        sequence.sequence_preflight(path)
+    assert str(err.value) == '%s:4: LOOP of undefined subsequence: nothere' %(path)
+
+
+def test_loop_cycle_reported_with_file_and_line(tmp_path):
+    path = str(tmp_path / 'main.seq')
+    write_sequence(path, '\n'.join(['SUBSEQUENCE a',
+                                    'echo a',
+                                    'LOOP b',
+                                    'END-SUBSEQUENCE a',
+                                    'SUBSEQUENCE b',
+                                    'LOOP a 2',
+                                    'END-SUBSEQUENCE b',
+                                    'LOOP a 1']) + '\n')
+    with pytest.raises(SequenceError) as err:
+        sequence.sequence_preflight(path)
+    assert str(err.value) == '%s:6: LOOP never ends: a -> b -> a' %(path)
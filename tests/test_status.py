@@ -0,0 +1,61 @@
+import sys
+import subprocess
+
+import pytest
+
+import status
+from status import StatusBoard
+
+
+@pytest.fixture
+def board():
+    board = StatusBoard(slots=4)
+    yield board
+    board.close()
+
+
+def test_slot_reuse_bumps_generation(board):
+    slot = board.allocate(total_loops=2)
+    assert slot.index == 0 and slot.generation == 1 and slot.state == status.RUNNING
+    slot.add(status.PASS, 2)
+    assert slot.transition((status.RUNNING,), status.COMPLETED)
+    # sequence run again by its caller keeps its slot and counters
+    assert board.reuse(slot, total_loops=3)
+    assert slot.state == status.RUNNING
+    assert slot.read()['TOTAL_LOOPS'] == 5 and slot.read()['PASS'] == 2
+    assert slot.transition((status.RUNNING,), status.COMPLETED)
+    assert board.release(slot.index)['PASS'] == 2
+    assert board.release(slot.index) is None
+    # released slot is allocated again with a new generation, stale handles see it FREE
+    again = board.allocate(total_loops=1)
+    assert again.index == slot.index and again.generation == slot.generation + 1
+    assert again.read()['PASS'] == 0
+    assert slot.state == status.FREE and again.state == status.RUNNING
+    assert not slot.transition((status.RUNNING,), status.COMPLETED)
+    assert not board.reuse(slot)
+    assert board.slot(slot.index, slot.generation).state == status.FREE
+    assert board.slot(slot.index).state == status.RUNNING
+
+
+def test_cancel_queued_slot_kills_nothing(board):
+    slot = board.allocate(state=status.QUEUED)
+    board.cancel(slot)
+    assert slot.state == status.CANCELLED
+    assert not slot.transition((status.QUEUED,), status.RUNNING)
+
+
+def test_cancel_kills_pool_worker_of_slot(board):
+    # in pool mode slot PID is the pool worker running the sequence
+    pool_worker = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        slot = board.allocate(state=status.QUEUED)
+        assert slot.transition((status.QUEUED,), status.RUNNING)
+        slot.set(status.PID, pool_worker.pid)
+        board.cancel(slot)
+        assert slot.state == status.CANCELLED
+        assert pool_worker.wait(5) == -9
+        # a finished slot is not cancelled again
+        board.cancel(slot)
+        assert slot.state == status.CANCELLED
+    finally:
+        if pool_worker.poll() is None: pool_worker.kill()
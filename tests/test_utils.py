@@ -0,0 +1,103 @@
+import mmap
+import tempfile
+import tracemalloc
+
+import pytest
+
+from utils import OutputMatcher, OutputCapture, EscapeWatcher, SequenceError, compile_pattern, check_pattern, in_search
+from sequence import sequence_escape_parser
+
+
+def test_escape_backreference_after_other_escapes():
+    # combined alternation renumbers groups, a backreference must keep its own
+    matcher = OutputMatcher(escapes=['PANIC', 'fatal', r'(\w+) \1 again'])
+    match = matcher.find_escape('line\nerr err again\n')
+    assert match is not None and match.pattern == r'(\w+) \1 again'
+    assert matcher.find_escape('line\nerr ok again\n') is None
+
+
+def test_escape_named_backreference():
+    matcher = OutputMatcher(escapes=['PANIC', r'(?P<w>\d+)-(?P=w)'])
+    assert matcher.find_escape('code 12-12').pattern == r'(?P<w>\d+)-(?P=w)'
+    assert matcher.find_escape('code 12-13') is None
+
+
+def test_earliest_escape_wins_across_standalone_and_combined():
+    matcher = OutputMatcher(escapes=['later', r'(\d)\1'])
+    assert matcher.find_escape('11 later').pattern == r'(\d)\1'
+    assert matcher.find_escape('later 11').pattern == 'later'
+
+
+def test_expect_anchor_matches_at_previous_expect_end():
+    # expects are searched in the output after the previous expect, like slicing it
+    matcher = OutputMatcher(expects=['abc', '^def'])
+    assert matcher.find_missing_expect('xx abcdef') is None
+    missing = matcher.find_missing_expect('xx abc def')
+    assert missing is not None and missing.pattern == '^def' and missing.start == 6
+
+
+def test_escape_anchor_at_search_start():
+    matcher = OutputMatcher(escapes=['PANIC', r'^Error'])
+    assert matcher.find_escape('xx Error', 3).start == 3
+    assert matcher.find_escape('xx Error') is None
+
+
+def test_binary_matcher_on_mmap():
+    matcher = OutputMatcher(expects=['abc', '^def'], escapes=['PANIC', r'(\w)\1!']).binary()
+    with tempfile.TemporaryFile() as fp:
+        fp.write(b'abcdef zz!\n')
+        fp.flush()
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            assert matcher.find_missing_expect(buf) is None
+            assert matcher.find_escape(buf).start == 7
+
+
+def test_escape_watcher_with_backreference():
+    watcher = EscapeWatcher(OutputMatcher(escapes=['PANIC', r'(\w)\1\1']))
+    assert watcher.feed('ok\nab') is None
+    match, line = watcher.feed('bb\n')
+    assert match.pattern == r'(\w)\1\1' and line == 2
+
+
+def test_literal_pattern_fast_path():
+    # patterns without regex metacharacters are matched as text, case-insensitively
+    assert compile_pattern('Test PASS').literal
+    assert compile_pattern('Test PASS').find is None
+    assert in_search('test pass', 'x Test PASS y')
+    assert in_search('Test PASS', 'x Test PASS y', do_find=True) == 2
+    assert not compile_pattern('PASS.*done').literal
+    assert in_search('PASS.*done', 'PASS all done')
+
+
+def test_invalid_regex_rejected_at_parse():
+    # any metacharacter makes a regex, literal text has to escape them
+    with pytest.raises(SequenceError):
+        check_pattern('Error: [')
+    with pytest.raises(SequenceError):
+        sequence_escape_parser('PANIC, Error: [')
+    check_pattern(r'Error: \[')
+    assert in_search(r'Error: \[', 'Error: [disk]')
+
+
+def test_standalone_escape_on_spilled_output_keeps_memory_bounded():
+    # standalone escapes are searched in place, not in a slice copied out of the mmap
+    capture = OutputCapture(threshold=64*1024)
+    line = 'Test 000000  memory pattern walk ....... PASS\n'
+    for _ in range(8*1024*1024//len(line)): capture.write(line)
+    capture.write('ERROR: walk\nFAIL 1\n')
+    matcher = OutputMatcher(expects=['PASS', '^FAIL'], escapes=['PANIC', r'^FAIL', r'\bERROR\b']).binary()
+    try:
+        buf = capture.buffer()
+        assert capture.spilled
+        tracemalloc.start()
+        try:
+            escaped = matcher.find_escape(buf)
+            missing = matcher.find_missing_expect(buf)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert escaped.pattern == r'\bERROR\b' and buf[escaped.start:escaped.end] == b'ERROR'
+        assert missing is None
+        assert peak < 64*1024
+    finally:
+        capture.close()